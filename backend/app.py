@@ -1,13 +1,32 @@
 # backend/app.py - CLEAN PRODUCTION VERSION
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 import serial
 import time
 import os
-import threading
-import re
 import logging
-import serial.tools.list_ports
+import functools
+import zlib
+
+from werkzeug.utils import secure_filename
+
+from upload_pipeline import (analysis_is_current, analyze_file, compress_at_rest, forget_cached_analyses,
+                             save_upload_stream)
+from command_filter import CommandFilter, active_filter, set_active_filter
+from gcode_storage import OUTPUT_CHUNK, compression_for, compression_supported, is_gcode_filename, open_gcode
+from chunked_upload import ChunkedUploadManager, MAX_CHUNK_SIZE
+from file_catalog import FileCatalog
+from blob_store import BlobStore
+from printer_registry import DEFAULT_PRINTER, PrinterRegistry
+from printer_session import JOB_STATES, STREAMER_MODES
+from job_queue import JobQueue, JobScheduler
+from job_placement import PlacementEngine
+from port_detect import PortDetector
+from port_inventory import PortInventory
+from serial_owner import acquire_serial_ownership
+from hot_log import start_queue_logging
+from serial_recorder import set_capture_dir
+from stream_metrics import BackendMetrics
 
 app = Flask(__name__)
 CORS(app)
@@ -15,54 +34,201 @@ CORS(app)
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+start_queue_logging()  # handlers run on a listener thread, never on a print streamer
 
 # --- Setup ---
 UPLOADS_DIR = 'uploads'
 if not os.path.exists(UPLOADS_DIR):
     os.makedirs(UPLOADS_DIR)
-
-# --- Global State ---
-printer = None
-print_thread = None
-IS_PRINTING = False
-IS_PAUSED = False
-PRINT_PROGRESS = 0
-TOTAL_LINES = 0
-CURRENT_FILE = ""
-PRINT_ERROR = None
-
-# --- Helper Functions ---
-def get_printer_response():
-    lines = []
-    if printer and printer.is_open:
-        while printer.in_waiting > 0:
-            try:
-                line = printer.readline().decode('utf-8', errors='ignore').strip()
-                if line: 
-                    lines.append(line)
-            except Exception as e:
-                logger.warning(f"Error reading printer response: {e}")
-                break
-    return lines
+COMPRESS_UPLOADS_AT_REST = None  # 'gzip' or 'zstd' to store plain .gcode uploads compressed
+chunked_uploads = ChunkedUploadManager(UPLOADS_DIR)
+blob_store = BlobStore(UPLOADS_DIR)
+file_catalog = FileCatalog(UPLOADS_DIR, blob_store)
+file_catalog.start()
+# Commands dropped or rewritten in print jobs (none unless configured through /api/command-filter)
+COMMAND_FILTER_PATH = os.path.join(UPLOADS_DIR, '.command-filter.json')
+set_active_filter(CommandFilter.load(COMMAND_FILTER_PATH, default=active_filter()))
+# Every printer connection's serial traffic is captured here (see serial_replay.py)
+set_capture_dir(os.path.join(UPLOADS_DIR, 'captures'))
+
+# --- Printers ---
+# Exactly one process drives the serial ports; others (e.g. extra WSGI workers) refuse printer requests
+SERIAL_OWNER, SERIAL_OWNER_PID = acquire_serial_ownership(os.path.join(UPLOADS_DIR, '.serial-owner.lock'))
+if not SERIAL_OWNER:
+    logger.warning(f"Serial ports are owned by process {SERIAL_OWNER_PID}; printer routes disabled here")
+printers = PrinterRegistry()
+job_queue = JobQueue(os.path.join(UPLOADS_DIR, '.jobs.db'))
+job_placement = PlacementEngine(job_queue, printers, file_catalog)
+job_scheduler = JobScheduler(job_queue, printers, UPLOADS_DIR, planner=job_placement)
+port_detector = PortDetector(os.path.join(UPLOADS_DIR, '.port-cache.json'))
+port_inventory = PortInventory(os.path.join(UPLOADS_DIR, '.port-identities.json'))
+port_inventory.start()
+if SERIAL_OWNER:
+    job_scheduler.start()
+
+def with_printer(view):
+    """Resolve the <printer_id> URL part (or the legacy default) to its PrinterSession"""
+    @functools.wraps(view)
+    def wrapper(printer_id, **kwargs):
+        if not SERIAL_OWNER:
+            return jsonify(status='error', message=f'Printers are served by process {SERIAL_OWNER_PID}; '
+                                                   'run a single backend process (see serve.py)'), 503
+        session = printers.get(printer_id)
+        if session is None:
+            return jsonify(status='error', message=f'Unknown printer: {printer_id}'), 404
+        return view(session, **kwargs)
+    return wrapper
+
+# --- Printer Registry API ---
+@app.route('/api/printers', methods=['GET'])
+def list_printers():
+    return jsonify(status='success', printers=[session.summary() for session in printers.all()])
+
+@app.route('/api/printers', methods=['POST'])
+def add_printer():
+    """
+    Registers a printer: {id, name, streamer, cpu} (all but id optional). streamer 'process'
+    runs its serial streamer in a dedicated process, pinned to cpu when given.
+    """
+    data = request.get_json() or {}
+    printer_id = secure_filename(data.get('id') or '')
+    if not printer_id:
+        return jsonify(status='error', message='Printer id required.'), 400
+    streamer_mode = data.get('streamer', 'thread')
+    if streamer_mode not in STREAMER_MODES:
+        return jsonify(status='error', message=f'Streamer must be one of {", ".join(STREAMER_MODES)}.'), 400
+    session = printers.add(printer_id, data.get('name'), streamer_mode, data.get('cpu'))
+    if session is None:
+        return jsonify(status='error', message=f'Printer {printer_id} already exists.'), 409
+    try:
+        session.update_profile(data)
+    except (TypeError, ValueError) as e:
+        return jsonify(status='error', message=f'Invalid profile: {e}', id=printer_id), 400
+    return jsonify(status='success', id=printer_id)
+
+@app.route('/api/printers/<printer_id>/profile', methods=['PUT'])
+@with_printer
+def update_printer_profile(session):
+    """Placement constraints: {build_volume: [x, y, z], nozzle_diameter, material}"""
+    try:
+        session.update_profile(request.get_json() or {})
+    except (TypeError, ValueError) as e:
+        return jsonify(status='error', message=f'Invalid profile: {e}'), 400
+    job_scheduler.poke()
+    return jsonify(status='success', profile=session.profile())
+
+@app.route('/api/printers/<printer_id>', methods=['DELETE'])
+def remove_printer(printer_id):
+    if not printers.remove(printer_id):
+        return jsonify(status='error', message=f'Cannot remove printer {printer_id}.'), 400
+    return jsonify(status='success', message=f'Printer {printer_id} removed.')
+
+@app.route('/api/farm/plan', methods=['GET'])
+def get_farm_plan():
+    """Planned printer for every queued job, blocked jobs with reasons and the predicted makespan"""
+    return jsonify(status='success', **job_placement.plan())
+
+@app.route('/api/farm/status', methods=['GET'])
+def get_farm_status():
+    """Every printer's state and last telemetry in one response, without touching any serial port"""
+    return jsonify(printers.farm_status())
+
+@app.route('/api/streamer/metrics', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/streamer', methods=['GET'])
+@with_printer
+def get_streamer_metrics(session):
+    """Inter-line turnaround and jitter of the print streamer (?reset=1 starts a new sample)"""
+    metrics = session.streamer_metrics()
+    if request.args.get('reset'):
+        session.reset_streamer_metrics()
+    return jsonify(status='success', **metrics)
+
+# --- Prometheus metrics ---
+METRICS = BackendMetrics()  # served at /metrics; the streaming values come from each SessionState
+
+def collect_printer_metrics():
+    """Per-printer streaming counters and job state, read from the shared session state at scrape time"""
+    sessions = [(session.printer_id, session.state, session.job_state) for session in printers.all()]
+
+    def per_printer(field):
+        return [({'printer': printer_id}, getattr(state, field)) for printer_id, state, _ in sessions]
+
+    return [
+        ('printer_lines_sent_total', 'counter', 'G-code lines written to the printer', per_printer('lines_sent')),
+        ('printer_lines_acked_total', 'counter', 'G-code lines the printer acknowledged', per_printer('lines_acked')),
+        ('printer_commands_in_flight', 'gauge', 'Commands sent and not yet acknowledged',
+         [({'printer': printer_id}, state.unacked_lines + state.pending_acks) for printer_id, state, _ in sessions]),
+        ('printer_line_gap_seconds_sum', 'counter', 'Summed time from an acknowledgement to writing the next line',
+         per_printer('gap_sum')),
+        ('printer_line_gap_seconds_count', 'counter', 'Acknowledgement to next line turnarounds measured',
+         per_printer('gap_count')),
+        ('printer_line_gap_seconds_max', 'gauge', 'Longest acknowledgement to next line turnaround',
+         per_printer('gap_max')),
+        ('printer_injected_commands_total', 'counter', 'Manual commands sent between the lines of a print',
+         per_printer('inject_count')),
+        ('printer_rx_lines_total', 'counter', 'Lines received on the current connection', per_printer('rx_lines')),
+        ('printer_rx_noisy_lines_total', 'counter', 'Received lines holding line noise',
+         per_printer('rx_noisy_lines')),
+        ('printer_print_progress_lines', 'gauge', 'Lines of the current print acknowledged so far',
+         per_printer('print_progress')),
+        ('printer_job_state', 'gauge', 'Current job state (1 for the active state)',
+         [({'printer': printer_id, 'state': name}, int(name == job_state))
+          for printer_id, _, job_state in sessions for name in JOB_STATES]),
+    ]
+
+METRICS.registry.add_collector(collect_printer_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Streaming metrics of every printer in the Prometheus text format"""
+    return Response(METRICS.render(), content_type=BackendMetrics.CONTENT_TYPE)
 
 # --- API Endpoints ---
-@app.route('/api/connect', methods=['POST'])
-def connect_printer():
-    global printer
-    if printer and printer.is_open: 
+@app.route('/api/connect', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/connect', methods=['POST'])
+@with_printer
+def connect_printer(session):
+    if session.is_connected:
         return jsonify(status='success', message='Already connected.')
     try:
-        data = request.get_json()
-        port = data.get('port') if data else 'COM3'
-        baud_rate = data.get('baud_rate') if data else 250000
-        
-        logger.info(f"Attempting to connect to printer on {port} at {baud_rate} baud")
-        printer = serial.Serial(port, baud_rate, timeout=2)
-        time.sleep(3)  # Give printer time to initialize
-        get_printer_response()  # Clear buffer
-        
-        logger.info(f"Successfully connected to printer on {port}")
-        return jsonify(status='success', message=f'Connected to printer on {port}')
+        data = request.get_json(silent=True) or {}
+        port = data.get('port') or 'auto'
+        baud_rate = data.get('baud_rate') or 'auto'
+        reset = data.get('reset', True) is not False
+
+        owner = printers.port_owner(port)
+        if owner:
+            return jsonify(status='error', message=f'{port} is in use by printer {owner.printer_id}'), 409
+        detected = None
+        if port == 'auto':
+            # The device this printer was last connected as, wherever it enumerated this time
+            remembered = port_inventory.port_for_printer(session.printer_id)
+            if remembered and remembered not in printers.busy_ports():
+                port = remembered
+        if (port == 'auto' or baud_rate == 'auto') and not reset:
+            # Probing opens ports and may reset the board; reattaching only uses what is remembered
+            detected = port_detector.cached_result(None if port == 'auto' else port, exclude=printers.busy_ports())
+            if detected is None:
+                return jsonify(status='error', message='Connecting without a reset needs the port and baud_rate '
+                                                       '(nothing is remembered for this printer).'), 400
+            port, baud_rate = detected['port'], detected['baud_rate']
+        elif port == 'auto' or baud_rate == 'auto':
+            # Remembered result for a known device, otherwise a parallel probe of the free ports
+            detected = port_detector.detect(None if port == 'auto' else port, exclude=printers.busy_ports())
+            if detected is None:
+                return jsonify(status='error', message='No printer found on any free serial port.'), 404
+            port, baud_rate = detected['port'], detected['baud_rate']
+        try:
+            # reset=false keeps a running board (and its SD print) alive and reattaches to it
+            session.connect(port, int(baud_rate), reset=reset)
+        except serial.SerialException:
+            if detected and detected['cached']:
+                port_detector.forget(port)  # the next attempt probes again
+            raise
+        port_inventory.remember(port, session.printer_id)
+        job_scheduler.poke()
+        return jsonify(status='success', message=f'Connected to printer on {port}', port=port,
+                       baud_rate=int(baud_rate), detected=detected, connection=session.connection)
     except serial.SerialException as e:
         logger.error(f"Failed to connect to printer: {str(e)}")
         return jsonify(status='error', message=f'Connection failed: {str(e)}'), 400
@@ -70,89 +236,84 @@ def connect_printer():
         logger.error(f"Unexpected error during connection: {str(e)}")
         return jsonify(status='error', message=f'Unexpected error: {str(e)}'), 500
 
-@app.route('/api/disconnect', methods=['POST'])
-def disconnect_printer():
-    global printer, IS_PRINTING
-    if IS_PRINTING:
-        IS_PRINTING = False  # Stop any ongoing print
-    if printer and printer.is_open: 
-        printer.close()
-    printer = None
+@app.route('/api/connection', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/connection', methods=['GET'])
+@with_printer
+def get_connection_info(session):
+    """Handshake outcome, connect time, firmware and capabilities of the current connection"""
+    if not session.is_connected:
+        return jsonify(status='not_connected')
+    return jsonify(status='success', port=session.port, **session.connection)
+
+@app.route('/api/disconnect', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/disconnect', methods=['POST'])
+@with_printer
+def disconnect_printer(session):
+    session.disconnect()
     return jsonify(status='success', message='Disconnected.')
 
-@app.route('/api/command', methods=['POST'])
-def send_command():
-    if not printer or not printer.is_open:
+@app.route('/api/command', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/command', methods=['POST'])
+@with_printer
+def send_command(session):
+    if not session.is_connected:
         return jsonify(status='error', message='Printer not connected.'), 400
-    
+
     command = request.json.get('command')
     if not command:
         return jsonify(status='error', message='No command provided.'), 400
-    
-    printer.write(command.encode() + b'\n')
-    time.sleep(0.1)  # Small delay for response
-    response = get_printer_response()
-    return jsonify(status='success', command=command, response=response)
 
-@app.route('/api/status', methods=['GET'])
-def get_status():
-    if not printer or not printer.is_open:
-        return jsonify(status='not_connected', error=PRINT_ERROR)
+    try:
+        result = session.execute(command)  # injected between file lines while printing
+    except RuntimeError as e:
+        return jsonify(status='error', command=command, message=str(e)), 504
+    return jsonify(status='success', **result)
+
+@app.route('/api/z-offset', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/z-offset', methods=['GET'])
+@with_printer
+def get_z_offset(session):
+    """Returns the babystep Z offset applied since connecting"""
+    return jsonify(status='success', z_offset=session.z_offset)
+
+@app.route('/api/z-offset', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/z-offset', methods=['POST'])
+@with_printer
+def adjust_z_offset(session):
+    """Babysteps Z to an absolute offset (-2.0 to +2.0 mm), also in the middle of a print"""
+    if not session.is_connected:
+        return jsonify(status='error', message='Printer not connected'), 400
+    try:
+        offset = float((request.get_json() or {})['offset'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify(status='error', message='Invalid offset value'), 400
+    if not -2.0 <= offset <= 2.0:
+        return jsonify(status='error', message='Z-offset must be between -2.0 and +2.0 mm'), 400
 
     try:
-        printer.write(b'M105\n')
-        time.sleep(0.1)  # Wait for response
-        response_lines = get_printer_response()
-
-        temps = { 'hotend_actual': 0, 'hotend_target': 0, 'bed_actual': 0, 'bed_target': 0 }
-        for line in response_lines:
-            if 'T:' in line:
-                # Parse temperature response: T:25.0 /0.0 B:25.0 /0.0
-                temp_match = re.search(r'T:(\d+\.?\d*)\s*/(\d+\.?\d*).*B:(\d+\.?\d*)\s*/(\d+\.?\d*)', line)
-                if temp_match:
-                    temps.update({
-                        'hotend_actual': float(temp_match.group(1)),
-                        'hotend_target': float(temp_match.group(2)),
-                        'bed_actual': float(temp_match.group(3)),
-                        'bed_target': float(temp_match.group(4))
-                    })
-                break
+        result = session.execute(f'M290 Z{offset - session.z_offset:.3f}')  # M290 steps relative
+    except RuntimeError as e:
+        return jsonify(status='error', message=str(e)), 504
+    session.z_offset = offset
+    return jsonify(status='success', message=f'Z-offset adjusted to {offset:.3f}mm', z_offset=offset,
+                   injected=result['injected'], wait_ms=result['wait_ms'])
+
+@app.route('/api/status', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/status', methods=['GET'])
+@with_printer
+def get_status(session):
+    if not session.is_connected:
+        return jsonify(status='not_connected', error=session.print_error)
 
+    try:
         base_status = {
-            'temperatures': temps,
-            'is_paused': IS_PAUSED,
-            'error': PRINT_ERROR
+            'temperatures': session.query_temperatures(),
+            'is_paused': session.is_paused,
+            'error': session.print_error
         }
-
-        if IS_PRINTING:
-            progress = (PRINT_PROGRESS / TOTAL_LINES) * 100 if TOTAL_LINES > 0 else 0
-            print_status = 'paused' if IS_PAUSED else 'printing'
-            base_status.update({
-                'status': print_status,
-                'progress': round(progress, 2),
-                'filename': CURRENT_FILE,
-                'current_line': PRINT_PROGRESS,
-                'total_lines': TOTAL_LINES,
-            })
-        elif PRINT_ERROR:
-            base_status.update({
-                'status': 'error',
-                'progress': (PRINT_PROGRESS / TOTAL_LINES) * 100 if TOTAL_LINES > 0 else 0,
-                'filename': CURRENT_FILE,
-                'current_line': PRINT_PROGRESS,
-                'total_lines': TOTAL_LINES,
-            })
-        else:
-            base_status.update({
-                'status': 'connected',
-                'progress': 0,
-                'filename': "",
-                'current_line': 0,
-                'total_lines': 0,
-            })
-        
+        base_status.update(session.job_status())
         return jsonify(base_status)
-    
+
     except Exception as e:
         logger.error(f"Error getting status: {str(e)}")
         return jsonify(status='error', message=f'Status check failed: {str(e)}'), 500
@@ -160,25 +321,194 @@ def get_status():
 # --- File Management API ---
 @app.route('/api/files', methods=['GET'])
 def list_files():
-    files = [f for f in os.listdir(UPLOADS_DIR) if f.endswith(('.gcode', '.gco'))]
-    return jsonify(files=files)
+    """Serves the cached upload catalog; unchanged listings are answered with 304"""
+    etag, entries = file_catalog.listing()
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    response = jsonify(files=[entry['name'] for entry in entries], catalog=entries)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def register_upload(filename, analysis):
+    """
+    Move a freshly written upload into the content store and catalog, compressing it
+    first if configured. Returns (stored filename, analysis, duplicate flag).
+    """
+    if COMPRESS_UPLOADS_AT_REST and not compression_for(filename):
+        filepath, analysis = compress_at_rest(os.path.join(UPLOADS_DIR, filename), COMPRESS_UPLOADS_AT_REST)
+        file_catalog.refresh_file(filename)  # drop the plain name
+        filename = os.path.basename(filepath)
+    duplicate = blob_store.adopt(filename, analysis['sha256'])
+    blob_store.put_derived(analysis['sha256'], {'analysis': analysis})
+    file_catalog.refresh_file(filename)
+    return filename, analysis, duplicate
+
+def stored_analysis(filename):
+    """Upload analysis for a stored file (frame index, line offsets), computed only if unknown"""
+    sha256 = blob_store.hash_for(filename)
+    analysis = blob_store.get_derived(sha256).get('analysis') if sha256 else None
+    if analysis and analysis_is_current(analysis):
+        return analysis
+    analysis = analyze_file(os.path.join(UPLOADS_DIR, filename))
+    if sha256:
+        blob_store.put_derived(sha256, {'analysis': analysis})
+    return analysis
+
+def link_stored_upload(filename, sha256):
+    """Name already-stored content without transferring it; returns the reply or None if unknown"""
+    if not sha256 or not blob_store.link_name(filename, sha256.lower()):
+        return None
+    file_catalog.refresh_file(filename)
+    analysis = stored_analysis(filename)
+    return jsonify(status='success', message=f'File {filename} uploaded.', filename=filename,
+                   analysis=analysis, duplicate=True)
+
+def upload_name_error(filename):
+    """Error reply for an upload name the server cannot store, or None"""
+    if not is_gcode_filename(filename):
+        return jsonify(status='error', message='Invalid file type.'), 400
+    if not compression_supported(filename):
+        return jsonify(status='error', message='zstd-compressed G-code is not supported on this server '
+                                               '(the zstandard package is not installed).'), 415
+    return None
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files: 
         return jsonify(status='error', message='No file part'), 400
     file = request.files['file']
-    if file and file.filename.endswith(('.gcode', '.gco')):
-        file.save(os.path.join(UPLOADS_DIR, file.filename))
-        return jsonify(status='success', message=f'File {file.filename} uploaded.')
-    return jsonify(status='error', message='Invalid file type.'), 400
+    filename = secure_filename(file.filename or '')
+    error = upload_name_error(filename)
+    if error:
+        return error
+    analysis = save_upload_stream(file.stream, os.path.join(UPLOADS_DIR, filename))
+    filename, analysis, duplicate = register_upload(filename, analysis)
+    return jsonify(status='success', message=f'File {filename} uploaded.', filename=filename,
+                   analysis=analysis, duplicate=duplicate)
+
+@app.route('/api/upload/stream/<filename>', methods=['PUT', 'POST'])
+def upload_file_stream(filename):
+    """Streams a raw request body to disk, analysing it in the same pass (no multipart buffering)"""
+    filename = secure_filename(filename)
+    error = upload_name_error(filename)
+    if error:
+        return error
+    try:
+        analysis = save_upload_stream(request.stream, os.path.join(UPLOADS_DIR, filename))
+        filename, analysis, duplicate = register_upload(filename, analysis)
+        logger.info(f"Streamed upload {filename}: {analysis['size']} bytes, {analysis['line_count']} lines")
+        return jsonify(status='success', message=f'File {filename} uploaded.', filename=filename,
+                       analysis=analysis, duplicate=duplicate)
+    except Exception as e:
+        logger.error(f"Streamed upload failed for {filename}: {str(e)}")
+        return jsonify(status='error', message=f'Upload failed: {str(e)}'), 500
+
+@app.route('/api/upload/by-hash', methods=['POST'])
+def upload_by_hash():
+    """Instant upload of content the server already has: {filename, sha256}; 404 if unknown"""
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename') or '')
+    error = upload_name_error(filename)
+    if error:
+        return error
+    reply = link_stored_upload(filename, data.get('sha256'))
+    if reply is None:
+        return jsonify(status='error', message='Content not stored, upload the file.'), 404
+    return reply
+
+# --- Resumable Chunked Upload API ---
+def chunked_upload_reply(result):
+    code = result.pop('code', 200)
+    return jsonify(result), code
+
+@app.route('/api/uploads', methods=['POST'])
+def initiate_chunked_upload():
+    """Starts a resumable upload: {filename, size, sha256 (optional)}"""
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename') or '')
+    error = upload_name_error(filename)
+    if error:
+        return error
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify(status='error', message='File size required.'), 400
+    reply = link_stored_upload(filename, data.get('sha256'))
+    if reply is not None:
+        return reply  # Known content: nothing to transfer
+    return chunked_upload_reply(chunked_uploads.initiate(filename, size, data.get('sha256')))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Writes one chunk at ?offset=N, verified against the X-Chunk-SHA256 header when given"""
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify(status='error', message='Chunk offset required.'), 400
+    if (request.content_length or 0) > MAX_CHUNK_SIZE:
+        return jsonify(status='error', message='Chunk too large.'), 413
+    data = request.get_data(cache=False)
+    return chunked_upload_reply(chunked_uploads.put_chunk(
+        upload_id, offset, data, request.headers.get('X-Chunk-SHA256')))
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """Reports received and missing byte ranges so a client can resume"""
+    return chunked_upload_reply(chunked_uploads.status(upload_id))
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    return chunked_upload_reply(chunked_uploads.abort(upload_id))
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload(upload_id):
+    """Moves the assembled file into uploads/ and returns its analysis"""
+    result = chunked_uploads.finalize(upload_id)
+    if result['status'] == 'success':
+        result['filename'], result['analysis'], result['duplicate'] = register_upload(
+            result['filename'], result['analysis'])
+    return chunked_upload_reply(result)
+
+@app.route('/api/command-filter', methods=['GET'])
+def get_command_filter():
+    """The deny/rewrite table applied to print jobs, by exact command code"""
+    return jsonify(status='success', **active_filter().to_dict())
+
+@app.route('/api/command-filter', methods=['PUT'])
+def set_command_filter():
+    """Replace the table: {"deny": ["M0", ...], "rewrite": {"M600": "M117 ..."}}; applies to new jobs and analyses"""
+    data = request.get_json() or {}
+    try:
+        command_filter = CommandFilter(deny=data.get('deny', ()), rewrite=data.get('rewrite'))
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify(status='error', message=f'Invalid command filter: {e}'), 400
+    command_filter.save(COMMAND_FILTER_PATH)
+    set_active_filter(command_filter)
+    forget_cached_analyses()  # stored analyses report filtered_commands for the old table; redone on next use
+    return jsonify(status='success', **command_filter.to_dict())
 
 # --- Legacy G-code serving for 3D viewer ---
 @app.route('/api/gcode/<filename>', methods=['GET'])
 def get_gcode(filename):
-    """Serves a G-code file from uploads directory or root for legacy files."""
+    """
+    Serves a G-code file from uploads directory or root for legacy files.
+    Compressed files are decompressed on the fly; ?offset=N starts at a content byte offset
+    (e.g. a layer offset from the upload analysis) using the frame index to seek.
+    """
     try:
         # Try uploads directory first
+        filepath = os.path.join(UPLOADS_DIR, secure_filename(filename))
+        offset = request.args.get('offset', 0, type=int)
+        if os.path.exists(filepath) and (offset or compression_for(filename)):
+            frames = stored_analysis(os.path.basename(filepath)).get('frames') if offset else None
+            reader = open_gcode(filepath, offset, frames)
+
+            def generate():
+                with reader:
+                    for chunk in iter(lambda: reader.read(OUTPUT_CHUNK), b''):
+                        yield chunk
+            return Response(generate(), mimetype='text/plain')
         if os.path.exists(os.path.join(UPLOADS_DIR, filename)):
             return send_from_directory(UPLOADS_DIR, filename)
         # Fall back to root directory for legacy files like sample.gcode
@@ -186,234 +516,192 @@ def get_gcode(filename):
     except FileNotFoundError:
         return jsonify(status='error', message='File not found.'), 404
 
-# --- Print Streaming Logic ---
-def print_job_thread(filepath):
-    global IS_PRINTING, IS_PAUSED, PRINT_PROGRESS, TOTAL_LINES, PRINT_ERROR
+# --- Job Queue API ---
+@app.route('/api/queue', methods=['GET'])
+def list_jobs():
+    return jsonify(status='success', jobs=job_queue.list_jobs())
+
+@app.route('/api/queue', methods=['POST'])
+def enqueue_job():
+    """Queues a print: {filename, printer_id (optional, default any printer), priority (optional)}"""
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or filename != data.get('filename') or not file_catalog.contains(filename):
+        return jsonify(status='error', message='File not found.'), 404
+    printer_id = data.get('printer_id') or None
+    if printer_id and printers.get(printer_id) is None:
+        return jsonify(status='error', message=f'Unknown printer: {printer_id}'), 404
     try:
-        logger.info(f"Starting print job: {filepath}")
-        PRINT_ERROR = None
-        
-        # Read G-code file
-        with open(filepath, 'r') as f:
-            gcode_lines = []
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith(';'):  # Skip empty lines and comments
-                    gcode_lines.append(line)
-            
-            TOTAL_LINES = len(gcode_lines)
-            logger.info(f"Total G-code lines: {TOTAL_LINES}")
-
-        IS_PRINTING = True
-        IS_PAUSED = False
-        PRINT_PROGRESS = 0
-
-        # Send initial setup commands
-        if printer and printer.is_open:
-            setup_commands = ['G21', 'G90', 'M83']  # mm units, absolute positioning, relative extruder
-            for cmd in setup_commands:
-                printer.write(f'{cmd}\n'.encode())
-                time.sleep(0.1)
-                get_printer_response()  # Clear responses
-
-        for i, line in enumerate(gcode_lines):
-            # Check if print is cancelled
-            if not IS_PRINTING:
-                logger.info("Print cancelled by user")
-                if printer and printer.is_open:
-                    printer.write(b'M104 S0\n')  # Turn off hotend
-                    time.sleep(0.1)
-                    printer.write(b'M140 S0\n')  # Turn off bed
-                    time.sleep(0.1)
-                    printer.write(b'M84\n')     # Disable motors
-                break
-
-            # Handle pause
-            while IS_PAUSED and IS_PRINTING:
-                logger.info("Print paused, waiting...")
-                time.sleep(0.5)
-            
-            if not IS_PRINTING:  # Check again after pause
-                break
-
-            if printer and printer.is_open:
-                try:
-                    logger.debug(f"Sending G-code line {i+1}/{TOTAL_LINES}: {line}")
-                    printer.write(line.encode() + b'\n')
-                    
-                    # Wait for acknowledgment with appropriate timeout
-                    timeout_seconds = 10  # Default timeout
-                    if line.startswith('M190'):  # Bed heating
-                        timeout_seconds = 300  # 5 minutes
-                    elif line.startswith('M109'):  # Hotend heating
-                        timeout_seconds = 180  # 3 minutes
-                    elif line.startswith('G28'):  # Homing
-                        timeout_seconds = 60   # 1 minute
-                    elif line.startswith('G29'):  # Auto bed leveling
-                        timeout_seconds = 120  # 2 minutes
-                    
-                    timeout_count = 0
-                    max_timeout = timeout_seconds * 10  # 0.1 second intervals
-                    response_received = False
-                    
-                    while timeout_count < max_timeout and not response_received:
-                        if not IS_PRINTING:  # Check if cancelled during wait
-                            break
-                            
-                        if printer.in_waiting > 0:
-                            response = printer.readline().decode('utf-8', errors='ignore').strip()
-                            if response:
-                                logger.debug(f"Printer response: {response}")
-                                if 'ok' in response.lower():
-                                    response_received = True
-                                    break
-                                elif 'error' in response.lower():
-                                    logger.error(f"Printer error on line {i+1}: {response}")
-                                    PRINT_ERROR = f"Printer error on line {i+1}: {response}"
-                                    IS_PRINTING = False
-                                    return
-                        
-                        time.sleep(0.1)
-                        timeout_count += 1
-                    
-                    if not response_received and IS_PRINTING:
-                        logger.warning(f"Timeout waiting for response on line {i+1}: {line}")
-                        # Continue anyway for non-critical commands
-                        if line.startswith(('M190', 'M109', 'G28', 'G29')):
-                            logger.error(f"Critical command timeout on line {i+1}")
-                            PRINT_ERROR = f"Timeout on critical command: {line}"
-                            IS_PRINTING = False
-                            return
-                        
-                except Exception as e:
-                    logger.error(f"Error sending line {i+1}: {str(e)}")
-                    PRINT_ERROR = f"Error on line {i+1}: {str(e)}"
-                    IS_PRINTING = False
-                    return
-                
-            PRINT_PROGRESS = i + 1
-            
-            # Variable delay based on command type
-            if line.startswith(('M190', 'M109')):
-                time.sleep(0.5)  # Longer delay for heating commands
-            elif line.startswith(('G0', 'G1')):
-                time.sleep(0.02)  # Short delay for movement
-            else:
-                time.sleep(0.1)   # Standard delay
-            
-        if IS_PRINTING:
-            logger.info("Print job completed successfully")
-        
-    except Exception as e:
-        logger.error(f"Print job error: {str(e)}")
-        PRINT_ERROR = f"Print job failed: {str(e)}"
-    finally:
-        IS_PRINTING = False
-        IS_PAUSED = False
-        logger.info("Print job thread finished")
-
-@app.route('/api/print/start', methods=['POST'])
-def start_print():
-    global print_thread, CURRENT_FILE
-    if IS_PRINTING: 
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify(status='error', message='Priority must be an integer.'), 400
+    job = job_queue.enqueue(filename, printer_id, priority)
+    job_scheduler.poke()
+    return jsonify(status='success', job=job)
+
+@app.route('/api/queue/<int:job_id>/move', methods=['POST'])
+def move_job(job_id):
+    """Reorders a queued job: {before: job_id} | {after: job_id} | {priority: n}"""
+    data = request.get_json() or {}
+    job = job_queue.move(job_id, data.get('before'), data.get('after'), data.get('priority'))
+    if job is None:
+        return jsonify(status='error', message='Job or anchor job is not queued.'), 409
+    return jsonify(status='success', job=job)
+
+@app.route('/api/queue/<int:job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancels a queued job, or the print of a job that is already running"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(status='error', message='Unknown job.'), 404
+    if job['status'] == 'printing':
+        session = printers.get(job['assigned_printer'])
+        if session and session.is_printing:
+            if not session.cancel():  # the scheduler records the job as cancelled when the print stops
+                return jsonify(status='error', message=f'Cannot cancel while {session.job_state}.'), 409
+            return jsonify(status='success', message='Print job cancelled')
+        # The print already stopped; record how it ended instead of waiting for the next pass
+        job_scheduler.run_once()
+        job = job_queue.get(job_id)
+        return jsonify(status='error', message=f"Job is already {job['status']}."), 409
+    if job_queue.cancel(job_id) is None:
+        return jsonify(status='error', message=f"Job is already {job['status']}."), 409
+    return jsonify(status='success', message='Queued job cancelled')
+
+@app.route('/api/printers/<printer_id>/bed-clear', methods=['POST'])
+@with_printer
+def confirm_bed_clear(session):
+    """Operator confirmation that the bed is empty, allowing the next queued job to start"""
+    session.bed_clear = True
+    job_scheduler.poke()
+    return jsonify(status='success', message=f'Bed of {session.printer_id} confirmed clear.')
+
+# --- Print Job API ---
+@app.route('/api/print/start', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/start', methods=['POST'])
+@with_printer
+def start_print(session):
+    if session.is_printing:
         return jsonify(status='error', message='Print already in progress.'), 400
-    
-    if not printer or not printer.is_open:
+
+    if not session.is_connected:
         return jsonify(status='error', message='Printer not connected.'), 400
 
     filename = request.json.get('filename')
     if not filename:
         return jsonify(status='error', message='No filename provided.'), 400
-        
+
     filepath = os.path.join(UPLOADS_DIR, filename)
-    if not os.path.exists(filepath): 
+    if not os.path.exists(filepath):
         return jsonify(status='error', message='File not found.'), 404
 
-    CURRENT_FILE = filename
-    print_thread = threading.Thread(target=print_job_thread, args=(filepath,))
-    print_thread.start()
-
+    if not session.start_print(filepath, filename):
+        return jsonify(status='error', message=f'Printer is {session.job_state}.'), 409
     return jsonify(status='success', message=f'Printing {filename}...')
 
-@app.route('/api/print/cancel', methods=['POST'])
-def cancel_print():
-    global IS_PRINTING, IS_PAUSED
-    if not IS_PRINTING: 
+@app.route('/api/print/cancel', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/cancel', methods=['POST'])
+@with_printer
+def cancel_print(session):
+    if not session.is_printing:
         return jsonify(status='error', message='No active print job'), 400
-        
+
     try:
-        logger.info("Cancelling print job")
-        IS_PRINTING = False  # Signal the thread to stop
-        IS_PAUSED = False    # Reset pause state
+        if not session.cancel():
+            return jsonify(status='error', message=f'Cannot cancel while {session.job_state}.'), 409
         return jsonify(status='success', message='Print job cancelled')
     except Exception as e:
         logger.error(f"Error cancelling print: {str(e)}")
         return jsonify(status='error', message=f'Cancel failed: {str(e)}'), 500
 
-@app.route('/api/print/pause', methods=['POST'])
-def pause_print():
-    global IS_PAUSED
-    if not IS_PRINTING:
+@app.route('/api/print/pause', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/pause', methods=['POST'])
+@with_printer
+def pause_print(session):
+    if not session.is_printing:
         return jsonify(status='error', message='No active print job'), 400
-    
+
     try:
-        IS_PAUSED = True
-        logger.info("Print job paused")
+        if not session.pause():
+            return jsonify(status='error', message=f'Cannot pause while {session.job_state}.'), 409
         return jsonify(status='success', message='Print job paused')
     except Exception as e:
         logger.error(f"Error pausing print: {str(e)}")
         return jsonify(status='error', message=f'Pause failed: {str(e)}'), 500
 
-@app.route('/api/print/resume', methods=['POST'])
-def resume_print():
-    global IS_PAUSED
-    if not IS_PRINTING:
+@app.route('/api/print/resume', methods=['POST'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/resume', methods=['POST'])
+@with_printer
+def resume_print(session):
+    if not session.is_printing:
         return jsonify(status='error', message='No active print job'), 400
-    
-    if not IS_PAUSED:
+
+    if not session.is_paused:
         return jsonify(status='error', message='Print job is not paused'), 400
-    
+
     try:
-        IS_PAUSED = False
-        logger.info("Print job resumed")
+        if not session.resume():
+            return jsonify(status='error', message=f'Cannot resume while {session.job_state}.'), 409
         return jsonify(status='success', message='Print job resumed')
     except Exception as e:
         logger.error(f"Error resuming print: {str(e)}")
         return jsonify(status='error', message=f'Resume failed: {str(e)}'), 500
 
-@app.route('/api/print/status', methods=['GET'])
-def get_print_status():
+@app.route('/api/print/status', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/status', methods=['GET'])
+@with_printer
+def get_print_status(session):
     """Returns the current print status and progress"""
-    if IS_PRINTING:
-        progress = (PRINT_PROGRESS / TOTAL_LINES) * 100 if TOTAL_LINES > 0 else 0
-        return jsonify(status='printing', progress=round(progress, 2), filename=CURRENT_FILE)
-    else:
-        return jsonify(status='idle', progress=0, filename='')
+    job = session.job_status()
+    if job['state'] in ('idle', 'error'):
+        return jsonify(status='idle', state=job['state'], progress=0, filename='')
+    return jsonify(status='printing', state=job['state'], progress=job['progress'], filename=job['filename'])
+
+@app.route('/api/print/transitions', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/transitions', methods=['GET'])
+@with_printer
+def get_print_transitions(session):
+    """Returns the current job state and the log of recent state transitions"""
+    return jsonify(state=session.job_state, transitions=session.transition_log())
+
+@app.route('/api/print/position', methods=['GET'], defaults={'printer_id': DEFAULT_PRINTER})
+@app.route('/api/printers/<printer_id>/print/position', methods=['GET'])
+@with_printer
+def get_print_position_route(session):
+    """Returns the toolpath segment and layer the printer has acknowledged up to"""
+    if not session.is_printing:
+        return jsonify(status='idle', filename='', position=None)
+    return jsonify(
+        status='paused' if session.is_paused else 'printing',
+        filename=session.current_file,
+        position=session.print_position()
+    )
+
+@app.route('/api/ports/detect', methods=['POST'])
+def detect_printer_port():
+    """Probes the free serial ports in parallel for a printer ({port?, refresh?} limits the search / skips the cache)"""
+    if not SERIAL_OWNER:
+        return jsonify(status='error', message=f'Printers are served by process {SERIAL_OWNER_PID}.'), 503
+    data = request.get_json(silent=True) or {}
+    detected = port_detector.detect(data.get('port'), exclude=printers.busy_ports(),
+                                    use_cache=not data.get('refresh'))
+    if detected is None:
+        return jsonify(status='error', message='No printer found on any free serial port.'), 404
+    return jsonify(status='success', **detected)
 
 @app.route('/api/ports', methods=['GET'])
 def list_available_ports():
-    """List all available serial ports"""
-    try:
-        ports = serial.tools.list_ports.comports()
-        available_ports = []
-        
-        for port in ports:
-            port_info = {
-                'port': port.device,
-                'description': port.description,
-                'manufacturer': getattr(port, 'manufacturer', 'Unknown'),
-                'product': getattr(port, 'product', 'Unknown'),
-                'is_printer': any(keyword in port.description.lower() 
-                                for keyword in ['arduino', 'ch340', 'cp210', 'ftdi', 'usb serial'])
-            }
-            available_ports.append(port_info)
-        
-        logger.info(f"Found {len(available_ports)} available ports")
-        return jsonify(status='success', ports=available_ports)
-        
-    except Exception as e:
-        logger.error(f"Error listing ports: {str(e)}")
-        return jsonify(status='error', message=f'Failed to list ports: {str(e)}'), 500
+    """Lists serial ports from the hotplug-maintained inventory; unchanged listings are answered with 304"""
+    etag, ports = port_inventory.listing()
+    busy = {session.port: session.printer_id for session in printers.all() if session.is_connected}
+    etag = f"{etag}-{zlib.crc32(repr(sorted(busy.items())).encode()):08x}"  # connections change it too
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    response = jsonify(status='success', ports=[dict(port, connected_printer=busy.get(port['port']))
+                                                for port in ports])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -1,5 +1,5 @@
 # backend/app.py - ENHANCED PRODUCTION VERSION WITH NUCLEAR PAUSE OVERRIDE
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 import serial
 import time
@@ -10,7 +10,10 @@ import logging
 import serial.tools.list_ports
 
 # Import enhanced print handler
-from enhanced_print_handler import nuclear_pause_override, enhanced_pause_detection_and_override, enhanced_print_monitoring
+from enhanced_print_handler import PauseRecovery, enhanced_print_monitoring
+from command_filter import PAUSE_COMMANDS, CommandFilter, FilterReport
+from hot_log import HotPathLogger, start_queue_logging
+from stream_metrics import MeteredSerial, StreamMetrics
 
 app = Flask(__name__)
 CORS(app)
@@ -18,6 +21,8 @@ CORS(app)
 # Configure logging for production
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+start_queue_logging()  # handlers run on a listener thread, not the print loop
+hot = HotPathLogger(logger)  # per-line trace, dumped when a print fails
 
 # --- Setup ---
 UPLOADS_DIR = 'uploads'
@@ -33,6 +38,9 @@ PRINT_PROGRESS = 0
 TOTAL_LINES = 0
 CURRENT_FILE = ""
 PRINT_ERROR = None  # To store any errors that occur during printing
+PAUSE_FILTER = CommandFilter(deny=PAUSE_COMMANDS)  # exact codes: M1 is dropped, M104/M140 are not
+PAUSE_RECOVERY = PauseRecovery()  # acts only when the printer reports a pause
+METRICS = StreamMetrics()  # served at /metrics; updated per line without locks
 CURRENT_POSITION = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'e': 0.0}
 PRINTER_STATUS = {
     'state': 'disconnected',
@@ -93,7 +101,7 @@ def get_printer_response():
             try:
                 line = printer.readline().decode('utf-8', errors='ignore').strip()
                 if line: 
-                    logger.debug(f"RAW PRINTER RESPONSE: {line}")  # Log raw response for debugging
+                    hot.trace("RAW PRINTER RESPONSE: %s", line)
                     lines.append(line)
                     # Parse useful information from responses
                     parse_position_from_response(line)
@@ -101,7 +109,7 @@ def get_printer_response():
                     
                     # Enhanced logging for pause-related responses
                     if any(keyword in line.lower() for keyword in ['paused', 'pause', 'wait', 'busy']):
-                        logger.warning(f"🔍 PAUSE-RELATED RESPONSE DETECTED: {line}")
+                        hot.log('pause_response', logging.WARNING, "🔍 PAUSE-RELATED RESPONSE DETECTED: %s", line)
                         
             except UnicodeDecodeError:
                 # Skip lines that can't be decoded as UTF-8
@@ -127,7 +135,7 @@ def connect_printer():
         baud_rate = data.get('baud_rate') if data else 250000
         
         logger.info(f"Attempting to connect to printer on {port} at {baud_rate} baud")
-        printer = serial.Serial(port, baud_rate, timeout=2)
+        printer = MeteredSerial(serial.Serial(port, baud_rate, timeout=2), METRICS)
         time.sleep(3)  # Give printer time to initialize
         get_printer_response()  # Clear buffer
         
@@ -326,22 +334,23 @@ def print_job_thread(filepath):
         # Read and filter G-code lines
         with open(filepath, 'r') as f:
             gcode_lines = []
-            pause_commands_found = 0
-            for line in f:
+            filter_report = FilterReport()
+            for line_number, line in enumerate(f, 1):
                 line = line.strip()
                 # Skip empty lines, comments, and pause-related commands
                 if line and not line.startswith(';'):
-                    # Check for pause commands and skip them
-                    if any(cmd in line.upper() for cmd in ['M0', 'M1', 'M25', 'M226', '@PAUSE']):
-                        pause_commands_found += 1
-                        logger.warning(f"Skipping pause command found in G-code: {line}")
+                    code, line = PAUSE_FILTER.apply(line)
+                    if code:
+                        filter_report.record(code, line_number, line is not None)
+                    if line is None:
                         continue
                     gcode_lines.append(line)
             
             TOTAL_LINES = len(gcode_lines)
             logger.info(f"Total G-code lines to execute: {TOTAL_LINES}")
-            if pause_commands_found > 0:
-                logger.info(f"🛡️  Filtered out {pause_commands_found} pause commands from G-code file")
+            if filter_report.total:
+                logger.info(f"🛡️  Filtered out {filter_report.total} pause commands from G-code file: "
+                            f"{filter_report.summary()}")
 
         IS_PRINTING = True
         IS_PAUSED = False
@@ -371,7 +380,7 @@ def print_job_thread(filepath):
             
             for cmd, desc in nuclear_setup_commands:
                 try:
-                    result = enhanced_print_monitoring(printer, cmd, timeout=3)
+                    result = enhanced_print_monitoring(printer, cmd, timeout=3, recovery=PAUSE_RECOVERY)
                     if result['status'] != 'success':
                         logger.warning(f"Nuclear setup warning ({desc}): {result['message']}")
                     else:
@@ -385,6 +394,8 @@ def print_job_thread(filepath):
 
         # Set current line for enhanced monitoring
         enhanced_print_monitoring.current_line = 0
+        last_ack = None  # when the previous line was acknowledged
+        METRICS.unacked = 0  # a new stream; oks owed from an earlier one are not waited for
         
         for i, line in enumerate(gcode_lines):
             # Update current line for monitoring
@@ -398,7 +409,7 @@ def print_job_thread(filepath):
                     emergency_commands = ['M104 S0', 'M140 S0', 'M84']
                     for cmd in emergency_commands:
                         try:
-                            enhanced_print_monitoring(printer, cmd, timeout=2)
+                            enhanced_print_monitoring(printer, cmd, timeout=2, recovery=PAUSE_RECOVERY)
                             time.sleep(0.1)
                         except:
                             pass
@@ -413,59 +424,61 @@ def print_job_thread(filepath):
             if not IS_PRINTING:
                 break
             
-            # NUCLEAR PERIODIC PREVENTION - Re-enforce every 25 lines for maximum security
-            if i > 0 and (i % 25) == 0:  # Every 25 lines
-                try:
-                    logger.info(f"🔥 NUCLEAR re-enforcement at line {i+1}")
-                    nuclear_success = nuclear_pause_override(printer)
-                    if not nuclear_success:
-                        logger.warning("Nuclear re-enforcement had issues, but continuing...")
-                except Exception as e:
-                    logger.warning(f"Nuclear periodic prevention failed: {e}")
-
             if printer and printer.is_open:
                 try:
-                    logger.info(f"📡 Sending NUCLEAR-PROTECTED G-code line {i+1}: {line}")
-                    
                     # Determine appropriate timeout based on command type
                     timeout_seconds = 15  # Default timeout
                     if line.startswith('M190'):  # Bed heating
                         timeout_seconds = 600  # 10 minutes
-                        logger.info("🌡️ Bed heating command detected, using extended timeout")
                     elif line.startswith('M109'):  # Hotend heating
                         timeout_seconds = 300  # 5 minutes
-                        logger.info("🌡️ Hotend heating command detected, using extended timeout")
                     elif line.startswith('G28'):  # Homing
                         timeout_seconds = 60   # 1 minute
-                        logger.info("🏠 Homing command detected, using extended timeout")
                     elif line.startswith('G29'):  # Auto bed leveling
                         timeout_seconds = 180  # 3 minutes
-                        logger.info("📐 Auto bed leveling command detected, using extended timeout")
                     elif line.startswith(('G0', 'G1')) and 'Z' in line.upper():  # Z movement
                         timeout_seconds = 30   # 30 seconds
-                        logger.info("⬆️ Z-axis movement detected, using extended timeout")
                     elif line.startswith(('G0', 'G1')):  # Other movement
                         timeout_seconds = 20   # 20 seconds
-                        logger.info("➡️ Movement command detected, using extended timeout")
+                    hot.trace("📡 Sending G-code line %d (timeout %ds): %s", i + 1, timeout_seconds, line)
                     
                     # Use enhanced monitoring with integrated NUCLEAR pause detection and override
-                    result = enhanced_print_monitoring(printer, line, timeout=timeout_seconds)
+                    sent = time.perf_counter()
+                    if last_ack is not None:
+                        METRICS.line_gap.observe(sent - last_ack)
+                    METRICS.lines_sent.inc()
+                    METRICS.unacked += 1  # until its ok is read; a timed-out or failed line stays counted
+                    result = enhanced_print_monitoring(printer, line, timeout=timeout_seconds, recovery=PAUSE_RECOVERY)
+                    resends = sum(1 for response in result.get('responses', ()) if response.startswith(('Resend', 'rs ')))
+                    if resends:
+                        METRICS.resends.inc(resends)
                     
                     if result['status'] == 'error':
+                        METRICS.errors.labels('pause_override_failed' if result['message'] == 'Pause override failed'
+                                              else 'printer_error').inc()
                         logger.error(f"❌ NUCLEAR monitoring error on line {i+1}: {result['message']}")
+                        hot.dump_trace("Print stopped")
                         PRINT_ERROR = f"Nuclear monitoring error on line {i+1}: {result['message']}"
                         IS_PRINTING = False
                         return
                     elif result['status'] == 'timeout':
+                        METRICS.errors.labels('timeout').inc()
                         logger.error(f"⏰ NUCLEAR monitoring timeout on line {i+1}: {result['message']}")
+                        hot.dump_trace("Print stopped")
                         PRINT_ERROR = f"Nuclear monitoring timeout on line {i+1}: {result['message']}"
                         IS_PRINTING = False
                         return
                     else:
-                        logger.info(f"✅ NUCLEAR monitoring successful for line {i+1}")
+                        last_ack = time.perf_counter()
+                        METRICS.unacked -= 1
+                        METRICS.lines_acked.inc()
+                        METRICS.ack_latency.observe(last_ack - sent)
+                        hot.trace("✅ Line %d acknowledged", i + 1)
                         
                 except Exception as e:
+                    METRICS.errors.labels('exception').inc()
                     logger.error(f"💥 Error in nuclear processing line {i+1}: {str(e)}")
+                    hot.dump_trace("Print stopped")
                     PRINT_ERROR = f"Error in nuclear processing line {i+1}: {str(e)}"
                     IS_PRINTING = False
                     return
@@ -485,6 +498,7 @@ def print_job_thread(filepath):
         
     except Exception as e:
         logger.error(f"💥 Nuclear print job error: {str(e)}")
+        hot.dump_trace("Print job failed")
         PRINT_ERROR = f"Nuclear print job failed: {str(e)}"
     finally:
         IS_PRINTING = False
@@ -606,7 +620,12 @@ def emergency_stop():
         logger.error(f"Error during nuclear emergency stop: {str(e)}")
         return jsonify(status='error', message=f'Emergency stop failed: {str(e)}'), 500
 
-# --- Health Check Endpoint ---
+@app.route('/api/print/pause-recovery', methods=['GET'])
+def get_pause_recovery():
+    """Detected pauses, which recovery tier resolved them and what each tier cost"""
+    return jsonify(status='success', **PAUSE_RECOVERY.stats())
+
+# --- Health Check and Metrics Endpoints ---
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring"""
@@ -615,9 +634,45 @@ def health_check():
         printer_connected=printer is not None and printer.is_open if printer else False,
         is_printing=IS_PRINTING,
         nuclear_mode=True,
-        uptime=time.time()
+        uptime=round(METRICS.uptime(), 1),
+        started=METRICS.started
     )
 
+PRINTER_STATES = ('disconnected', 'connected', 'printing', 'paused', 'error')
+
+def current_printer_state():
+    if not printer or not printer.is_open:
+        return 'disconnected'
+    if IS_PRINTING:
+        return 'paused' if IS_PAUSED else 'printing'
+    return 'error' if PRINT_ERROR else 'connected'
+
+def collect_printer_metrics():
+    """Printer state and pause recovery counts, read at scrape time"""
+    state = current_printer_state()
+    recovery = PAUSE_RECOVERY.stats()
+    return [
+        ('printer_state', 'gauge', 'Current printer state (1 for the active state)',
+         [({'state': name}, int(name == state)) for name in PRINTER_STATES]),
+        ('printer_print_progress_lines', 'gauge', 'Lines of the current print acknowledged so far',
+         [({}, PRINT_PROGRESS)]),
+        ('printer_pauses_detected_total', 'counter', 'Firmware pauses detected during prints',
+         [({}, recovery['detected'])]),
+        ('printer_pause_recovery_failures_total', 'counter', 'Pauses no recovery tier could resolve',
+         [({}, recovery['failed'])]),
+        ('printer_pause_recovery_attempts_total', 'counter', 'Pause recovery attempts by tier',
+         [({'tier': tier}, stats['attempts']) for tier, stats in recovery['tiers'].items()]),
+        ('printer_pause_recovery_resolved_total', 'counter', 'Pauses resolved by each recovery tier',
+         [({'tier': tier}, stats['resolved']) for tier, stats in recovery['tiers'].items()]),
+    ]
+
+METRICS.registry.add_collector(collect_printer_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Streaming metrics in the Prometheus text format"""
+    return Response(METRICS.render(), content_type=StreamMetrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     logger.info("🚀 Starting 3D Printer Controller Server with NUCLEAR PAUSE OVERRIDE")
     app.run(host='0.0.0.0', port=5000, debug=False)
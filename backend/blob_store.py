@@ -0,0 +1,173 @@
+# Content-Addressed Upload Store
+# Upload contents live once under uploads/.blobs keyed by SHA-256; the visible
+# file names in uploads/ are hard links into the store, so duplicates cost no disk
+# and anything derived from a file's content is computed once per hash.
+#
+# Blobs are made read-only, and because a name shares its blob's inode the visible
+# upload is read-only too: writing through one name would silently change every
+# other name with the same content. Files are replaced (write a new file, then
+# os.replace), never edited in place; the catalog picks the new content up.
+
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Name -> SHA-256 mapping over a directory of immutable content blobs"""
+
+    def __init__(self, uploads_dir):
+        self.uploads_dir = uploads_dir
+        self.blobs_dir = os.path.join(uploads_dir, '.blobs')
+        self.names_path = os.path.join(self.blobs_dir, 'names.json')
+        self.lock = threading.RLock()
+        self._derived = {}
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        try:
+            with open(self.names_path) as f:
+                self.names = json.load(f)
+        except (OSError, ValueError):
+            self.names = {}
+
+    # --- Paths ---
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def _derived_path(self, sha256):
+        return self.blob_path(sha256) + '.json'
+
+    def _name_path(self, name):
+        return os.path.join(self.uploads_dir, name)
+
+    def _save_names(self):
+        with open(self.names_path + '.tmp', 'w') as f:
+            json.dump(self.names, f, indent=1, sort_keys=True)
+        os.replace(self.names_path + '.tmp', self.names_path)
+
+    # --- Lookups ---
+    def has(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def hash_for(self, name):
+        """SHA-256 of a name if it is still linked to its blob, else None"""
+        with self.lock:
+            sha256 = self.names.get(name)
+        if not sha256:
+            return None
+        try:
+            if os.path.samefile(self._name_path(name), self.blob_path(sha256)):
+                return sha256
+        except OSError:
+            return None
+        return None  # replaced on disk by something else since it was stored
+
+    # --- Storing ---
+    def _link_into_place(self, blob, path):
+        """Atomically point a name at a blob, copying where hard links are unsupported"""
+        tmp_path = path + '.link'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            shutil.copyfile(blob, tmp_path)
+        os.replace(tmp_path, path)
+
+    def adopt(self, name, sha256):
+        """
+        Register an uploaded file under its content hash. If the content is already
+        stored the new copy is replaced by a link to the existing blob (deduplicated).
+        Returns True when the content was a duplicate.
+        """
+        path = self._name_path(name)
+        blob = self.blob_path(sha256)
+        with self.lock:
+            duplicate = os.path.exists(blob)
+            if duplicate:
+                if not os.path.samefile(path, blob):
+                    self._link_into_place(blob, path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    os.link(path, blob)
+                except OSError:
+                    shutil.copyfile(path, blob)
+                # Blobs are shared between names; refuse in-place edits through any of them (the
+                # name is the same inode, so it turns read-only as well). Skipped on Windows, where a
+                # read-only file cannot be replaced by os.replace.
+                if os.name != 'nt':
+                    os.chmod(blob, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            self.names[name] = sha256
+            self._save_names()
+        if duplicate:
+            logger.info(f"Deduplicated upload {name} (content {sha256[:12]} already stored)")
+        return duplicate
+
+    def link_name(self, name, sha256):
+        """Create or replace a name for content that is already stored (instant duplicate upload)"""
+        blob = self.blob_path(sha256)
+        with self.lock:
+            if not os.path.exists(blob):
+                return False
+            self._link_into_place(blob, self._name_path(name))
+            self.names[name] = sha256
+            self._save_names()
+        logger.info(f"Linked {name} to stored content {sha256[:12]}")
+        return True
+
+    def forget_missing(self):
+        """
+        Drop mappings whose names no longer exist and delete blobs nothing refers to.
+        Holds the lock for the whole sweep, so a blob stored meanwhile is never deleted.
+        """
+        with self.lock:
+            gone = [name for name in self.names if not os.path.exists(self._name_path(name))]
+            for name in gone:
+                del self.names[name]
+            if gone:
+                self._save_names()
+            referenced = set(self.names.values())
+            for prefix in os.listdir(self.blobs_dir):
+                prefix_dir = os.path.join(self.blobs_dir, prefix)
+                if not os.path.isdir(prefix_dir):
+                    continue
+                for entry in os.listdir(prefix_dir):
+                    sha256 = entry.split('.', 1)[0]
+                    if sha256 not in referenced:
+                        path = os.path.join(prefix_dir, entry)
+                        os.chmod(path, stat.S_IWUSR | stat.S_IRUSR)
+                        os.remove(path)
+                        self._derived.pop(sha256, None)
+
+    # --- Derived data, computed once per content hash ---
+    def get_derived(self, sha256):
+        with self.lock:
+            derived = self._derived.get(sha256)
+        if derived is not None:
+            return dict(derived)
+        try:
+            with open(self._derived_path(sha256)) as f:
+                derived = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        with self.lock:
+            self._derived[sha256] = derived
+        return dict(derived)
+
+    def put_derived(self, sha256, values):
+        """Merge values into the derived data stored for a hash"""
+        if not self.has(sha256):
+            return
+        with self.lock:
+            derived = self.get_derived(sha256)
+            derived.update(values)
+            self._derived[sha256] = derived
+            tmp_path = self._derived_path(sha256) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(derived, f)
+            os.replace(tmp_path, self._derived_path(sha256))
@@ -0,0 +1,264 @@
+# Resumable Chunked Uploads
+# Large G-code files are sent as independently verified chunks written straight
+# into place, so a dropped connection only costs the chunk that was in flight.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from gcode_storage import compression_for
+from upload_pipeline import CHUNK_SIZE, StreamingUploadAnalyzer, record_analysis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+STALE_SESSION_SECONDS = 24 * 3600
+
+
+def _merge_range(ranges, start, end):
+    """Insert [start, end) into a sorted list of disjoint ranges, coalescing neighbours"""
+    merged = []
+    for r_start, r_end in ranges:
+        if r_end < start or r_start > end:
+            merged.append([r_start, r_end])
+        else:
+            start, end = min(start, r_start), max(end, r_end)
+    merged.append([start, end])
+    merged.sort()
+    return merged
+
+
+def _missing_ranges(ranges, size):
+    missing = []
+    position = 0
+    for r_start, r_end in ranges:
+        if r_start > position:
+            missing.append([position, r_start])
+        position = max(position, r_end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+class ChunkedUploadSession:
+    """One in-progress upload: a preallocated .part file plus the ranges received so far"""
+
+    def __init__(self, upload_id, filename, size, sha256=None, ranges=None, created=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.ranges = ranges or []
+        self.created = created or time.time()
+        self.lock = threading.Lock()
+        # Content analysis follows the contiguous prefix; None after a backend
+        # restart, in which case finalize analyses the assembled file once
+        self.analyzer = StreamingUploadAnalyzer(compression_for(filename)) if not self.ranges else None
+        self.analyzed_upto = 0
+
+    @property
+    def received_bytes(self):
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def is_complete(self):
+        return self.ranges == [[0, self.size]] or (self.size == 0 and not self.ranges)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'sha256': self.sha256,
+            'ranges': self.ranges,
+            'created': self.created,
+        }
+
+    def progress(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'received_bytes': self.received_bytes,
+            'received_ranges': self.ranges,
+            'missing_ranges': _missing_ranges(self.ranges, self.size),
+            'complete': self.is_complete,
+        }
+
+
+class ChunkedUploadManager:
+    """Initiate / put chunk / query / finalize protocol backed by files under uploads/.partial"""
+
+    def __init__(self, uploads_dir):
+        self.uploads_dir = uploads_dir
+        self.partial_dir = os.path.join(uploads_dir, '.partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_dir, f'{upload_id}.part')
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.partial_dir, f'{upload_id}.json')
+
+    def _save_state(self, session):
+        state_path = self._state_path(session.upload_id)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(session.to_dict(), f)
+        os.replace(state_path + '.tmp', state_path)
+
+    def _get_session(self, upload_id):
+        with self.sessions_lock:
+            session = self.sessions.get(upload_id)
+            if session:
+                return session
+            # Resume a session started before a backend restart
+            try:
+                with open(self._state_path(upload_id)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                return None
+            session = ChunkedUploadSession(**state)
+            self.sessions[upload_id] = session
+            return session
+
+    def _remove_session(self, session):
+        with self.sessions_lock:
+            self.sessions.pop(session.upload_id, None)
+        for path in (self._state_path(session.upload_id), self._part_path(session.upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup_stale(self, max_age=STALE_SESSION_SECONDS):
+        """Delete sessions that have not been finalized within max_age seconds"""
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            if not name.endswith(('.json', '.part')):
+                continue
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    logger.info(f"Removed stale partial upload file: {name}")
+            except OSError:
+                continue
+
+    def initiate(self, filename, size, sha256=None):
+        """Start a new upload and preallocate its destination file"""
+        if size < 0:
+            return {'status': 'error', 'message': 'Invalid size', 'code': 400}
+        self.cleanup_stale()
+
+        upload_id = uuid.uuid4().hex
+        session = ChunkedUploadSession(upload_id, filename, size, sha256.lower() if sha256 else None)
+        with open(self._part_path(upload_id), 'wb') as f:
+            f.truncate(size)
+        self._save_state(session)
+        with self.sessions_lock:
+            self.sessions[upload_id] = session
+
+        logger.info(f"Chunked upload {upload_id} started: {filename} ({size} bytes)")
+        return {'status': 'success', 'upload_id': upload_id, 'chunk_size': DEFAULT_CHUNK_SIZE,
+                'max_chunk_size': MAX_CHUNK_SIZE}
+
+    def put_chunk(self, upload_id, offset, data, chunk_sha256=None):
+        """Verify and write one chunk at its offset"""
+        session = self._get_session(upload_id)
+        if not session:
+            return {'status': 'error', 'message': 'Unknown upload', 'code': 404}
+        if offset < 0 or offset + len(data) > session.size:
+            return {'status': 'error', 'message': 'Chunk outside file bounds', 'code': 416}
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            return {'status': 'error', 'message': 'Chunk checksum mismatch', 'code': 422}
+
+        with session.lock:
+            fd = os.open(self._part_path(upload_id), os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                if hasattr(os, 'pwrite'):
+                    os.pwrite(fd, data, offset)
+                else:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    os.write(fd, data)
+            finally:
+                os.close(fd)
+
+            if data:
+                session.ranges = _merge_range(session.ranges, offset, offset + len(data))
+            self._advance_analysis(session, offset, data)
+            self._save_state(session)
+            return dict(status='success', **session.progress())
+
+    def _advance_analysis(self, session, offset, data):
+        """Feed newly contiguous bytes to the analyzer without re-reading in-order data"""
+        if session.analyzer is None:
+            return
+        end = offset + len(data)
+        if offset <= session.analyzed_upto < end:
+            session.analyzer.feed(data[session.analyzed_upto - offset:])
+            session.analyzed_upto = end
+
+        # Chunks that arrived out of order are already on disk; pick them up now
+        contiguous_end = session.ranges[0][1] if session.ranges and session.ranges[0][0] == 0 else 0
+        if contiguous_end > session.analyzed_upto:
+            with open(self._part_path(session.upload_id), 'rb') as f:
+                f.seek(session.analyzed_upto)
+                while session.analyzed_upto < contiguous_end:
+                    chunk = f.read(min(CHUNK_SIZE, contiguous_end - session.analyzed_upto))
+                    if not chunk:
+                        break
+                    session.analyzer.feed(chunk)
+                    session.analyzed_upto += len(chunk)
+
+    def status(self, upload_id):
+        session = self._get_session(upload_id)
+        if not session:
+            return {'status': 'error', 'message': 'Unknown upload', 'code': 404}
+        with session.lock:
+            return dict(status='success', **session.progress())
+
+    def abort(self, upload_id):
+        session = self._get_session(upload_id)
+        if not session:
+            return {'status': 'error', 'message': 'Unknown upload', 'code': 404}
+        with session.lock:
+            self._remove_session(session)
+        logger.info(f"Chunked upload {upload_id} aborted")
+        return {'status': 'success', 'message': 'Upload aborted'}
+
+    def finalize(self, upload_id):
+        """Move a complete upload into place and return its content analysis"""
+        session = self._get_session(upload_id)
+        if not session:
+            return {'status': 'error', 'message': 'Unknown upload', 'code': 404}
+
+        with session.lock:
+            if not session.is_complete:
+                return dict(status='error', message='Upload incomplete', code=409, **session.progress())
+
+            part_path = self._part_path(upload_id)
+            analyzer = session.analyzer
+            if analyzer is None or session.analyzed_upto != session.size:
+                logger.info(f"Chunked upload {upload_id} resumed after restart, analysing assembled file")
+                analyzer = StreamingUploadAnalyzer(compression_for(session.filename))
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        analyzer.feed(chunk)
+
+            digest = analyzer.sha256.hexdigest()
+            if session.sha256 and digest != session.sha256:
+                self._remove_session(session)
+                return {'status': 'error', 'message': 'File checksum mismatch, upload discarded', 'code': 422}
+
+            dest_path = os.path.join(self.uploads_dir, session.filename)
+            os.replace(part_path, dest_path)
+            self._remove_session(session)
+
+        analysis = record_analysis(dest_path, analyzer)
+        logger.info(f"Chunked upload {upload_id} finalized as {session.filename}")
+        return {'status': 'success', 'filename': session.filename, 'analysis': analysis}
@@ -0,0 +1,128 @@
+# G-code Command Filter
+# Drops or rewrites whole G-code lines by their exact command code. The command
+# word of each line is parsed once into (letter, number), so M1 never matches M104
+# or M140 the way a substring test does. The table is applied while a file is
+# analysed at upload (to report what would be filtered) and while a print job's
+# line list is built, never inside the streaming loop. The active table is empty
+# unless configured (intentional M0/M1 pauses in sliced files are kept);
+# app_nuclear uses its own table denying PAUSE_COMMANDS.
+
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Optional line number, then the command word: a letter and number (G29.1) or a host @command
+COMMAND_WORD = re.compile(rb'[ \t]*(?:[Nn]\d+[ \t]*)?(?:([A-Za-z])0*(\d+)(?:\.(\d+))?|@([A-Za-z_]+))')
+COMMAND_WORD_TEXT = re.compile(COMMAND_WORD.pattern.decode())
+# Commands that stop a host-streamed print waiting for the user (or for an SD resume)
+PAUSE_COMMANDS = ('M0', 'M1', 'M25', 'M226', '@PAUSE')
+MAX_REPORTED_LINES = 20
+
+
+def command_code(line):
+    """Normalised command of a raw or text G-code line ('M104', 'G29.1', '@PAUSE'), or None"""
+    match = (COMMAND_WORD if isinstance(line, bytes) else COMMAND_WORD_TEXT).match(line)
+    if not match:
+        return None
+    letter, number, sub, host = match.groups()
+    if isinstance(line, bytes):
+        letter, number, sub, host = (part.decode('ascii') if part else part for part in (letter, number, sub, host))
+    if host:
+        return '@' + host.upper()
+    return f'{letter.upper()}{number}' + (f'.{sub}' if sub else '')
+
+
+def normalise_code(code):
+    """'m01' -> 'M1', '@pause' -> '@PAUSE'; raises ValueError for anything else"""
+    if not COMMAND_WORD_TEXT.fullmatch(code.strip()):
+        raise ValueError(f'Not a G-code command: {code!r}')
+    return command_code(code.strip())
+
+
+class CommandFilter:
+    """Deny/rewrite table keyed by exact command code"""
+
+    def __init__(self, deny=(), rewrite=None):
+        self.rules = dict.fromkeys(normalise_code(code) for code in deny)   # code -> None: drop the line
+        self.rules.update((normalise_code(code), replacement)                 # code -> replacement line
+                          for code, replacement in (rewrite or {}).items())
+
+    @classmethod
+    def load(cls, path, default=None):
+        """Table from a JSON file ({"deny": [...], "rewrite": {code: line}}), or the default"""
+        try:
+            with open(path) as f:
+                return cls(**json.load(f))
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring invalid command filter table {path}: {e}")
+        return default if default is not None else cls()
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def to_dict(self):
+        return {
+            'deny': sorted(code for code, replacement in self.rules.items() if replacement is None),
+            'rewrite': {code: replacement for code, replacement in sorted(self.rules.items())
+                        if replacement is not None},
+        }
+
+    def apply(self, line):
+        """
+        (code, result) for one line: result is the line itself, its replacement, or
+        None when it is dropped. code is None unless a rule matched.
+        """
+        if not self.rules:
+            return None, line
+        code = command_code(line)
+        if code not in self.rules:
+            return None, line
+        replacement = self.rules[code]
+        if replacement is not None and isinstance(line, bytes):
+            replacement = replacement.encode('ascii')
+        return code, replacement
+
+
+class FilterReport:
+    """Which commands a filter removed or rewrote, with the first line numbers of each"""
+
+    def __init__(self):
+        self.commands = {}
+
+    def record(self, code, line_number, rewritten):
+        entry = self.commands.get(code)
+        if entry is None:
+            entry = self.commands[code] = {'action': 'rewrite' if rewritten else 'drop', 'count': 0, 'lines': []}
+        entry['count'] += 1
+        if len(entry['lines']) < MAX_REPORTED_LINES:
+            entry['lines'].append(line_number)
+
+    @property
+    def total(self):
+        return sum(entry['count'] for entry in self.commands.values())
+
+    def as_dict(self):
+        return self.commands
+
+    def summary(self):
+        return ', '.join(f"{code} x{entry['count']} ({entry['action']})" for code, entry in sorted(self.commands.items()))
+
+
+_active = CommandFilter()
+
+
+def active_filter():
+    """The table applied to uploads and print jobs in this process"""
+    return _active
+
+
+def set_active_filter(command_filter):
+    global _active
+    _active = command_filter
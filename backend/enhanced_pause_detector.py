@@ -10,116 +10,145 @@ import re
 import threading
 from collections import deque
 
+from line_noise import CONTROL_BYTES
+
 logger = logging.getLogger(__name__)
 
+CONTROL_CHARS = dict.fromkeys(range(32))
+for _keep in '\t\n\r':
+    del CONTROL_CHARS[ord(_keep)]
+
+# Every keyword in one automaton over the lowercased line. At any position a false
+# positive phrase wins over the pause words it contains, and 'ok' is reported too.
+LINE_PATTERN = re.compile(
+    rb'(?P<false_positive>busy: ok|busy: processing|ok busy)'
+    rb'|(?P<pause>pause|wait|busy processing)'
+    rb'|(?P<ok>ok)'
+)
+RECENT_WINDOW = 5          # responses considered for the "printer is acknowledging fine" check
+RECENT_OK_LIMIT = 3        # this many recent 'ok' lines overrule a pause keyword
+CONFIRMATION_THRESHOLD = 2 # consecutive pause lines needed to report a pause
+MAX_VALID_LENGTH = 100     # longer lines are treated as garbage
+
+
+def clean_line(raw):
+    """Lowercased bytes line without control characters, whitespace collapsed"""
+    return b' '.join(raw.lower().translate(None, CONTROL_BYTES).split())
+
+
+def is_valid_line(cleaned):
+    """Reject empty, overlong and repeated-character (line noise) lines"""
+    length = len(cleaned)
+    if length < 2 or length > MAX_VALID_LENGTH:
+        return False
+    return length <= 10 or len(set(cleaned.replace(b' ', b''))) >= 3
+
+
+def classify_line(cleaned):
+    """'false_positive', 'pause', 'pause_with_ok' or None for a cleaned line"""
+    pause = ok = False
+    for match in LINE_PATTERN.finditer(cleaned):
+        kind = match.lastgroup
+        if kind == 'false_positive':
+            return kind
+        if kind == 'pause':
+            pause = True
+        else:
+            ok = True
+    if pause:
+        return 'pause_with_ok' if ok else 'pause'
+    return None
+
+
+class StreamingPauseDetector:
+    """
+    Incremental pause detector meant to sit inline on every received line: one
+    translate, one split/join and one pattern scan per line, and O(1) state (a ring of
+    the last few 'ok' flags with a running count) instead of copies of the history.
+    """
+
+    def __init__(self):
+        self._recent_ok = [False] * RECENT_WINDOW
+        self._recent_index = 0
+        self.recent_ok_count = 0
+        self.consecutive = 0
+        self.last = None          # True/False for the last valid line, None if it was filtered
+        self.lines = 0
+        self.filtered = 0
+
+    def feed(self, raw):
+        """Process one received line (bytes or str); True once a pause is confirmed"""
+        if not raw:
+            return False
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8', errors='ignore')
+        self.lines += 1
+
+        # The window covers raw lines, filtered ones included
+        has_ok = b'ok' in raw.lower()
+        index = self._recent_index
+        self.recent_ok_count += has_ok - self._recent_ok[index]
+        self._recent_ok[index] = has_ok
+        self._recent_index = (index + 1) % RECENT_WINDOW
+
+        cleaned = clean_line(raw)
+        if not is_valid_line(cleaned):
+            self.filtered += 1
+            self.last = None
+            return False
+
+        self.last = classify_line(cleaned) == 'pause' and self.recent_ok_count < RECENT_OK_LIMIT
+        self.consecutive = self.consecutive + 1 if self.last else 0
+        return self.consecutive >= CONFIRMATION_THRESHOLD
+
+
 class EnhancedPauseDetector:
     def __init__(self, printer):
         self.printer = printer
-        self.pause_keywords = ['paused', 'pause', 'waiting', 'busy processing', 'wait']
-        self.false_positive_keywords = ['busy: ok', 'busy: processing', 'ok busy']
-        self.response_buffer = deque(maxlen=50)  # Keep last 50 responses
+        self.stream = StreamingPauseDetector()
+        self.response_buffer = deque(maxlen=50)  # Keep last 50 responses (diagnostics)
         self.pause_detection_history = deque(maxlen=10)  # Track detection history
-        self.consecutive_pause_detections = 0
         self.last_valid_response_time = time.time()
-        
+
+    @property
+    def consecutive_pause_detections(self):
+        return self.stream.consecutive
+
     def clean_response(self, response):
         """Clean response from potential garbage characters"""
         if not response:
             return ""
-        
-        # Remove control characters except \n, \r, \t
-        cleaned = ''.join(c for c in response if ord(c) >= 32 or c in '\n\r\t')
-        
-        # Remove excessive whitespace
-        cleaned = ' '.join(cleaned.split())
-        
-        return cleaned.strip()
-    
+        if isinstance(response, bytes):
+            response = response.translate(None, CONTROL_BYTES).decode('utf-8', errors='ignore')
+            return ' '.join(response.split())
+        return ' '.join(response.translate(CONTROL_CHARS).split())
+
     def is_response_valid(self, response):
         """Check if response appears to be valid (not garbage)"""
         if not response:
             return False
-        
-        cleaned = self.clean_response(response)
-        
-        # Check for minimum length
-        if len(cleaned) < 2:
-            return False
-        
-        # Check for reasonable character distribution
-        if len(cleaned) > 100:  # Very long responses might be garbage
-            return False
-        
-        # Check for repeated characters (potential garbage)
-        if len(set(cleaned.replace(' ', ''))) < 3 and len(cleaned) > 10:
-            return False
-        
-        return True
-    
+        return is_valid_line(clean_line(response.encode('utf-8', errors='ignore')))
+
     def analyze_pause_legitimacy(self, response):
-        """Analyze if pause detection is legitimate or false positive"""
-        cleaned_response = self.clean_response(response).lower()
-        
-        # Check for explicit false positives
-        for fp_keyword in self.false_positive_keywords:
-            if fp_keyword in cleaned_response:
-                logger.debug(f"False positive pause detection: {response}")
-                return False
-        
-        # Check for legitimate pause indicators
-        pause_score = 0
-        for pause_keyword in self.pause_keywords:
-            if pause_keyword in cleaned_response:
-                pause_score += 1
-        
-        # Additional context analysis
-        if 'ok' in cleaned_response and pause_score > 0:
-            # Response contains both 'ok' and pause keywords - likely false positive
-            logger.debug(f"Mixed signals in response: {response}")
-            return False
-        
-        # Check response history for patterns
-        recent_responses = list(self.response_buffer)[-5:]  # Last 5 responses
-        ok_responses = sum(1 for r in recent_responses if 'ok' in r.lower())
-        
-        if ok_responses >= 3 and pause_score > 0:
-            # Recent 'ok' responses suggest printer is working fine
-            logger.debug(f"Recent OK responses contradict pause detection: {response}")
-            return False
-        
-        return pause_score > 0
-    
+        """Analyze if pause detection is legitimate or false positive (for the line just fed)"""
+        kind = classify_line(clean_line(response.encode('utf-8', errors='ignore')))
+        return kind == 'pause' and self.stream.recent_ok_count < RECENT_OK_LIMIT
+
     def detect_pause_from_response(self, response):
         """Enhanced pause detection with garbage filtering"""
         if not response:
             return False
-        
-        # Store response in buffer
         self.response_buffer.append(response)
-        
-        # Validate response
-        if not self.is_response_valid(response):
-            logger.debug(f"Invalid response filtered: {response}")
-            return False
-        
+        confirmed = self.stream.feed(response)
+        if self.stream.last is None:
+            return False  # filtered as garbage
+
         self.last_valid_response_time = time.time()
-        
-        # Analyze for legitimate pause
-        is_paused = self.analyze_pause_legitimacy(response)
-        
-        # Update detection history
-        self.pause_detection_history.append(is_paused)
-        
-        if is_paused:
-            self.consecutive_pause_detections += 1
-            logger.info(f"Pause detected (#{self.consecutive_pause_detections}): {response}")
-        else:
-            self.consecutive_pause_detections = 0
-        
-        # Require multiple consecutive detections to confirm pause
-        confirmation_threshold = 2
-        return self.consecutive_pause_detections >= confirmation_threshold
-    
+        self.pause_detection_history.append(self.stream.last)
+        if self.stream.last:
+            logger.info("Pause detected (#%d): %s", self.stream.consecutive, response)
+        return confirmed
+
     def is_printer_responsive(self, timeout=5):
         """Check if printer is responsive to commands"""
         try:
@@ -1,11 +1,196 @@
 # Enhanced Print Handler with Nuclear Pause Override
-# This module contains the improved print handling logic with aggressive pause prevention
+# This module contains the improved print handling logic with aggressive pause prevention.
+#
+# Pause recovery is event driven: PauseRecovery watches every received line and only
+# acts when the firmware actually reports a pause (a host action prompt,
+# //action:paused, "busy: paused for user", or pause keywords confirmed by the
+# streaming detector). It then escalates through RECOVERY_TIERS, cheapest first,
+# timing each attempt and counting which tier finally resolved the pause. A tier
+# only counts as resolved once the acks of its own commands are consumed (so the
+# print loop's ok/line pairing is kept) and an M114 position report arrives with
+# no new pause message; when every tier fails, the acks still owed are drained
+# (for up to DRAIN_TIMEOUT) before giving up. The emergency stop (M112/M999) is never sent unless the
+# recovery is created with allow_emergency_stop=True.
 
+import re
 import time
 import logging
+from collections import deque
+
+from enhanced_pause_detector import StreamingPauseDetector
 
 logger = logging.getLogger(__name__)
 
+# Firmware messages that always mean the printer is holding the job
+PAUSE_TRIGGER_PATTERN = re.compile(
+    rb'//action:(?:paused|pause\b|prompt_begin)|paused for user|wait(?:ing)? for user|busy: paused'
+)
+NUCLEAR_COMMANDS = (
+    (b'M112\n', 'Emergency stop (clears all states)'),
+    (b'M999\n', 'Restart after emergency stop'),
+    (b'M412 S0\n', 'Disable filament sensor'),
+    (b'M413 S0\n', 'Disable power recovery'),
+    (b'M108\n', 'Break ANY wait condition'),
+    (b'M24\n', 'Force resume'),
+    (b'G4 P0\n', 'Clear buffer'),
+    (b'M117 NUCLEAR_OVERRIDE\n', 'Set override status'),
+)
+EMERGENCY_COMMANDS = (b'M112\n', b'M999\n')  # halt the firmware; only with allow_emergency_stop
+# Escalation order: (tier name, commands). Each tier is verified before the next is tried.
+RECOVERY_TIERS = (
+    ('break_wait', (b'M108\n',)),
+    ('resume', (b'M24\n',)),
+    ('clear_and_resume', (b'G4 P0\n', b'M24\n')),
+    ('pause_cycle', (b'M25\n', b'M24\n')),
+    ('disable_triggers', (b'M412 S0\n', b'M413 S0\n', b'M155 S0\n', b'M108\n', b'M24\n')),
+    ('nuclear', tuple(command for command, _ in NUCLEAR_COMMANDS)),
+)
+VERIFY_TIMEOUT = 2.0        # seconds to wait for the printer to move on after a tier
+DRAIN_TIMEOUT = 5.0         # seconds to collect the acks still owed after every tier failed
+RECOVERY_LOG_SIZE = 50
+
+
+class PauseRecovery:
+    """
+    Pause recovery state machine: 'watching' until observe() sees a pause, then
+    'recovering' while recover() escalates through the tiers, back to 'watching'
+    once the printer acknowledges again or 'failed' when every tier was tried.
+    """
+
+    def __init__(self, tiers=RECOVERY_TIERS, verify_timeout=VERIFY_TIMEOUT, allow_emergency_stop=False,
+                 drain_timeout=DRAIN_TIMEOUT):
+        if not allow_emergency_stop:
+            tiers = tuple((name, tuple(command for command in commands if command not in EMERGENCY_COMMANDS))
+                          for name, commands in tiers)
+        self.tiers = tiers
+        self.verify_timeout = verify_timeout
+        self.drain_timeout = drain_timeout
+        self.owed_acks = 0  # recovery acks not seen even after draining; the caller may consume them
+        self.detector = StreamingPauseDetector()
+        self.state = 'watching'
+        self.detected = 0
+        self.failed = 0
+        self.tier_stats = {name: {'attempts': 0, 'resolved': 0, 'seconds': 0.0} for name, _ in tiers}
+        self.events = deque(maxlen=RECOVERY_LOG_SIZE)
+
+    def observe(self, response):
+        """Feed one received line; returns what gave the pause away, or None"""
+        raw = response.encode('utf-8', errors='ignore') if isinstance(response, str) else response
+        confirmed = self.detector.feed(raw)
+        trigger = PAUSE_TRIGGER_PATTERN.search(raw.lower())
+        if trigger:
+            return trigger.group().decode('ascii')
+        return 'pause keywords' if confirmed else None
+
+    def _verify(self, printer, outstanding):
+        """
+        Ask for the position and read until the outstanding acks (the tier's commands and
+        the M114) are consumed. Returns (resolved, acks still outstanding): resolved once
+        the position report arrived with no pause message after it.
+        """
+        printer.write(b'M114\n')
+        printer.flush()
+        outstanding += 1
+        position = False
+        deadline = time.monotonic() + self.verify_timeout
+        while time.monotonic() < deadline:
+            if printer.in_waiting == 0:
+                time.sleep(0.01)
+                continue
+            line = printer.readline().strip().lower()
+            if PAUSE_TRIGGER_PATTERN.search(line):
+                position = False  # still (or again) paused; only a later report counts
+                continue
+            if line.startswith(b'ok'):
+                outstanding -= 1
+            if line.startswith(b'x:') or b' x:' in line:
+                position = True
+            if outstanding <= 0 and position:
+                return True, 0
+        return False, max(outstanding, 0)
+
+    def _drain(self, printer, outstanding):
+        """Read (and drop) lines until the outstanding acks arrived or drain_timeout passed"""
+        deadline = time.monotonic() + self.drain_timeout
+        while outstanding > 0 and time.monotonic() < deadline:
+            if printer.in_waiting == 0:
+                time.sleep(0.01)
+                continue
+            if printer.readline().strip().lower().startswith(b'ok'):
+                outstanding -= 1
+        return outstanding
+
+    def recover(self, printer, line_number=0, command='', trigger=''):
+        """Escalate through the tiers until the printer continues; returns True if it did"""
+        self.state = 'recovering'
+        self.detected += 1
+        logger.warning(f"⚠️ Pause detected at line {line_number} ({trigger or 'unknown trigger'}) "
+                       f"after '{command}' - starting recovery")
+        started = time.perf_counter()
+        attempts = []
+        resolved_by = None
+        outstanding = 0  # acks owed for recovery commands; never left for the print loop to take
+        for name, commands in self.tiers:
+            attempt_started = time.perf_counter()
+            try:
+                for tier_command in commands:
+                    printer.write(tier_command)
+                    outstanding += 1
+                printer.flush()
+                resolved, outstanding = self._verify(printer, outstanding)
+            except Exception as e:
+                logger.warning(f"Recovery tier {name} failed: {e}")
+                resolved = False
+            cost = time.perf_counter() - attempt_started
+            stats = self.tier_stats[name]
+            stats['attempts'] += 1
+            stats['seconds'] += cost
+            attempts.append({'tier': name, 'ms': round(cost * 1000, 1), 'resolved': resolved})
+            if resolved:
+                stats['resolved'] += 1
+                resolved_by = name
+                break
+
+        if not resolved_by and outstanding:
+            # Left unread, these oks would be taken as the acks of the following G-code lines
+            try:
+                outstanding = self._drain(printer, outstanding)
+            except Exception as e:
+                logger.warning(f"Draining recovery acks failed: {e}")
+            if outstanding:
+                logger.warning(f"{outstanding} recovery command(s) still unacknowledged after draining")
+        self.owed_acks = outstanding
+
+        elapsed = time.perf_counter() - started
+        self.detector.consecutive = 0
+        self.state = 'watching' if resolved_by else 'failed'
+        if resolved_by:
+            logger.info(f"✅ Pause at line {line_number} resolved by {resolved_by} in {elapsed * 1000:.0f} ms")
+        else:
+            self.failed += 1
+            logger.error(f"❌ All pause recovery tiers failed at line {line_number}")
+        self.events.append({'time': time.time(), 'line': line_number, 'command': command, 'trigger': trigger,
+                            'resolved_by': resolved_by, 'ms': round(elapsed * 1000, 1), 'attempts': attempts,
+                            'owed_acks': outstanding})
+        return resolved_by is not None
+
+    def stats(self):
+        """How often each tier was needed and what it cost"""
+        return {
+            'state': self.state,
+            'detected': self.detected,
+            'failed': self.failed,
+            'tiers': {name: dict(stats, seconds=round(stats['seconds'], 3),
+                                 mean_ms=round(stats['seconds'] / stats['attempts'] * 1000, 1)
+                                 if stats['attempts'] else 0.0)
+                      for name, stats in self.tier_stats.items()},
+            'recent': list(self.events),
+        }
+
+
+default_recovery = PauseRecovery()
+
+
 def nuclear_pause_override(printer):
     """
     Nuclear option for overcoming persistent pause states
@@ -15,18 +200,7 @@ def nuclear_pause_override(printer):
         logger.warning("🚨 IMPLEMENTING NUCLEAR PAUSE OVERRIDE")
         
         # Step 1: Nuclear commands - reset ALL printer states
-        nuclear_commands = [
-            (b'M112\n', 'Emergency stop (clears all states)'),
-            (b'M999\n', 'Restart after emergency stop'),
-            (b'M412 S0\n', 'Disable filament sensor'),
-            (b'M413 S0\n', 'Disable power recovery'),
-            (b'M108\n', 'Break ANY wait condition'),
-            (b'M24\n', 'Force resume'),
-            (b'G4 P0\n', 'Clear buffer'),
-            (b'M117 NUCLEAR_OVERRIDE\n', 'Set override status'),
-        ]
-        
-        for cmd, desc in nuclear_commands:
+        for cmd, desc in NUCLEAR_COMMANDS:
             try:
                 logger.info(f"Nuclear command: {desc}")
                 printer.write(cmd)
@@ -86,132 +260,27 @@ def nuclear_pause_override(printer):
         logger.error(f"Nuclear override failed catastrophically: {nuclear_error}")
         return False
 
-def enhanced_pause_detection_and_override(printer, response, line_number, current_command):
+def enhanced_pause_detection_and_override(printer, response, line_number, current_command, recovery=None):
     """
-    Enhanced pause detection with multiple override strategies
-    Returns True if pause was successfully handled, False if print should stop
+    Pause detection with escalating override strategies
+    Returns True if no pause was detected or it was handled, False if print should stop
     """
-    if not any(pause_keyword in response.lower() for pause_keyword in ['paused for user', 'paused', 'pause', 'wait for user']):
+    recovery = recovery or default_recovery
+    trigger = recovery.observe(response)
+    if not trigger:
         return True  # No pause detected, continue normally
-    
-    logger.warning(f"⚠️  ENHANCED AUTO-PAUSE DETECTED at line {line_number} - IMPLEMENTING COMPREHENSIVE OVERRIDE")
-    logger.warning(f"Pause trigger response: {response}")
-    logger.warning(f"Command that triggered pause: {current_command}")
-    
-    try:
-        # Strategy 1: Standard resume approaches (quick attempt)
-        standard_commands = [
-            (b'M24\n', 'Standard resume'),
-            (b'M108\n', 'Break wait state'),
-            (b'G4 P0\nM24\n', 'Clear state and resume'),
-        ]
-        
-        for cmd_bytes, cmd_desc in standard_commands:
-            logger.info(f"Trying standard approach: {cmd_desc}")
-            printer.write(cmd_bytes)
-            printer.flush()
-            time.sleep(0.3)
-            
-            # Quick verification
-            verification_success = False
-            for _ in range(10):
-                if printer.in_waiting > 0:
-                    check_response = printer.readline().decode().strip()
-                    logger.info(f"Standard verification: {check_response}")
-                    
-                    if ('ok' in check_response.lower() or 
-                        ('x:' in check_response.lower()) or
-                        ('busy' in check_response.lower() and 'paused' not in check_response.lower())):
-                        verification_success = True
-                        logger.info(f"✅ Standard approach successful: {cmd_desc}")
-                        return True
-                    elif 'paused' in check_response.lower():
-                        break  # Still paused, try next approach
-                time.sleep(0.1)
-            
-            if verification_success:
-                return True
-        
-        # Strategy 2: Aggressive hardware override
-        logger.warning("Standard approaches failed, trying aggressive hardware override")
-        aggressive_commands = [
-            (b'M25\nM24\n', 'Explicit pause and resume'),
-            (b'M412 S0\nM24\n', 'Disable sensor and resume'),
-            (b'M413 S0\nM24\n', 'Disable power loss recovery and resume'),
-            (b'M108\nM24\nM24\n', 'Triple command approach'),
-            (b'M155 S0\nM108\nM24\n', 'Disable reporting and resume'),
-        ]
-        
-        for cmd_bytes, cmd_desc in aggressive_commands:
-            logger.info(f"Trying aggressive approach: {cmd_desc}")
-            printer.write(cmd_bytes)
-            printer.flush()
-            time.sleep(0.5)
-            
-            # Enhanced verification
-            verification_attempts = 0
-            verification_success = False
-            
-            while verification_attempts < 15 and not verification_success:
-                verification_attempts += 1
-                
-                # Send status query
-                printer.write(b'M114\n')
-                printer.flush()
-                time.sleep(0.1)
-                
-                # Check responses
-                response_timeout = 0
-                while printer.in_waiting > 0 and response_timeout < 25:
-                    try:
-                        check_response = printer.readline().decode().strip()
-                        logger.info(f"Aggressive verification {verification_attempts}: {check_response}")
-                        
-                        if ('ok' in check_response.lower() or 
-                            'x:' in check_response.lower() or
-                            ('busy' in check_response.lower() and 'paused' not in check_response.lower())):
-                            verification_success = True
-                            logger.info(f"✅ Aggressive approach successful: {cmd_desc}")
-                            return True
-                        elif 'paused' in check_response.lower():
-                            logger.warning(f"Still paused on aggressive attempt {verification_attempts}")
-                            break
-                    except:
-                        pass
-                    
-                    response_timeout += 1
-                    time.sleep(0.05)
-                
-                if verification_success:
-                    return True
-                
-                time.sleep(0.2)
-        
-        # Strategy 3: Nuclear Option (last resort)
-        logger.error("All standard and aggressive approaches failed, deploying nuclear option")
-        nuclear_success = nuclear_pause_override(printer)
-        
-        if nuclear_success:
-            logger.info("🚀 NUCLEAR OVERRIDE SUCCESSFUL - print can continue")
-            return True
-        else:
-            logger.error("❌ ALL OVERRIDE STRATEGIES FAILED - print must stop")
-            return False
-        
-    except Exception as override_error:
-        logger.error(f"Error in enhanced pause override: {override_error}")
-        return False
+    return recovery.recover(printer, line_number, current_command, trigger)
 
-def enhanced_print_monitoring(printer, command, timeout=15):
+def enhanced_print_monitoring(printer, command, timeout=15, recovery=None):
     """
     Enhanced command monitoring with integrated pause detection and override
     """
+    recovery = recovery or default_recovery
     try:
         if not printer or not printer.is_open:
             return {'status': 'error', 'message': 'Printer not connected'}
         
         # Send command
-        logger.info(f"📡 Enhanced monitoring command: {command}")
         printer.write(f'{command}\n'.encode())
         printer.flush()
         
@@ -224,16 +293,15 @@ def enhanced_print_monitoring(printer, command, timeout=15):
                 response = printer.readline().decode('utf-8', errors='ignore').strip()
                 if response:
                     responses.append(response)
-                    logger.debug(f"Monitoring response: {response}")
+                    logger.debug("Monitoring response for %s: %s", command, response)
                     
                     # Check for pause and handle it
-                    if any(pause_keyword in response.lower() for pause_keyword in ['paused for user', 'paused', 'pause', 'wait for user']):
+                    trigger = recovery.observe(response)
+                    if trigger:
                         # Extract line number if available (assuming global line counter)
                         current_line = getattr(enhanced_print_monitoring, 'current_line', 0)
                         
-                        override_success = enhanced_pause_detection_and_override(
-                            printer, response, current_line, command
-                        )
+                        override_success = recovery.recover(printer, current_line, command, trigger)
                         
                         if override_success:
                             # Continue monitoring after successful override
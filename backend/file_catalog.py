@@ -0,0 +1,314 @@
+# Upload Catalog
+# In-memory catalog of uploaded G-code files with slicer metadata, kept current
+# by Linux inotify (or a low-rate polling fallback) instead of per-request listdir.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import struct
+import threading
+import uuid
+import zlib
+
+from gcode_storage import GCODE_EXTENSIONS, open_gcode
+from upload_pipeline import analysis_is_current, analyze_file
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5.0          # seconds between rescans when inotify is unavailable
+HEAD_BYTES = 256 * 1024      # thumbnails and Cura headers live at the start
+TAIL_BYTES = 128 * 1024      # PrusaSlicer statistics and config live at the end
+DERIVED_ANALYSIS_KEYS = {'content_size', 'bounds', 'filtered_commands'}
+DERIVED_METADATA_KEYS = {'nozzle_diameter', 'filament_type'}
+
+# --- Slicer metadata parsing ---
+_DURATION_PART = re.compile(r'(\d+)\s*([dhms])')
+_METADATA_PATTERNS = [
+    # PrusaSlicer / SuperSlicer / OrcaSlicer
+    ('estimated_time', re.compile(rb'^; estimated printing time \(normal mode\) = (.+)$', re.M)),
+    ('filament_mm', re.compile(rb'^; filament used \[mm\] = ([\d.]+)', re.M)),
+    ('filament_g', re.compile(rb'^; (?:total )?filament used \[g\] = ([\d.]+)', re.M)),
+    # Cura
+    ('estimated_seconds', re.compile(rb'^;TIME:(\d+)', re.M)),
+    ('filament_m', re.compile(rb'^;Filament used: ([\d.]+)m', re.M)),
+    ('layer_count', re.compile(rb'^;LAYER_COUNT:(\d+)', re.M)),
+    # Machine and material requirements (PrusaSlicer config block / Cura Griffin header)
+    ('nozzle_diameter', re.compile(rb'^; nozzle_diameter = ([\d.]+)', re.M)),
+    ('nozzle_diameter', re.compile(rb'^;EXTRUDER_TRAIN\.0\.NOZZLE\.DIAMETER:([\d.]+)', re.M)),
+    ('filament_type', re.compile(rb'^; filament_type = ([^;\r\n]+)', re.M)),
+    ('filament_type', re.compile(rb'^;EXTRUDER_TRAIN\.0\.MATERIAL\.NAME:(.+)$', re.M)),
+]
+_THUMBNAIL_MARKER = re.compile(rb'^; thumbnail(?:_\w+)? begin', re.M)
+
+
+def _parse_duration(text):
+    """Convert '1d 2h 3m 4s' style durations to seconds"""
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    return sum(int(value) * units[unit] for value, unit in _DURATION_PART.findall(text))
+
+
+def parse_slicer_metadata(filepath, analysis=None):
+    """
+    Extract print time, filament and thumbnail info from slicer comments (head and tail only).
+    The upload analysis, when given, lets compressed files seek straight to the tail.
+    """
+    size = (analysis or {}).get('content_size') or os.path.getsize(filepath)
+    with open_gcode(filepath) as f:
+        head = f.read(HEAD_BYTES)
+        tail = f.read() if size <= HEAD_BYTES + TAIL_BYTES else b''
+    if size > HEAD_BYTES + TAIL_BYTES:
+        with open_gcode(filepath, size - TAIL_BYTES, (analysis or {}).get('frames')) as f:
+            tail = f.read()
+    text = head + b'\n' + tail
+
+    found = {}
+    for key, pattern in _METADATA_PATTERNS:
+        match = pattern.search(text) if key not in found else None
+        if match:
+            found[key] = match.group(1).decode('ascii', errors='ignore').strip()
+
+    metadata = {
+        'estimated_time': None,
+        'filament_mm': None,
+        'filament_g': None,
+        'layer_count': None,
+        'nozzle_diameter': float(found['nozzle_diameter']) if 'nozzle_diameter' in found else None,
+        'filament_type': found.get('filament_type'),
+        'has_thumbnail': bool(_THUMBNAIL_MARKER.search(head)),
+    }
+    if 'estimated_time' in found:
+        metadata['estimated_time'] = _parse_duration(found['estimated_time'])
+    elif 'estimated_seconds' in found:
+        metadata['estimated_time'] = int(found['estimated_seconds'])
+    if 'filament_mm' in found:
+        metadata['filament_mm'] = float(found['filament_mm'])
+    elif 'filament_m' in found:
+        metadata['filament_mm'] = float(found['filament_m']) * 1000
+    if 'filament_g' in found:
+        metadata['filament_g'] = float(found['filament_g'])
+    if 'layer_count' in found:
+        metadata['layer_count'] = int(found['layer_count'])
+    return metadata
+
+
+# --- Catalog ---
+class FileCatalog:
+    """Name -> metadata entries for the uploads directory with a cheap change token (ETag)"""
+
+    def __init__(self, uploads_dir, blob_store=None):
+        self.uploads_dir = uploads_dir
+        self.blob_store = blob_store
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+        self._instance = uuid.uuid4().hex[:8]  # keeps ETags unique across restarts
+        self._listing = None                   # (etag, entries) rebuilt only after changes
+        self._stop = threading.Event()
+        self._thread = None
+        self.watch_mode = None
+
+    @property
+    def etag(self):
+        return f'{self._instance}-{self.generation}'
+
+    def _changed(self):
+        self.generation += 1
+        self._listing = None
+
+    def listing(self):
+        """Return (etag, sorted list of entries); cheap when nothing changed"""
+        with self.lock:
+            if self._listing is None:
+                entries = sorted(self.entries.values(), key=lambda e: e['name'].lower())
+                public = [{k: v for k, v in e.items() if not k.startswith('_')} for e in entries]
+                self._listing = (self.etag, public)
+            return self._listing
+
+    def contains(self, name):
+        """True if name is a cataloged G-code file (refreshed once if the watcher has not seen it yet)"""
+        with self.lock:
+            if name in self.entries:
+                return True
+        self.refresh_file(name)
+        with self.lock:
+            return name in self.entries
+
+    def _build_entry(self, name, stat, adopt=False):
+        filepath = os.path.join(self.uploads_dir, name)
+        # Content stored in the blob store is analysed once per hash, not once per name
+        sha256 = self.blob_store.hash_for(name) if self.blob_store else None
+        derived = self.blob_store.get_derived(sha256) if sha256 else {}
+        # Entries cached before a field was added, or before the command filter changed, are recomputed once
+        analysis = derived.get('analysis')
+        if not analysis or not DERIVED_ANALYSIS_KEYS.issubset(analysis) or not analysis_is_current(analysis):
+            analysis = analyze_file(filepath)
+        metadata = derived.get('metadata')
+        if not metadata or not DERIVED_METADATA_KEYS.issubset(metadata):
+            metadata = parse_slicer_metadata(filepath, analysis)
+        if self.blob_store:
+            if sha256 is None and adopt:
+                self.blob_store.adopt(name, analysis['sha256'])
+            if analysis is not derived.get('analysis') or metadata is not derived.get('metadata'):
+                self.blob_store.put_derived(analysis['sha256'], {'analysis': analysis, 'metadata': metadata})
+        return {
+            'name': name,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': analysis['sha256'],
+            'estimated_time': metadata['estimated_time'],
+            'filament_mm': metadata['filament_mm'],
+            'filament_g': metadata['filament_g'],
+            'layer_count': metadata['layer_count'] or analysis['layer_count'],
+            'has_thumbnail': metadata['has_thumbnail'],
+            'line_count': analysis['line_count'],
+            'compression': analysis.get('compression'),
+            'bounds': analysis.get('bounds'),
+            'nozzle_diameter': metadata.get('nozzle_diameter'),
+            'filament_type': metadata.get('filament_type'),
+            '_signature': (stat.st_size, stat.st_mtime_ns),
+        }
+
+    def refresh_file(self, name, adopt=False):
+        """Add, update or drop one file after it changed on disk"""
+        if not name.lower().endswith(GCODE_EXTENSIONS):
+            return
+        filepath = os.path.join(self.uploads_dir, name)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            with self.lock:
+                if self.entries.pop(name, None) is not None:
+                    self._changed()
+            return
+
+        with self.lock:
+            current = self.entries.get(name)
+        if current and current['_signature'] == (stat.st_size, stat.st_mtime_ns):
+            return
+        try:
+            entry = self._build_entry(name, stat, adopt)
+        except (OSError, EOFError, ValueError, zlib.error) as e:  # unreadable or corrupt compressed file
+            logger.warning(f"Could not catalog {name}: {e}")
+            return
+        with self.lock:
+            self.entries[name] = entry
+            self._changed()
+
+    def rescan(self, adopt=False):
+        """
+        Reconcile the catalog with the directory, analysing only new or changed files.
+        With adopt=True, files not yet in the blob store (e.g. copied in by hand) are moved into it.
+        """
+        try:
+            names = {n for n in os.listdir(self.uploads_dir) if n.lower().endswith(GCODE_EXTENSIONS)}
+        except OSError as e:
+            logger.warning(f"Catalog rescan failed: {e}")
+            return
+        with self.lock:
+            removed = set(self.entries) - names
+            for name in removed:
+                del self.entries[name]
+            if removed:
+                self._changed()
+        for name in sorted(names):
+            self.refresh_file(name, adopt)
+
+    # --- Change watching ---
+    def start(self):
+        """Scan once and keep the catalog current in a background thread"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._watch, name='file-catalog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        watcher = InotifyWatcher.create(self.uploads_dir)
+        self.watch_mode = 'inotify' if watcher else 'polling'
+        logger.info(f"File catalog watching {self.uploads_dir} using {self.watch_mode}")
+        if self.blob_store:
+            self.blob_store.forget_missing()
+        self.rescan(adopt=True)
+        if watcher:
+            try:
+                while not self._stop.is_set():
+                    names = watcher.read_events(timeout=1.0)
+                    if watcher.overflowed:  # changes were lost: reconcile everything
+                        watcher.overflowed = False
+                        logger.warning(f"inotify queue overflowed, rescanning {self.uploads_dir}")
+                        self.rescan()
+                        with self.lock:
+                            self._changed()  # clients revalidate even if the rescan saw no difference
+                        continue
+                    for name in names:
+                        self.refresh_file(name)
+            finally:
+                watcher.close()
+        else:
+            while not self._stop.wait(POLL_INTERVAL):
+                self.rescan()
+
+
+class InotifyWatcher:
+    """Minimal ctypes binding for inotify on a single directory"""
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000   # always reported: events were dropped, the names read are incomplete
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.overflowed = False   # set when the kernel queue overflowed; the reader rescans and clears it
+
+    @classmethod
+    def create(cls, directory, mask=WATCH_MASK):
+        """Return a watcher, or None when inotify is not available on this platform"""
+        if not os.path.isdir('/proc/sys/fs/inotify'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(os.path.abspath(directory)), mask) < 0:
+                os.close(fd)
+                return None
+            return cls(fd)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, falling back to polling: {e}")
+            return None
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return the set of file names that changed (see overflowed)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset + self._EVENT_HEADER.size <= len(data):
+            _wd, mask, _cookie, length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
@@ -13,6 +13,8 @@ import sys
 import os
 from datetime import datetime
 
+from line_noise import decode_line, noise_count
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -130,19 +132,15 @@ class GarbageValueDiagnostics:
                         raw_data = self.printer.readline()
                         raw_responses.append(raw_data)
                         
-                        # Decode with error handling
-                        try:
-                            decoded_response = raw_data.decode('utf-8', errors='replace').strip()
-                            if decoded_response:
-                                responses.append(decoded_response)
-                                logger.debug(f"📥 Response: '{decoded_response}'")
-                                
-                                # Check for 'ok' acknowledgment
-                                if 'ok' in decoded_response.lower():
-                                    break
-                                    
-                        except UnicodeDecodeError as e:
-                            logger.error(f"❌ Decode error: {e}, Raw data: {raw_data}")
+                        # Garbage bytes are dropped before decoding
+                        decoded_response = decode_line(raw_data)
+                        if decoded_response:
+                            responses.append(decoded_response)
+                            logger.debug(f"📥 Response: '{decoded_response}'")
+                            
+                            # Check for 'ok' acknowledgment
+                            if 'ok' in decoded_response.lower():
+                                break
                             
                     except Exception as e:
                         logger.error(f"❌ Read error: {e}")
@@ -176,22 +174,27 @@ class GarbageValueDiagnostics:
         logger.info(f"  - Post-buffer: {post_buffer} bytes")
         logger.info(f"  - Responses received: {len(responses)}")
         
-        # Check for garbage in responses
-        for i, (response, raw) in enumerate(zip(responses, raw_responses)):
-            logger.debug(f"  Response {i+1}: '{response}' (Raw: {raw})")
+        # Check for garbage in responses (on the raw bytes; responses drops empty lines)
+        noisy = 0
+        for i, raw in enumerate(raw_responses):
+            logger.debug(f"  Response {i+1}: '{decode_line(raw)}' (Raw: {raw})")
             
             # Check for control characters or garbage
-            if any(ord(c) < 32 and c not in '\r\n\t' for c in response):
-                logger.warning(f"⚠️ Response {i+1} contains control characters: {response}")
+            noise = noise_count(raw)
+            if noise:
+                noisy += 1
+                logger.warning(f"⚠️ Response {i+1} contains {noise} garbage byte(s): {raw}")
             
             # Check for incomplete responses
-            if not response.endswith('ok') and 'ok' not in response and command in ['M105', 'M114']:
-                logger.warning(f"⚠️ Response {i+1} may be incomplete: '{response}'")
+            if b'ok' not in raw and command in ['M105', 'M114']:
+                logger.warning(f"⚠️ Response {i+1} may be incomplete: {raw}")
+        if raw_responses:
+            logger.info(f"  - Line noise: {noisy}/{len(raw_responses)} lines")
         
         # Check for missing responses
         if not responses:
             logger.error(f"❌ No responses received for command '{command}'")
-        elif 'ok' not in ' '.join(responses).lower():
+        elif not any(b'ok' in raw.lower() for raw in raw_responses):
             logger.warning(f"⚠️ No 'ok' acknowledgment received for '{command}'")
     
     def test_gcode_file_parsing(self, filename="sample.gcode"):
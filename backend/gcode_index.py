@@ -0,0 +1,167 @@
+# G-code Line Index
+# Maps G-code file line numbers to toolpath segments and layers so the backend
+# can tell the viewer exactly which move the printer has reached.
+
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_right
+
+from gcode_storage import open_gcode_text
+
+# Same coordinate extraction the frontend viewer uses (GcodeViewer3D.parseGcode),
+# so segment numbers line up one-to-one with the viewer's `moves` array.
+_AXIS_PATTERNS = {
+    axis: re.compile(r'%s([-\d.]+)' % axis, re.IGNORECASE) for axis in 'XYZE'
+}
+_NUMBER_PREFIX = re.compile(r'-?\d*\.?\d*')
+
+
+def _parse_float(text):
+    """Parse a number the way JavaScript parseFloat does (longest valid prefix)"""
+    match = _NUMBER_PREFIX.match(text)
+    try:
+        return float(match.group(0)) if match else None
+    except ValueError:
+        return None
+
+
+class GcodeIndex:
+    """Immutable line -> segment -> layer lookup tables for one G-code file"""
+
+    def __init__(self, segment_lines, layer_first_segments, layer_heights, total_lines, bounds=None):
+        self.segment_lines = segment_lines              # file line (1-based) of each segment
+        self.layer_first_segments = layer_first_segments  # first segment index of each layer
+        self.layer_heights = layer_heights              # Z height of each layer
+        self.total_lines = total_lines
+        self.bounds = bounds                            # [min_x, min_y, min_z, max_x, max_y, max_z] of extrusion
+
+    @property
+    def total_segments(self):
+        return len(self.segment_lines)
+
+    @property
+    def total_layers(self):
+        return len(self.layer_first_segments)
+
+    def segment_for_line(self, line_number):
+        """Index of the last segment at or before a file line, -1 if none yet"""
+        return bisect_right(self.segment_lines, line_number) - 1
+
+    def layer_for_segment(self, segment):
+        """Index of the layer containing a segment, -1 if before the first layer"""
+        if segment < 0:
+            return -1
+        return bisect_right(self.layer_first_segments, segment) - 1
+
+    def position_for_line(self, line_number):
+        """Resolve an acknowledged file line to segment/layer information"""
+        segment = self.segment_for_line(line_number)
+        layer = self.layer_for_segment(segment)
+        return {
+            'line': line_number,
+            'segment': segment,
+            'total_segments': self.total_segments,
+            'layer': layer,
+            'total_layers': self.total_layers,
+            'z': self.layer_heights[layer] if layer >= 0 else None,
+        }
+
+
+class GcodeIndexBuilder:
+    """Incrementally builds a GcodeIndex while a file is being read line by line"""
+
+    def __init__(self):
+        self.segment_lines = array('I')
+        self.layer_first_segments = array('I')
+        self.layer_heights = []
+        self.total_lines = 0
+        self.bounds = None
+        self._x = self._y = self._z = self._e = 0.0
+
+    def feed_line(self, line_number, line):
+        """Feed one raw file line (1-based line number)"""
+        self.total_lines = line_number
+        trimmed = line.strip()
+        if not trimmed.startswith(('G0', 'G1')):
+            return
+
+        position = {'X': self._x, 'Y': self._y, 'Z': self._z, 'E': self._e}
+        for axis in 'XYZE':
+            match = _AXIS_PATTERNS[axis].search(trimmed)
+            if match:
+                value = _parse_float(match.group(1))
+                if value is not None:
+                    position[axis] = value
+        x, y, z, e = position['X'], position['Y'], position['Z'], position['E']
+        is_extrusion = e > self._e
+
+        if (x, y, z) != (self._x, self._y, self._z):
+            segment = len(self.segment_lines)
+            self.segment_lines.append(line_number)
+            # Layers change on the first extruding move at a new height, so
+            # Z-hops and start-gcode lifts (travel only) don't count as layers
+            if is_extrusion and (not self.layer_heights or z != self.layer_heights[-1]):
+                self.layer_first_segments.append(segment)
+                self.layer_heights.append(z)
+            if is_extrusion:
+                self._extend_bounds(self._x, self._y, self._z)
+                self._extend_bounds(x, y, z)
+
+        self._x, self._y, self._z, self._e = x, y, z, e
+
+    def _extend_bounds(self, x, y, z):
+        if self.bounds is None:
+            self.bounds = [x, y, z, x, y, z]
+            return
+        bounds = self.bounds
+        bounds[0], bounds[1], bounds[2] = min(bounds[0], x), min(bounds[1], y), min(bounds[2], z)
+        bounds[3], bounds[4], bounds[5] = max(bounds[3], x), max(bounds[4], y), max(bounds[5], z)
+
+    def build(self):
+        return GcodeIndex(self.segment_lines, self.layer_first_segments,
+                          self.layer_heights, self.total_lines, self.bounds)
+
+
+def build_index(filepath):
+    """Build an index by reading a G-code file once"""
+    builder = GcodeIndexBuilder()
+    with open_gcode_text(filepath) as f:
+        for line_number, line in enumerate(f, 1):
+            builder.feed_line(line_number, line)
+    return builder.build()
+
+
+# --- Index cache keyed by path, invalidated on size/mtime change ---
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def store_index(filepath, index):
+    """Cache an index that was built elsewhere (e.g. during a print or upload pass)"""
+    try:
+        signature = _file_signature(filepath)
+    except OSError:
+        return
+    with _index_cache_lock:
+        _index_cache[os.path.abspath(filepath)] = (signature, index)
+
+
+def get_index(filepath):
+    """Return a cached index for a file, building it if missing or stale"""
+    key = os.path.abspath(filepath)
+    signature = _file_signature(filepath)
+    with _index_cache_lock:
+        cached = _index_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    index = build_index(filepath)
+    with _index_cache_lock:
+        _index_cache[key] = (signature, index)
+    return index
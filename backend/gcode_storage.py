@@ -0,0 +1,178 @@
+# Compressed G-code Storage
+# G-code may be stored as .gcode.gz / .gcode.zst and is decompressed on the fly with
+# bounded buffers. Files are written as a series of independent gzip members / zstd
+# frames, and the recorded frame start offsets let readers jump to any byte offset
+# of the G-code without decompressing from the beginning.
+
+import gzip
+import io
+import zlib
+from bisect import bisect_right
+
+try:
+    import zstandard
+except ImportError:  # optional: .gcode.zst support needs `pip install zstandard`
+    zstandard = None
+
+GCODE_EXTENSIONS = ('.gcode', '.gco', '.gcode.gz', '.gcode.zst')
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+FRAME_SIZE = 1024 * 1024      # uncompressed bytes per independently decodable frame
+OUTPUT_CHUNK = 64 * 1024      # largest piece of decompressed data handed out at once
+# zstd input is fed this much at a time: python-zstandard's decompressobj has no output
+# limit, but a block (at most 128 KiB of output) takes at least 4 bytes of input, so a
+# slice decompresses to at most ~4 MiB however compressible the data is
+ZSTD_INPUT_SLICE = 128
+
+
+def is_gcode_filename(filename):
+    return filename.lower().endswith(GCODE_EXTENSIONS)
+
+
+def compression_for(filename):
+    """'gzip', 'zstd' or None, from the file name"""
+    for suffix, method in COMPRESSION_SUFFIXES.items():
+        if filename.lower().endswith(suffix):
+            return method
+    return None
+
+
+def compression_supported(filename):
+    """False for a compressed name whose codec is not installed (.zst without zstandard)"""
+    return compression_for(filename) != 'zstd' or zstandard is not None
+
+
+def _require(method):
+    if method == 'zstd' and zstandard is None:
+        raise ValueError('zstd-compressed G-code requires the zstandard package')
+
+
+class StreamDecompressor:
+    """
+    Incremental decompressor for a stream of gzip members or zstd frames.
+    Records [uncompressed_offset, compressed_offset] at the start of every frame.
+    """
+
+    def __init__(self, method):
+        _require(method)
+        self.method = method
+        self.frames = [[0, 0]]
+        self.compressed_pos = 0
+        self.content_pos = 0
+        self._obj = self._new_frame()
+
+    def _new_frame(self):
+        if self.method == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    @property
+    def at_frame_end(self):
+        return self._obj.eof
+
+    def _zstd_step(self, data):
+        """Decompress slices of data until about OUTPUT_CHUNK bytes came out; returns (output, rest)"""
+        pieces, size, pos = [], 0, 0
+        while pos < len(data) and size < OUTPUT_CHUNK and not self._obj.eof:
+            piece = self._obj.decompress(data[pos:pos + ZSTD_INPUT_SLICE])
+            pos += ZSTD_INPUT_SLICE
+            pieces.append(piece)
+            size += len(piece)
+        rest = data[pos:]
+        if self._obj.eof and self._obj.unused_data:
+            rest = self._obj.unused_data + bytes(rest)  # the next frame starts inside the last slice
+        return b''.join(pieces), rest
+
+    def decompress(self, data):
+        """Yield the decompressed pieces of data, each at most OUTPUT_CHUNK bytes"""
+        data = memoryview(data)
+        while True:
+            if data and self._obj.eof:
+                self.frames.append([self.content_pos, self.compressed_pos])
+                self._obj = self._new_frame()
+
+            if self.method == 'gzip':
+                out = self._obj.decompress(data, OUTPUT_CHUNK)
+                rest = self._obj.unused_data if self._obj.eof else self._obj.unconsumed_tail
+            else:
+                out, rest = self._zstd_step(data)
+            self.compressed_pos += len(data) - len(rest)
+            data = memoryview(rest)
+
+            for start in range(0, len(out), OUTPUT_CHUNK):
+                piece = out[start:start + OUTPUT_CHUNK]
+                self.content_pos += len(piece)
+                yield piece
+            if not data and len(out) < OUTPUT_CHUNK:
+                return
+
+
+class FrameCompressor:
+    """Compresses a stream into independent frames of FRAME_SIZE uncompressed bytes"""
+
+    def __init__(self, method, frame_size=FRAME_SIZE):
+        _require(method)
+        self.method = method
+        self.frame_size = frame_size
+        self._pending = bytearray()
+        self._zstd = zstandard.ZstdCompressor(level=10) if method == 'zstd' else None
+
+    def _compress_frame(self, data):
+        if self.method == 'gzip':
+            return gzip.compress(bytes(data), compresslevel=6, mtime=0)
+        return self._zstd.compress(bytes(data))
+
+    def compress(self, data):
+        """Return the compressed frames completed by data (possibly b'')"""
+        self._pending += data
+        frames = []
+        while len(self._pending) >= self.frame_size:
+            frames.append(self._compress_frame(self._pending[:self.frame_size]))
+            del self._pending[:self.frame_size]
+        return b''.join(frames)
+
+    def flush(self):
+        data, self._pending = self._pending, bytearray()
+        return self._compress_frame(data) if data else b''
+
+
+def _skip(reader, count):
+    while count > 0:
+        skipped = len(reader.read(min(count, OUTPUT_CHUNK)))
+        if not skipped:
+            break
+        count -= skipped
+
+
+def open_gcode(filepath, start=0, frames=None):
+    """
+    Open a G-code file for binary reading of its (decompressed) content from byte
+    offset start. With the frame index from the upload analysis only the frame
+    containing start is decompressed up to that offset; otherwise everything before it.
+    """
+    method = compression_for(filepath)
+    raw = open(filepath, 'rb')
+    if method is None:
+        raw.seek(start)
+        return raw
+    try:
+        _require(method)
+        frame_start = 0
+        if frames and start:
+            frame_start, compressed_offset = frames[bisect_right(frames, [start, float('inf')]) - 1]
+            raw.seek(compressed_offset)
+        if method == 'gzip':
+            reader = gzip.GzipFile(fileobj=raw, mode='rb')
+            reader.myfileobj = raw  # closing the GzipFile then closes the underlying file too
+        else:
+            reader = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True, closefd=True), OUTPUT_CHUNK)
+    except Exception:
+        raw.close()
+        raise
+    _skip(reader, start - frame_start)
+    return reader
+
+
+def open_gcode_text(filepath):
+    """Text-mode reader over a possibly compressed G-code file"""
+    return io.TextIOWrapper(open_gcode(filepath), encoding='utf-8', errors='replace')
@@ -0,0 +1,108 @@
+# Hot-Path Logging
+# Logging for code that runs once per G-code line or received response.
+# start_queue_logging() puts the root handlers behind a queue, so formatting and
+# console/file I/O happen on a listener thread instead of the streamer. A
+# HotPathLogger keeps per-line detail unformatted in a ring buffer that is written
+# out only when something goes wrong (dump_trace), and rate-limits and samples
+# repetitive categories, reporting how many records it skipped.
+
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
+import time
+
+TRACE_SIZE = 2000                  # per-line entries kept for dump_trace
+DEFAULT_LIMIT = (5, 1)             # (records per second, keep 1 in N) for categories without a limit
+
+_listener = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands records over unformatted; the listener in this process formats them"""
+
+    def prepare(self, record):
+        return record
+
+
+def start_queue_logging():
+    """Move the root logger's handlers behind a queue and a listener thread (once per process)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    records = queue.SimpleQueue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class _Trace:
+    """Trace entries formatted only when a handler turns the record into text"""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __str__(self):
+        lines = []
+        for stamp, message, args in self.entries:
+            try:
+                text = message % args if args else message
+            except (TypeError, ValueError):
+                text = f'{message} {args!r}'
+            clock = time.strftime('%H:%M:%S', time.localtime(stamp))
+            lines.append(f"  {clock}.{int(stamp % 1 * 1000):03d} {text}")
+        return '\n'.join(lines)
+
+
+class HotPathLogger:
+    """
+    Wrapper around a logger for per-line code: trace() only records, log() also emits
+    subject to the category's limit of (records per second, keep 1 in N).
+    """
+
+    def __init__(self, logger, trace_size=TRACE_SIZE, limits=None):
+        self.logger = logger
+        self.limits = dict(limits or {})
+        self.entries = collections.deque(maxlen=trace_size)
+        self._categories = {}   # category -> [window start, emitted in window, seen, suppressed]
+
+    def trace(self, message, *args):
+        """Keep a %-style entry for dump_trace; nothing is formatted now"""
+        self.entries.append((time.time(), message, args))
+
+    def log(self, category, level, message, *args):
+        """Trace the entry and emit it unless the category is over its rate or not sampled"""
+        self.entries.append((time.time(), message, args))
+        if not self.logger.isEnabledFor(level):
+            return
+        state = self._categories.get(category)
+        if state is None:
+            state = self._categories[category] = [0.0, 0, 0, 0]
+        per_second, sample_every = self.limits.get(category, DEFAULT_LIMIT)
+        state[2] += 1
+        now = time.monotonic()
+        if now - state[0] >= 1.0:
+            state[0], state[1] = now, 0
+        if (sample_every > 1 and state[2] % sample_every) or state[1] >= per_second:
+            state[3] += 1
+            return
+        state[1] += 1
+        if state[3]:
+            message += ' (%d similar suppressed)'
+            args += (state[3],)
+            state[3] = 0
+        self.logger.log(level, message, *args)
+
+    def dump_trace(self, reason, level=logging.ERROR):
+        """Emit the buffered entries in one record (formatted by the handler) and start over"""
+        entries = list(self.entries)
+        self.entries.clear()
+        if entries:
+            self.logger.log(level, "%s - last %d trace entries:\n%s", reason, len(entries), _Trace(entries))
@@ -9,6 +9,11 @@ import re
 import logging
 import serial.tools.list_ports
 import hashlib
+from werkzeug.utils import secure_filename
+
+from upload_pipeline import save_upload_stream
+from line_noise import NoiseMeter, has_control_bytes
+from hot_log import start_queue_logging
 
 app = Flask(__name__)
 CORS(app)
@@ -16,6 +21,7 @@ CORS(app)
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+start_queue_logging()  # handlers run on a listener thread, not the print loop
 
 # --- Setup ---
 UPLOADS_DIR = 'uploads'
@@ -35,6 +41,7 @@ PRINT_ERROR = None
 # --- Command verification and cleanup ---
 LAST_COMMAND_CHECKSUM = None
 BUFFER_CLEANUP_COUNTER = 0
+RX_NOISE = NoiseMeter()  # line noise received on the current connection
 
 def calculate_command_checksum(command):
     """Calculate checksum for command verification"""
@@ -52,9 +59,9 @@ def safe_buffer_clear(max_attempts=50):
         try:
             data = printer.readline()
             if data:
-                decoded = data.decode('utf-8', errors='replace').strip()
+                decoded = RX_NOISE.decode(data)
                 cleared_data.append(decoded)
-                logger.debug(f"Buffer cleanup #{BUFFER_CLEANUP_COUNTER}: {decoded}")
+                logger.debug("Buffer cleanup #%d: %s", BUFFER_CLEANUP_COUNTER, decoded)
             attempts += 1
         except Exception as e:
             logger.warning(f"Buffer clear error: {e}")
@@ -88,7 +95,7 @@ def enhanced_command_send(command, timeout=10, expected_response="ok"):
         # Prepare command with proper encoding
         encoded_command = command.encode('utf-8', errors='replace') + b'\n'
         
-        logger.debug(f"Sending command: '{command}' (checksum: {command_checksum})")
+        logger.debug("Sending command: '%s' (checksum: %s)", command, command_checksum)
         
         # Send command with error checking
         bytes_written = printer.write(encoded_command)
@@ -106,10 +113,10 @@ def enhanced_command_send(command, timeout=10, expected_response="ok"):
                 try:
                     raw_response = printer.readline()
                     if raw_response:
-                        decoded_response = raw_response.decode('utf-8', errors='replace').strip()
+                        decoded_response = RX_NOISE.decode(raw_response)
                         if decoded_response:
                             responses.append(decoded_response)
-                            logger.debug(f"Response: '{decoded_response}'")
+                            logger.debug("Response: '%s'", decoded_response)
                             
                             # Check for expected acknowledgment
                             if expected_response.lower() in decoded_response.lower():
@@ -155,33 +162,28 @@ def get_printer_response():
     return responses
 
 def validate_gcode_line(line):
-    """Validate G-code line for potential garbage data"""
-    if not line or not line.strip():
-        return False
-    
+    """Validate a raw (bytes) G-code line for potential garbage data"""
     line = line.strip()
+    if not line:
+        return False
     
     # Skip comments
-    if line.startswith(';'):
+    if line.startswith(b';'):
         return False
     
     # Check for basic G-code format
-    if not re.match(r'^[GMTFS]\d+', line.upper()):
-        # Allow some non-standard but valid commands
-        if not any(line.upper().startswith(prefix) for prefix in ['M', 'G', 'T', 'F', 'S']):
-            logger.warning(f"Potentially invalid G-code line: '{line}'")
-            return False
+    if line[:1].upper() not in (b'G', b'M', b'T', b'F', b'S'):
+        logger.warning(f"Potentially invalid G-code line: {line!r}")
+        return False
     
     # Check for suspicious characters
-    if any(ord(c) < 32 and c not in '\r\n\t' for c in line):
-        logger.warning(f"Control characters detected in line: '{line}'")
+    if has_control_bytes(line):
+        logger.warning(f"Control characters detected in line: {line!r}")
         return False
     
     # Check for encoding issues
-    try:
-        line.encode('ascii')
-    except UnicodeEncodeError:
-        logger.warning(f"Non-ASCII characters in line: '{line}'")
+    if not line.isascii():
+        logger.warning(f"Non-ASCII characters in line: {line!r}")
         # Still allow but log the issue
     
     return True
@@ -189,7 +191,7 @@ def validate_gcode_line(line):
 # --- API Endpoints ---
 @app.route('/api/connect', methods=['POST'])
 def connect_printer():
-    global printer, BUFFER_CLEANUP_COUNTER
+    global printer, BUFFER_CLEANUP_COUNTER, RX_NOISE
     
     if printer and printer.is_open: 
         return jsonify(status='success', message='Already connected.')
@@ -216,6 +218,7 @@ def connect_printer():
         
         time.sleep(3)  # Give printer time to initialize
         BUFFER_CLEANUP_COUNTER = 0
+        RX_NOISE = NoiseMeter()
         safe_buffer_clear()  # Initial cleanup
         
         logger.info(f"Successfully connected to printer on {port}")
@@ -339,6 +342,19 @@ def get_status():
         return jsonify(status='error', message=f'Status check failed: {str(e)}'), 500
 
 # --- File Management API ---
+def upload_response(filename, analysis):
+    """Build the upload reply from the analysis computed while streaming"""
+    status_msg = f'File {filename} uploaded.'
+    if analysis['validation_issues']:
+        status_msg += f" Warning: {analysis['validation_issues']} potentially problematic lines detected."
+    
+    return jsonify(
+        status='success',
+        message=status_msg,
+        validation_issues=analysis['validation_issues'],
+        analysis=analysis
+    )
+
 @app.route('/api/files', methods=['GET'])
 def list_files():
     files = [f for f in os.listdir(UPLOADS_DIR) if f.endswith(('.gcode', '.gco'))]
@@ -353,35 +369,26 @@ def upload_file():
     if file and file.filename.endswith(('.gcode', '.gco')):
         filepath = os.path.join(UPLOADS_DIR, file.filename)
         
-        # Save and validate file
-        file.save(filepath)
-        
-        # Quick validation of uploaded file
-        validation_issues = []
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                lines = f.readlines()[:100]  # Check first 100 lines
-                
-            for i, line in enumerate(lines):
-                if not validate_gcode_line(line):
-                    validation_issues.append(f"Line {i+1}: {line.strip()[:50]}")
-                    
-        except Exception as e:
-            validation_issues.append(f"File read error: {e}")
-        
-        status_msg = f'File {file.filename} uploaded.'
-        if validation_issues:
-            status_msg += f' Warning: {len(validation_issues)} potentially problematic lines detected.'
-            logger.warning(f"File validation issues in {file.filename}: {validation_issues[:5]}")
-        
-        return jsonify(
-            status='success',
-            message=status_msg,
-            validation_issues=len(validation_issues)
-        )
+        # Save, hash and validate in a single streaming pass
+        analysis = save_upload_stream(file.stream, filepath)
+        return upload_response(file.filename, analysis)
     
     return jsonify(status='error', message='Invalid file type.'), 400
 
+@app.route('/api/upload/stream/<filename>', methods=['PUT', 'POST'])
+def upload_file_stream(filename):
+    """Streams a raw request body to disk, validating it in the same pass"""
+    filename = secure_filename(filename)
+    if not filename.endswith(('.gcode', '.gco')):
+        return jsonify(status='error', message='Invalid file type.'), 400
+    
+    try:
+        analysis = save_upload_stream(request.stream, os.path.join(UPLOADS_DIR, filename))
+        return upload_response(filename, analysis)
+    except Exception as e:
+        logger.error(f"Streamed upload failed for {filename}: {str(e)}")
+        return jsonify(status='error', message=f'Upload failed: {str(e)}'), 500
+
 # --- Legacy G-code serving for 3D viewer ---
 @app.route('/api/gcode/<filename>', methods=['GET'])
 def get_gcode(filename):
@@ -404,7 +411,7 @@ def print_job_thread(filepath):
         PRINT_ERROR = None
         
         # Read and validate G-code file
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+        with open(filepath, 'rb') as f:
             all_lines = f.readlines()
         
         gcode_lines = []
@@ -412,8 +419,8 @@ def print_job_thread(filepath):
         
         for i, line in enumerate(all_lines):
             if validate_gcode_line(line):
-                gcode_lines.append(line.strip())
-            elif line.strip() and not line.strip().startswith(';'):
+                gcode_lines.append(line.strip().decode('utf-8', errors='replace'))  # only valid lines are decoded
+            elif line.strip() and not line.strip().startswith(b';'):
                 invalid_lines.append((i+1, line.strip()[:50]))
         
         if invalid_lines:
@@ -475,7 +482,7 @@ def print_job_thread(filepath):
 
             # Send command with enhanced error checking
             try:
-                logger.debug(f"Sending line {i+1}/{TOTAL_LINES}: {line}")
+                logger.debug("Sending line %d/%d: %s", i + 1, TOTAL_LINES, line)
                 result = enhanced_command_send(line, timeout=timeout_seconds)
                 
                 if not result['success']:
@@ -651,7 +658,8 @@ def get_buffer_status():
         status='success',
         in_waiting=printer.in_waiting,
         buffer_cleanups=BUFFER_CLEANUP_COUNTER,
-        last_checksum=LAST_COMMAND_CHECKSUM
+        last_checksum=LAST_COMMAND_CHECKSUM,
+        line_noise=RX_NOISE.stats()
     )
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+# Farm Job Placement
+# Plans which printer each queued job should run on so the farm finishes its
+# queue as early as possible. Durations come from slicer time estimates, busy
+# printers become available at their current job's ETA, and jobs only go to
+# printers whose build volume, nozzle and loaded material suit the file.
+# The plan is recomputed on every scheduler pass, so prints that end early, fail
+# or are cancelled immediately move the remaining jobs.
+
+import time
+
+CHANGEOVER_SECONDS = 300          # part removal and bed check between two jobs
+FALLBACK_SECONDS_PER_LINE = 0.05  # duration guess for files without a slicer estimate
+VOLUME_TOLERANCE = 0.5            # mm a file may exceed the nominal build volume by
+NOZZLE_TOLERANCE = 0.01
+
+
+def job_duration(entry):
+    """(seconds, source) for a catalog entry"""
+    if entry.get('estimated_time'):
+        return entry['estimated_time'], 'slicer'
+    return entry.get('line_count', 0) * FALLBACK_SECONDS_PER_LINE, 'line_count'
+
+
+def constraint_violation(session, entry):
+    """Why a printer cannot run a file, or None if it can (unknown values never block)"""
+    bounds = entry.get('bounds')
+    if session.build_volume and bounds:
+        for axis, size, extent in zip('XYZ', session.build_volume, bounds['max']):
+            if extent > size + VOLUME_TOLERANCE:
+                return f'{axis} extent {extent:g} mm exceeds build volume {size:g} mm'
+    nozzle = entry.get('nozzle_diameter')
+    if session.nozzle_diameter and nozzle and abs(session.nozzle_diameter - nozzle) > NOZZLE_TOLERANCE:
+        return f'sliced for {nozzle:g} mm nozzle, printer has {session.nozzle_diameter:g} mm'
+    material = entry.get('filament_type')
+    if session.material and material and session.material.lower() != material.lower():
+        return f'sliced for {material}, printer has {session.material} loaded'
+    return None
+
+
+class PlacementEngine:
+    """Greedy earliest-finish placement of queued jobs over the registered printers"""
+
+    def __init__(self, queue, registry, catalog):
+        self.queue = queue
+        self.registry = registry
+        self.catalog = catalog
+        self.last_plan = None
+
+    def _entry(self, filename):
+        with self.catalog.lock:
+            return self.catalog.entries.get(filename)
+
+    def remaining_seconds(self, session, now):
+        """ETA of the printer's current print, from the slicer estimate scaled by line progress"""
+        if not session.is_printing:
+            return 0.0
+        fraction = session.print_progress / session.total_lines if session.total_lines else 0.0
+        entry = self._entry(session.current_file)
+        if entry and entry.get('estimated_time'):
+            return entry['estimated_time'] * (1.0 - fraction)
+        elapsed = now - session.print_started if session.print_started else 0.0
+        if fraction > 0.01:
+            return elapsed * (1.0 - fraction) / fraction
+        return job_duration(entry)[0] if entry else 0.0
+
+    def plan(self):
+        """
+        Walk queued jobs in dispatch order (priority, then position) and give each to
+        the eligible printer on which it would finish first. Times are seconds from now.
+        """
+        now = time.time()
+        printers = {}
+        for session in self.registry.all():
+            if not session.is_connected:
+                continue
+            busy_for = self.remaining_seconds(session, now)
+            available = busy_for + (CHANGEOVER_SECONDS if session.is_printing or not session.bed_clear else 0)
+            printers[session.printer_id] = {'session': session, 'busy_for': busy_for,
+                                            'available_in': available, 'jobs': []}
+
+        assignments, unplaceable = [], []
+        for job in self.queue.list_jobs():
+            if job['status'] != 'queued':
+                continue
+            entry = self._entry(job['filename'])
+            if entry is None:
+                unplaceable.append({'job_id': job['id'], 'filename': job['filename'],
+                                    'reasons': {'*': 'file not in catalog'}})
+                continue
+            duration, source = job_duration(entry)
+
+            best, reasons = None, {}
+            for printer_id, state in printers.items():
+                if job['printer_id'] and job['printer_id'] != printer_id:
+                    continue
+                reason = constraint_violation(state['session'], entry)
+                if reason:
+                    reasons[printer_id] = reason
+                elif best is None or state['available_in'] < printers[best]['available_in']:
+                    best = printer_id
+            if best is None:
+                if job['printer_id'] and job['printer_id'] not in printers:
+                    reasons[job['printer_id']] = 'printer not connected'
+                unplaceable.append({'job_id': job['id'], 'filename': job['filename'],
+                                    'reasons': reasons or {'*': 'no printer connected'}})
+                continue
+
+            state = printers[best]
+            start = state['available_in']
+            state['available_in'] = start + duration + CHANGEOVER_SECONDS
+            state['jobs'].append(job['id'])
+            assignments.append({
+                'job_id': job['id'],
+                'filename': job['filename'],
+                'printer_id': best,
+                'start_in': round(start),
+                'finish_in': round(start + duration),
+                'duration': round(duration),
+                'duration_source': source,
+            })
+
+        # Time until the last planned job, or the last running print, ends
+        finishes = [a['finish_in'] for a in assignments] + [round(p['busy_for']) for p in printers.values()]
+        plan = {
+            'generated': now,
+            'assignments': assignments,
+            'unplaceable': unplaceable,
+            'printers': {pid: {'available_in': round(state['available_in']), 'jobs': state['jobs']}
+                         for pid, state in printers.items()},
+            'makespan': max(finishes) if finishes else 0,
+        }
+        self.last_plan = plan
+        return plan
+
+    @staticmethod
+    def next_job_id(plan, printer_id):
+        """First job the plan puts on a printer"""
+        for assignment in plan['assignments']:
+            if assignment['printer_id'] == printer_id:
+                return assignment['job_id']
+        return None
@@ -0,0 +1,231 @@
+# Print Job Queue
+# Durable queue of print jobs in SQLite, plus a scheduler thread that starts the
+# next job on any idle printer once its bed has been confirmed clear. Jobs target
+# one printer or any printer; higher priority first, then queue position.
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_INTERVAL = 2.0   # seconds between scheduler passes when nothing wakes it
+FINISHED_HISTORY = 50      # finished jobs returned by list_jobs
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    printer_id TEXT,                -- NULL: any printer
+    priority INTEGER NOT NULL DEFAULT 0,
+    position REAL NOT NULL,         -- order within a priority; fractional so moves touch one row
+    status TEXT NOT NULL DEFAULT 'queued',
+    assigned_printer TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority DESC, position);
+CREATE INDEX IF NOT EXISTS jobs_tail ON jobs (status, position);  -- MAX(position) of queued jobs for enqueue
+"""
+
+
+class JobQueue:
+    """SQLite-backed job store; every queue operation touches O(1) rows via the jobs_next/jobs_tail indexes"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(_SCHEMA)
+        # Jobs that were printing when the backend stopped cannot be resumed blindly
+        self.db.execute("UPDATE jobs SET status='failed', error='Backend restarted during print', "
+                        "finished=? WHERE status='printing'", (time.time(),))
+        self.db.commit()
+
+    def _get(self, job_id):
+        row = self.db.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get(self, job_id):
+        with self.lock:
+            return self._get(job_id)
+
+    def enqueue(self, filename, printer_id=None, priority=0):
+        with self.lock:
+            last = self.db.execute("SELECT MAX(position) FROM jobs WHERE status='queued'").fetchone()[0]
+            cursor = self.db.execute(
+                'INSERT INTO jobs (filename, printer_id, priority, position, created) VALUES (?, ?, ?, ?, ?)',
+                (filename, printer_id, priority, (last or 0) + 1, time.time()))
+            self.db.commit()
+            return self._get(cursor.lastrowid)
+
+    def list_jobs(self):
+        """Queued jobs in dispatch order, then printing jobs, then the most recent finished ones"""
+        with self.lock:
+            queued = self.db.execute("SELECT * FROM jobs WHERE status='queued' "
+                                     "ORDER BY priority DESC, position").fetchall()
+            printing = self.db.execute("SELECT * FROM jobs WHERE status='printing' ORDER BY started").fetchall()
+            finished = self.db.execute("SELECT * FROM jobs WHERE status NOT IN ('queued', 'printing') "
+                                       "ORDER BY finished DESC LIMIT ?", (FINISHED_HISTORY,)).fetchall()
+        return [dict(row) for row in queued + printing + finished]
+
+    def next_for(self, printer_id):
+        """Highest priority queued job this printer may take"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE status='queued' AND (printer_id IS NULL OR printer_id=?) "
+                "ORDER BY priority DESC, position LIMIT 1", (printer_id,)).fetchone()
+        return dict(row) if row else None
+
+    def printing_jobs(self):
+        with self.lock:
+            return [dict(row) for row in self.db.execute("SELECT * FROM jobs WHERE status='printing'")]
+
+    def mark_started(self, job_id, printer_id):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET status='printing', assigned_printer=?, started=? WHERE id=?",
+                            (printer_id, time.time(), job_id))
+            self.db.commit()
+
+    def mark_finished(self, job_id, status, error=None):
+        with self.lock:
+            self.db.execute('UPDATE jobs SET status=?, error=?, finished=? WHERE id=?',
+                            (status, error, time.time(), job_id))
+            self.db.commit()
+
+    def cancel(self, job_id):
+        """Cancel a queued job; returns the job, or None if it is not queued"""
+        with self.lock:
+            cursor = self.db.execute("UPDATE jobs SET status='cancelled', finished=? "
+                                     "WHERE id=? AND status='queued'", (time.time(), job_id))
+            self.db.commit()
+            return self._get(job_id) if cursor.rowcount else None
+
+    def move(self, job_id, before=None, after=None, priority=None):
+        """
+        Reorder a queued job: place it directly before or after another queued job
+        (taking that job's priority) or just change its priority. Only the moved row changes.
+        """
+        with self.lock:
+            job = self._get(job_id)
+            if not job or job['status'] != 'queued':
+                return None
+            anchor_id = before if before is not None else after
+            if anchor_id is not None:
+                anchor = self._get(anchor_id)
+                if not anchor or anchor['status'] != 'queued' or anchor_id == job_id:
+                    return None
+                comparison, order = ('<', 'DESC') if before is not None else ('>', 'ASC')
+                neighbour = self.db.execute(
+                    f"SELECT position FROM jobs WHERE status='queued' AND priority=? AND id!=? "
+                    f"AND position {comparison} ? ORDER BY position {order} LIMIT 1",
+                    (anchor['priority'], job_id, anchor['position'])).fetchone()
+                step = -1 if before is not None else 1
+                position = (anchor['position'] + neighbour[0]) / 2 if neighbour else anchor['position'] + step
+                self.db.execute('UPDATE jobs SET priority=?, position=? WHERE id=?',
+                                (anchor['priority'], position, job_id))
+            elif priority is not None:
+                self.db.execute('UPDATE jobs SET priority=? WHERE id=?', (int(priority), job_id))
+            self.db.commit()
+            return self._get(job_id)
+
+
+def bed_confirmed_clear(session):
+    """Default bed-clear hook: an operator confirmed the bed is empty since the last job"""
+    return session.bed_clear
+
+
+class JobScheduler:
+    """Dispatches queued jobs to idle printers and records how they finished"""
+
+    def __init__(self, queue, registry, uploads_dir, bed_clear_hook=bed_confirmed_clear, planner=None):
+        self.queue = queue
+        self.planner = planner  # PlacementEngine; without one each idle printer takes its next eligible job
+        self.registry = registry
+        self.uploads_dir = uploads_dir
+        self.bed_clear_hook = bed_clear_hook
+        self.wakeup = threading.Event()
+        self.pass_lock = threading.Lock()  # one scheduling pass at a time
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.wakeup.set()
+
+    def poke(self):
+        """Run a scheduling pass now (new job, bed confirmed, printer connected, ...)"""
+        self.wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Job scheduler pass failed: {e}")
+            self.wakeup.wait(SCHEDULER_INTERVAL)
+            self.wakeup.clear()
+
+    def run_once(self):
+        with self.pass_lock:
+            self._schedule()
+
+    def _schedule(self):
+        busy = set()
+        for job in self.queue.printing_jobs():
+            session = self.registry.get(job['assigned_printer'])
+            if session and session.is_printing:
+                busy.add(session.printer_id)
+            else:
+                self._finish(job, session)
+
+        ready = [session for session in self.registry.all()
+                 if session.printer_id not in busy and not session.is_printing and session.is_connected
+                 and self.bed_clear_hook(session)]
+        plan = self.planner.plan() if self.planner and ready else None
+        for session in ready:
+            if plan is not None:
+                job_id = self.planner.next_job_id(plan, session.printer_id)
+                job = self.queue.get(job_id) if job_id else None
+            else:
+                job = self.queue.next_for(session.printer_id)
+            if job:
+                self._dispatch(job, session)
+
+    def _dispatch(self, job, session):
+        filepath = os.path.join(self.uploads_dir, job['filename'])
+        if not os.path.exists(filepath):
+            self.queue.mark_finished(job['id'], 'failed', 'File not found')
+            return
+        if not session.start_print(filepath, job['filename']):
+            return  # the printer left the idle state meanwhile; the job stays queued
+        logger.info(f"Dispatched job {job['id']} ({job['filename']}) to printer {session.printer_id}")
+        self.queue.mark_started(job['id'], session.printer_id)
+        session.bed_clear = False  # the next job needs a fresh confirmation
+        session.current_job = job['id']
+
+    def _finish(self, job, session):
+        if session is None:
+            self.queue.mark_finished(job['id'], 'failed', 'Printer removed')
+            return
+        if session.print_error:
+            status, error = 'failed', session.print_error
+        elif session.total_lines and session.print_progress >= session.total_lines:
+            status, error = 'done', None
+        else:
+            status, error = 'cancelled', None
+        session.current_job = None
+        self.queue.mark_finished(job['id'], status, error)
+        logger.info(f"Job {job['id']} on printer {session.printer_id} finished: {status}")
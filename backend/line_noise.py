@@ -0,0 +1,59 @@
+# Line Noise Filtering
+# Garbage detection and stripping on raw received bytes. Marlin talks printable
+# ASCII, so anything else on the wire (control bytes, baud-mismatch or bootloader
+# junk above 0x7e) is noise. Both checks are single bytes.translate calls over
+# precomputed tables, and only lines that survive are decoded to str.
+
+TEXT_BYTES = bytes(range(32, 127)) + b'\t\n\r'
+NOISE_BYTES = bytes(b for b in range(256) if b not in TEXT_BYTES)
+CONTROL_BYTES = bytes(b for b in range(32) if b not in b'\t\n\r')
+
+
+def noise_count(raw):
+    """Number of non-text bytes in a received chunk"""
+    return len(raw.translate(None, TEXT_BYTES))
+
+
+def has_control_bytes(raw):
+    """True if raw contains control characters other than tab, CR and LF"""
+    return len(raw.translate(None, CONTROL_BYTES)) != len(raw)
+
+
+def strip_noise(raw):
+    """raw without its noise bytes"""
+    return raw.translate(None, NOISE_BYTES)
+
+
+def decode_line(raw):
+    """Received line as stripped text with noise removed, '' if nothing is left"""
+    line = raw.translate(None, NOISE_BYTES).strip()
+    return line.decode('ascii') if line else ''
+
+
+class NoiseMeter:
+    """Received lines and how many of them carried noise, for one connection"""
+
+    def __init__(self):
+        self.lines = 0
+        self.noisy_lines = 0
+        self.noise_bytes = 0
+
+    def decode(self, raw):
+        """decode_line(raw), counting the line and its noise"""
+        self.lines += 1
+        noise = len(raw.translate(None, TEXT_BYTES))
+        if noise:
+            self.noisy_lines += 1
+            self.noise_bytes += noise
+            raw = raw.translate(None, NOISE_BYTES)
+        line = raw.strip()
+        return line.decode('ascii') if line else ''
+
+    @property
+    def rate(self):
+        """Fraction of received lines that carried noise"""
+        return self.noisy_lines / self.lines if self.lines else 0.0
+
+    def stats(self):
+        return {'lines': self.lines, 'noisy_lines': self.noisy_lines, 'noise_bytes': self.noise_bytes,
+                'noise_rate': round(self.rate, 6)}
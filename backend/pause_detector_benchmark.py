@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Pause Detector Benchmark
+Replays recorded printer response streams through the streaming pause detector and
+through the original list-copying implementation, and reports the per-line cost of
+each and whether they agree on every line.
+
+Streams are read from garbage diagnostic logs (the "Raw: b'...'" responses and raw
+garbage chunks) or from plain text files with one response per line. Without
+arguments the bundled diagnostic log plus a synthetic stream with pause episodes
+and line noise is used.
+
+Usage: python pause_detector_benchmark.py [--lines 200000] [stream.log ...]
+"""
+
+import argparse
+import ast
+import glob
+import os
+import re
+import time
+from collections import deque
+
+from enhanced_pause_detector import StreamingPauseDetector
+
+RAW_PATTERN = re.compile(r"(?:\(Raw|Garbage chunk \d+): (b'.*?')\)?$")
+
+
+class ReferenceDetector:
+    """The original detector's decision logic, kept as the baseline"""
+
+    pause_keywords = ['paused', 'pause', 'waiting', 'busy processing', 'wait']
+    false_positive_keywords = ['busy: ok', 'busy: processing', 'ok busy']
+
+    def __init__(self):
+        self.response_buffer = deque(maxlen=50)
+        self.consecutive = 0
+
+    def clean_response(self, response):
+        cleaned = ''.join(c for c in response if ord(c) >= 32 or c in '\n\r\t')
+        return ' '.join(cleaned.split()).strip()
+
+    def is_response_valid(self, response):
+        cleaned = self.clean_response(response)
+        if len(cleaned) < 2 or len(cleaned) > 100:
+            return False
+        return not (len(set(cleaned.replace(' ', ''))) < 3 and len(cleaned) > 10)
+
+    def analyze_pause_legitimacy(self, response):
+        cleaned = self.clean_response(response).lower()
+        if any(keyword in cleaned for keyword in self.false_positive_keywords):
+            return False
+        pause_score = sum(1 for keyword in self.pause_keywords if keyword in cleaned)
+        if 'ok' in cleaned and pause_score > 0:
+            return False
+        recent_responses = list(self.response_buffer)[-5:]
+        if sum(1 for r in recent_responses if 'ok' in r.lower()) >= 3 and pause_score > 0:
+            return False
+        return pause_score > 0
+
+    def feed(self, response):
+        if not response:
+            return False
+        self.response_buffer.append(response)
+        if not self.is_response_valid(response):
+            return False
+        self.consecutive = self.consecutive + 1 if self.analyze_pause_legitimacy(response) else 0
+        return self.consecutive >= 2
+
+
+def load_stream(path):
+    """Received lines (bytes, without the newline) from a diagnostic log or a plain capture"""
+    with open(path, 'rb') as f:
+        text = f.read().decode('utf-8', errors='replace')
+    recorded = [RAW_PATTERN.search(line) for line in text.splitlines()]
+    recorded = [match.group(1) for match in recorded if match]
+    if not recorded:
+        return [line.encode('utf-8', errors='replace') for line in text.splitlines()]
+    lines = []
+    for literal in recorded:
+        lines.extend(line for line in ast.literal_eval(literal).split(b'\n') if line)
+    return lines
+
+
+def synthetic_stream():
+    """Streaming traffic with pause episodes, busy keepalives and line noise"""
+    lines = []
+    for i in range(200):
+        lines += [b'ok'] * 8
+        lines.append(b'ok T:210.00 /210.00 B:60.00 /60.00 @:64 B@:32')
+        if i % 10 == 0:
+            lines += [b'echo:busy: processing', b'busy: processing', b'ok']
+        if i % 25 == 0:
+            lines += [b'//action:paused', b'echo:Print paused, waiting for user',
+                      b'echo:busy: paused for user', b'echo:busy: paused for user']
+        if i % 7 == 0:
+            lines += [b'\x00\x00\xfe\xff\x01', b'o\x00k', b'xxxxxxxxxxxxxxxxxxxx', b'T:21' * 40]
+    return lines
+
+
+def run(detector, lines):
+    feed = detector.feed
+    started = time.perf_counter()
+    results = [feed(line) for line in lines]
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-line cost of pause detection on recorded streams')
+    parser.add_argument('streams', nargs='*', help='diagnostic logs or one-response-per-line captures')
+    parser.add_argument('--lines', type=int, default=200000, help='lines to replay per stream')
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    streams = [(os.path.basename(path), load_stream(path))
+               for path in args.streams or sorted(glob.glob(os.path.join(here, 'garbage_diagnostic_*.log')))]
+    if not args.streams:
+        streams.append(('synthetic', synthetic_stream()))
+
+    print(f"{'stream':<40}{'lines':>9}{'reference us':>14}{'streaming us':>14}{'speedup':>9}"
+          f"{'pauses':>8}{'mismatches':>12}")
+    for name, recorded in streams:
+        if not recorded:
+            continue
+        lines = (recorded * (args.lines // len(recorded) + 1))[:args.lines]
+        # The reference works on decoded text, as the serial reader used to hand it over
+        texts = [line.decode('utf-8', errors='ignore') for line in lines]
+        reference_time, reference = run(ReferenceDetector(), texts)
+        streaming_time, streaming = run(StreamingPauseDetector(), lines)
+        mismatches = sum(1 for a, b in zip(reference, streaming) if a != b)
+        print(f"{name[:39]:<40}{len(lines):>9}{reference_time / len(lines) * 1e6:>14.2f}"
+              f"{streaming_time / len(lines) * 1e6:>14.2f}{reference_time / streaming_time:>8.1f}x"
+              f"{sum(streaming):>8}{mismatches:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Pause Detection Regression Harness
+Replays recorded printer sessions at full speed through the response handling
+(get_printer_response), EnhancedPauseDetector and enhanced_pause_detection_and_override,
+and reports missed pauses (false negatives), pauses reported where there were none
+(false positives), how late each pause was caught, and the processing cost per line.
+
+Sessions:
+  - serial captures (.cap, see serial_recorder.py); a <capture>.labels.json sidecar
+    {"pauses": [[from_s, to_s], ...]} marks where the printer really was paused, in
+    seconds since capture start (serial_replay.py prints these times). Captures
+    without labels are replayed for cost only.
+  - garbage diagnostic logs, which hold no pauses.
+  - scripted sessions (clean, heating, noisy, garbage and three kinds of pause).
+
+Exits with status 1 if any labelled session had a false positive or negative.
+
+Usage: python pause_regression.py [--repeat 5] [--handler nuclear|improved] [session ...]
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from enhanced_pause_detector import EnhancedPauseDetector
+from enhanced_print_handler import PauseRecovery, enhanced_pause_detection_and_override
+from pause_detector_benchmark import load_stream
+from serial_recorder import CaptureReader
+from serial_replay import ReplaySerial, received_lines
+
+LINE_INTERVAL = 0.01       # seconds between lines of sessions recorded without timestamps
+EPISODE_GAP = 5.0          # false-positive detections closer than this count as one episode
+KEEPALIVE = 2.0            # Marlin's busy/host keepalive interval
+TEMPERATURE = b' T:210.00 /210.00 B:60.00 /60.00 @:64 B@:32\n'
+
+
+class Session:
+    """Received lines [(seconds, raw)] and the true pauses [(from_s, to_s)], None if unlabelled"""
+
+    def __init__(self, name, lines, pauses=None):
+        self.name = name
+        self.lines = lines
+        self.pauses = pauses
+
+
+def capture_session(path):
+    reader = CaptureReader(path)
+    lines = [(stamp, raw) for stamp, _, raw in received_lines(reader.records())]
+    try:
+        with open(path + '.labels.json') as f:
+            pauses = [tuple(window) for window in json.load(f)['pauses']]
+    except FileNotFoundError:
+        pauses = None
+    return Session(os.path.basename(path), lines, pauses)
+
+
+def log_session(path):
+    return Session(os.path.basename(path),
+                   [(i * LINE_INTERVAL, line + b'\n') for i, line in enumerate(load_stream(path))], [])
+
+
+class _Script:
+    """Builds a scripted session line by line on a simulated clock"""
+
+    def __init__(self, name, seed=0):
+        self.name = name
+        self.random = random.Random(seed)
+        self.clock = 0.0
+        self.lines = []
+        self.pauses = []
+
+    def emit(self, raw, gap=LINE_INTERVAL):
+        self.clock += gap
+        self.lines.append((self.clock, raw))
+
+    def printing(self, count, temperature_every=100):
+        for i in range(count):
+            self.emit(b'ok\n')
+            if i % temperature_every == temperature_every - 1:
+                self.emit(TEMPERATURE, 0.001)
+
+    def pause(self, announcement, seconds, resume=(b'ok\n',)):
+        """A real pause: the announcement, busy keepalives for the duration, then the resume"""
+        started = self.clock + LINE_INTERVAL
+        for raw in announcement:
+            self.emit(raw)
+        for _ in range(int(seconds / KEEPALIVE)):
+            self.emit(b'echo:busy: paused for user\n', KEEPALIVE)
+        self.pauses.append((started, self.clock))
+        for raw in resume:
+            self.emit(raw)
+
+    def garble(self, raw):
+        """raw with line noise: stray control bytes and bytes above 0x7e"""
+        data = bytearray(raw)
+        for _ in range(self.random.randint(1, 3)):
+            data.insert(self.random.randrange(len(data)), self.random.choice(b'\x00\x01\x1b\x7f\xfe\xff'))
+        return bytes(data)
+
+    def session(self):
+        return Session(self.name, self.lines, self.pauses)
+
+
+def scripted_sessions():
+    clean = _Script('scripted: clean')
+    clean.printing(3000)
+
+    heating = _Script('scripted: heating (M109/M190 waits)')
+    heating.printing(200)
+    for second in range(60):
+        heating.emit(f' T:{150 + second:.2f} /210.00 B:60.00 /60.00 @:127 B@:0 W:?\n'.encode(), 1.0)
+        if second % 2:
+            heating.emit(b'echo:busy: processing\n', 0.001)
+    heating.emit(b'ok\n')
+    heating.printing(200)
+
+    noisy = _Script('scripted: noisy line', seed=1)
+    for i in range(3000):
+        noisy.emit(noisy.garble(b'ok\n') if noisy.random.random() < 0.05 else b'ok\n')
+        if i % 100 == 99:
+            noisy.emit(noisy.garble(TEMPERATURE), 0.001)
+
+    garbage = _Script('scripted: garbage bursts', seed=2)
+    for _ in range(30):
+        garbage.printing(80)
+        for _ in range(garbage.random.randint(1, 6)):
+            garbage.emit(bytes(garbage.random.randrange(128, 256) for _ in range(garbage.random.randint(4, 60)))
+                         + b'\n', 0.001)
+        garbage.emit(b'x' * 40 + b'\n', 0.001)
+
+    m0 = _Script('scripted: M0 pause with host prompt')
+    m0.printing(500)
+    m0.pause((b'//action:prompt_begin Click to Resume...\n', b'//action:prompt_button Continue\n',
+              b'//action:prompt_show\n', b'echo:busy: paused for user\n'), 30,
+             resume=(b'//action:prompt_end\n', b'ok\n'))
+    m0.printing(500)
+
+    runout = _Script('scripted: filament runout (M600)')
+    runout.printing(800)
+    runout.pause((b'//action:paused filament_runout\n', b'echo:busy: paused for user\n'), 20)
+    runout.printing(800)
+
+    noisy_pause = _Script('scripted: pause on a noisy line', seed=3)
+    noisy_pause.printing(500)
+    noisy_pause.pause((noisy_pause.garble(b'//action:paused\n'), noisy_pause.garble(b'echo:busy: paused for user\n'),
+                       noisy_pause.garble(b'echo:busy: paused for user\n')), 10)
+    noisy_pause.printing(500)
+
+    return [script.session() for script in (clean, heating, noisy, garbage, m0, runout, noisy_pause)]
+
+
+class AckingPort:
+    """Printer side for recovery attempts: acknowledges every command and reports its position, like a printer that resumes"""
+
+    is_open = True
+
+    def __init__(self):
+        self.replies = []
+
+    @property
+    def in_waiting(self):
+        return len(self.replies[0]) if self.replies else 0
+
+    def write(self, data):
+        if data.startswith(b'M114'):
+            self.replies.append(b'X:0.00 Y:0.00 Z:0.20 E:0.00 Count X:0 Y:0 Z:80\n')
+        self.replies.append(b'ok\n')
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return self.replies.pop(0) if self.replies else b''
+
+
+def score(hits, pauses):
+    """Detected, missed and false-positive pauses, and the worst detection latency, for one detector"""
+    detected = 0
+    latency = 0.0
+    for started, ended in pauses:
+        caught = [stamp for stamp in hits if started <= stamp <= ended]
+        if caught:
+            detected += 1
+            latency = max(latency, caught[0] - started)
+    false_positives = 0
+    last = None
+    for stamp in hits:
+        if any(started <= stamp <= ended for started, ended in pauses):
+            continue
+        if last is None or stamp - last > EPISODE_GAP:
+            false_positives += 1
+        last = stamp
+    return {'detected': detected, 'missed': len(pauses) - detected, 'false_positives': false_positives,
+            'latency': latency}
+
+
+def run_session(session, handler):
+    """Detection times of each detector and the seconds spent in each stage"""
+    port = ReplaySerial()
+    handler.printer = port
+    detector = EnhancedPauseDetector(port)
+    recovery = PauseRecovery(verify_timeout=0.05)
+    printer = AckingPort()
+    hits = {'detector': [], 'recovery': []}
+    cost = {'handling': 0.0, 'detector': 0.0, 'recovery': 0.0}
+    clock = time.perf_counter
+    for number, (stamp, raw) in enumerate(session.lines, 1):
+        started = clock()
+        port.push(raw)
+        responses = handler.get_printer_response()
+        handled = clock()
+        for response in responses:
+            if detector.detect_pause_from_response(response):
+                hits['detector'].append(stamp)
+        detected = clock()
+        for response in responses:
+            before = recovery.detected
+            enhanced_pause_detection_and_override(printer, response, number, '', recovery)
+            if recovery.detected != before:
+                hits['recovery'].append(stamp)
+        finished = clock()
+        cost['handling'] += handled - started
+        cost['detector'] += detected - handled
+        cost['recovery'] += finished - detected
+    return hits, cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded sessions through the pause detection')
+    parser.add_argument('sessions', nargs='*', help='.cap captures or diagnostic logs (default: all found)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per session; the fastest is reported')
+    parser.add_argument('--handler', choices=('nuclear', 'improved'), default='nuclear',
+                        help='backend whose get_printer_response() parses the lines')
+    parser.add_argument('--no-scripted', action='store_true', help='skip the scripted sessions')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)  # recovery attempts would log every detection
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = args.sessions or (sorted(glob.glob(os.path.join(here, 'garbage_diagnostic_*.log')))
+                              + sorted(glob.glob(os.path.join(here, 'uploads', 'captures', '*.cap'))))
+    sessions = [capture_session(path) if path.endswith('.cap') else log_session(path) for path in paths]
+    if not args.no_scripted:
+        sessions += scripted_sessions()
+    handler = importlib.import_module('app_nuclear' if args.handler == 'nuclear' else 'improved_app')
+
+    print(f"{'session':<40}{'lines':>7}{'pauses':>7}  {'detector ok/miss/fp':>20}{'recovery ok/miss/fp':>20}"
+          f"{'latency s':>10}  {'us/line handling':>16}{'detector':>9}{'recovery':>9}")
+    failed = False
+    for session in sessions:
+        if not session.lines:
+            continue
+        hits, cost = run_session(session, handler)
+        for _ in range(args.repeat - 1):
+            cost = {stage: min(seconds, cost[stage]) for stage, seconds in run_session(session, handler)[1].items()}
+        per_line = {stage: seconds / len(session.lines) * 1e6 for stage, seconds in cost.items()}
+        if session.pauses is None:
+            outcome = {name: '-' for name in hits}
+            latency = '-'
+        else:
+            scores = {name: score(stamps, session.pauses) for name, stamps in hits.items()}
+            outcome = {name: f"{s['detected']}/{s['missed']}/{s['false_positives']}" for name, s in scores.items()}
+            latency = '/'.join(f"{s['latency']:.1f}" for s in scores.values())
+            failed |= any(s['missed'] or s['false_positives'] for s in scores.values())
+        print(f"{session.name[:39]:<40}{len(session.lines):>7}{len(session.pauses or ()):>7}  "
+              f"{outcome['detector']:>20}{outcome['recovery']:>20}{latency:>10}  "
+              f"{per_line['handling']:>16.2f}{per_line['detector']:>9.2f}{per_line['recovery']:>9.2f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# Serial Port Auto-Detection
+# Finds which serial port a printer is on and at which baud rate. Every candidate
+# port is probed at the same time on a thread pool, each trying the most likely
+# baud rate first, and detection ends as soon as any port answers with a firmware
+# banner or an M115 report. Results are remembered per USB device (see device_key)
+# so a reconnect can skip detection entirely.
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+import serial.tools.list_ports
+import serial.tools.list_ports_common
+
+from printer_session import open_serial, parse_firmware_report
+
+logger = logging.getLogger(__name__)
+
+BAUD_RATES = (115200, 250000, 57600, 38400, 19200, 9600)
+# Baud rate usually flashed on boards behind a given USB chip (VID, PID)
+LIKELY_BAUD = {
+    (0x1a86, 0x7523): 115200,   # CH340 (Creality, most Chinese boards)
+    (0x10c4, 0xea60): 115200,   # CP210x
+    (0x0483, 0x5740): 115200,   # STM32 native USB (baud is ignored)
+    (0x2c99, 0x0002): 115200,   # Prusa MK3
+    (0x2341, 0x0042): 250000,   # Arduino Mega 2560 (RAMPS)
+    (0x2341, 0x0010): 250000,   # Arduino Mega 2560 (older)
+    (0x0403, 0x6001): 250000,   # FTDI FT232R
+}
+# Ports are opened without a DTR reset, so a board busy printing (e.g. for another host) keeps
+# running. A port whose HUPCL another program left set still resets once on open, hence the margin.
+PROBE_TIMEOUT = 2.5     # seconds per baud rate; covers the bootloader delay of such a reset
+QUERY_INTERVAL = 0.5    # M115 is repeated because the first one can land during that reset
+MAX_WORKERS = 16
+
+def device_key(port_info):
+    """
+    Stable identity of the USB device behind a port (VID:PID:serial), or None for
+    non-USB ports. Adapters without a serial number (most CH340s) are told apart by
+    the USB socket they are plugged into instead (VID:PID@location).
+    """
+    if port_info.vid is None:
+        return None
+    if port_info.serial_number:
+        return f'{port_info.vid:04x}:{port_info.pid:04x}:{port_info.serial_number}'
+    return f'{port_info.vid:04x}:{port_info.pid:04x}@{port_info.location or port_info.device}'
+
+
+def baud_order(port_info, preferred=None):
+    """All baud rates, the preferred (cached) one first, then the chip's usual one"""
+    first = [preferred, LIKELY_BAUD.get((port_info.vid, port_info.pid))]
+    ordered = [baud for baud in first if baud]
+    return ordered + [baud for baud in BAUD_RATES if baud not in ordered]
+
+
+def identify(line):
+    """Firmware description if a line proves a printer is talking at this baud rate"""
+    report = parse_firmware_report(line)
+    if report:
+        return report['FIRMWARE_NAME']
+    if line == 'start' or line.startswith(('Marlin', 'echo:Marlin')):
+        return line
+    return None
+
+
+class PortDetector:
+    """Concurrent port/baud prober with a per-device result cache"""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        try:
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+        except (OSError, ValueError):
+            self.cache = {}
+
+    def _save_cache(self):
+        with open(self.cache_path + '.tmp', 'w') as f:
+            json.dump(self.cache, f, indent=1, sort_keys=True)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+    def remember(self, port_info, baud_rate, firmware):
+        key = device_key(port_info)
+        if key is None:
+            return
+        with self.lock:
+            self.cache[key] = {'baud_rate': baud_rate, 'firmware': firmware,
+                               'port': port_info.device, 'time': time.time()}
+            self._save_cache()
+
+    def forget(self, port):
+        """Drop the cached result of the device currently on a port (e.g. after a failed connect)"""
+        with self.lock:
+            stale = [key for key, entry in self.cache.items() if entry.get('port') == port]
+            for key in stale:
+                del self.cache[key]
+            if stale:
+                self._save_cache()
+
+    def _cached(self, port_info):
+        key = device_key(port_info)
+        with self.lock:
+            return self.cache.get(key) if key else None
+
+    def cached_result(self, port=None, exclude=()):
+        """Cached port/baud for a device that is plugged in right now, or None"""
+        for port_info in serial.tools.list_ports.comports():
+            if port_info.device in exclude or (port and port_info.device != port):
+                continue
+            entry = self._cached(port_info)
+            if entry:
+                return {'port': port_info.device, 'baud_rate': entry['baud_rate'],
+                        'firmware': entry['firmware'], 'cached': True, 'elapsed': 0.0}
+        return None
+
+    def _probe(self, port_info, baud_rate, found):
+        """Open the port at one baud rate (without resetting the board) and wait for a banner or M115 reply"""
+        try:
+            connection = open_serial(port_info.device, baud_rate, reset=False, timeout=0.05)
+        except (serial.SerialException, OSError) as e:
+            return None, str(e)
+        with connection:
+            deadline = time.monotonic() + PROBE_TIMEOUT
+            next_query = 0.0
+            pending = b''
+            while time.monotonic() < deadline and not found.is_set():
+                if time.monotonic() >= next_query:
+                    connection.write(b'\nM115\n')
+                    next_query = time.monotonic() + QUERY_INTERVAL
+                pending += connection.read(connection.in_waiting or 1)
+                *lines, pending = pending.split(b'\n')
+                for raw in lines:
+                    firmware = identify(raw.decode('ascii', errors='replace').strip())
+                    if firmware:
+                        return firmware, None
+        return None, 'no answer'
+
+    def _probe_port(self, port_info, found):
+        """Try one port at each baud rate in turn until it answers or another port won"""
+        cached = self._cached(port_info)
+        attempts = []
+        for baud_rate in baud_order(port_info, cached and cached['baud_rate']):
+            if found.is_set():
+                break
+            firmware, error = self._probe(port_info, baud_rate, found)
+            attempts.append({'baud_rate': baud_rate, 'error': error})
+            if firmware:
+                found.set()
+                return {'port': port_info.device, 'baud_rate': baud_rate, 'firmware': firmware,
+                        'attempts': attempts}
+            if error != 'no answer':
+                break  # the port itself cannot be opened
+        return {'port': port_info.device, 'baud_rate': None, 'attempts': attempts}
+
+    def detect(self, port=None, exclude=(), use_cache=True):
+        """
+        Find a printer, optionally on one given port. Ports in exclude (held by
+        connected printers) are not touched. Returns {port, baud_rate, firmware,
+        cached, elapsed, probed} or None when nothing answered.
+        """
+        started = time.monotonic()
+        if use_cache:
+            cached = self.cached_result(port, exclude)
+            if cached:
+                return cached
+
+        candidates = {p.device: p for p in serial.tools.list_ports.comports()
+                      if p.device not in exclude and (port is None or p.device == port)}
+        if port and port not in candidates and port not in exclude:
+            candidates[port] = serial.tools.list_ports_common.ListPortInfo(port)  # not enumerated (e.g. a pty)
+        if not candidates:
+            return None
+
+        found = threading.Event()
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(candidates)),
+                                thread_name_prefix='port-probe') as pool:
+            results = list(pool.map(lambda info: self._probe_port(info, found), candidates.values()))
+
+        elapsed = round(time.monotonic() - started, 3)
+        winner = next((result for result in results if result['baud_rate']), None)
+        if winner is None:
+            logger.info(f"Port detection over {len(candidates)} port(s) found no printer in {elapsed}s")
+            return None
+        logger.info(f"Port detection found {winner['port']} at {winner['baud_rate']} baud in {elapsed}s")
+        self.remember(candidates[winner['port']], winner['baud_rate'], winner['firmware'])
+        return dict(winner, cached=False, elapsed=elapsed, probed=results)
@@ -0,0 +1,156 @@
+# Serial Port Inventory
+# The list of serial ports, enumerated once and then kept current by watching /dev
+# for tty devices appearing and disappearing (Linux inotify) or by a low-rate
+# rescan elsewhere, so /api/ports never enumerates USB on the request path.
+# Every port carries its stable device_key (VID:PID:serial) and the printer that
+# device was last connected as, which survives USB re-enumeration (ttyUSB0 coming
+# back as ttyUSB1) and backend restarts.
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import serial.tools.list_ports
+
+from file_catalog import InotifyWatcher
+from port_detect import LIKELY_BAUD, device_key
+
+logger = logging.getLogger(__name__)
+
+SCAN_INTERVAL = 5.0      # seconds between rescans when /dev cannot be watched
+SETTLE_DELAY = 0.5       # udev creates the /dev/serial/by-id links just after the tty node
+BY_ID_DIR = '/dev/serial/by-id'
+PRINTER_KEYWORDS = ('arduino', 'ch340', 'cp210', 'ftdi', 'usb serial', 'marlin', 'prusa', 'stm32')
+
+
+def _by_id_links():
+    """Resolved tty path -> /dev/serial/by-id link"""
+    try:
+        names = os.listdir(BY_ID_DIR)
+    except OSError:
+        return {}
+    return {os.path.realpath(os.path.join(BY_ID_DIR, name)): os.path.join(BY_ID_DIR, name) for name in names}
+
+
+class PortInventory:
+    """Current serial ports with stable identities and remembered printer assignments"""
+
+    def __init__(self, identities_path):
+        self.identities_path = identities_path
+        self.lock = threading.Lock()
+        self.ports = {}          # device path -> entry
+        self.generation = 0
+        self._instance = uuid.uuid4().hex[:8]
+        self._stop = threading.Event()
+        self._thread = None
+        self.watch_mode = None
+        try:
+            with open(identities_path) as f:
+                self.identities = json.load(f)   # device_key -> {'printer_id', 'port', 'time'}
+        except (OSError, ValueError):
+            self.identities = {}
+
+    @property
+    def etag(self):
+        return f'{self._instance}-{self.generation}'
+
+    def _save_identities(self):
+        with open(self.identities_path + '.tmp', 'w') as f:
+            json.dump(self.identities, f, indent=1, sort_keys=True)
+        os.replace(self.identities_path + '.tmp', self.identities_path)
+
+    def _entry(self, port_info, by_id):
+        key = device_key(port_info)
+        identity = self.identities.get(key) if key else None
+        description = port_info.description or ''
+        return {
+            'port': port_info.device,
+            'device_key': key,
+            'by_id': by_id.get(os.path.realpath(port_info.device)),
+            'description': description,
+            'manufacturer': port_info.manufacturer or 'Unknown',
+            'product': port_info.product or 'Unknown',
+            'vid': f'{port_info.vid:04x}' if port_info.vid is not None else None,
+            'pid': f'{port_info.pid:04x}' if port_info.pid is not None else None,
+            'serial_number': port_info.serial_number,
+            'is_printer': bool(identity or (port_info.vid, port_info.pid) in LIKELY_BAUD
+                               or any(keyword in description.lower() for keyword in PRINTER_KEYWORDS)),
+            'last_printer': identity['printer_id'] if identity else None,
+        }
+
+    def rescan(self):
+        """Enumerate the ports; returns True if anything was plugged in or removed"""
+        by_id = _by_id_links()
+        with self.lock:
+            ports = {info.device: self._entry(info, by_id) for info in serial.tools.list_ports.comports()}
+            changed = ports != self.ports
+            if changed:
+                added, removed = ports.keys() - self.ports.keys(), self.ports.keys() - ports.keys()
+                self.ports = ports
+                self.generation += 1
+        if changed and (added or removed):
+            logger.info(f"Serial ports changed: +{sorted(added)} -{sorted(removed)}")
+        return changed
+
+    def listing(self):
+        """(etag, ports sorted by device path) without touching USB"""
+        with self.lock:
+            return self.etag, [self.ports[device] for device in sorted(self.ports)]
+
+    # --- Printer identities ---
+    def remember(self, port, printer_id):
+        """Record that the device now on port is this printer"""
+        with self.lock:
+            entry = self.ports.get(port)
+            key = entry and entry['device_key']
+            if not key:
+                return
+            for other in [k for k, v in self.identities.items() if v['printer_id'] == printer_id]:
+                del self.identities[other]  # a printer is one device at a time
+            self.identities[key] = {'printer_id': printer_id, 'port': port, 'time': time.time()}
+            self._save_identities()
+            for port_entry in self.ports.values():
+                port_entry['last_printer'] = self.identities.get(port_entry['device_key'], {}).get('printer_id')
+            self.generation += 1
+
+    def port_for_printer(self, printer_id):
+        """Current device path of the device last connected as this printer, if it is plugged in"""
+        with self.lock:
+            for entry in self.ports.values():
+                if entry['last_printer'] == printer_id:
+                    return entry['port']
+        return None
+
+    # --- Change watching ---
+    def start(self):
+        """Enumerate once and keep the inventory current in a background thread"""
+        if self._thread:
+            return
+        self.rescan()
+        self._thread = threading.Thread(target=self._watch, name='port-inventory', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        watcher = InotifyWatcher.create('/dev', InotifyWatcher.IN_CREATE | InotifyWatcher.IN_DELETE)
+        self.watch_mode = 'inotify' if watcher else 'polling'
+        logger.info(f"Port inventory watching serial devices using {self.watch_mode}")
+        if watcher:
+            try:
+                while not self._stop.is_set():
+                    names = watcher.read_events(timeout=1.0)
+                    if watcher.overflowed or any(name.startswith('tty') for name in names):
+                        self._stop.wait(SETTLE_DELAY)
+                        watcher.read_events(timeout=0)  # the rest of the same plug event
+                        watcher.overflowed = False
+                        self.rescan()
+            finally:
+                watcher.close()
+        else:
+            while not self._stop.wait(SCAN_INTERVAL):
+                self.rescan()
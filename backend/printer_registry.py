@@ -0,0 +1,65 @@
+# Printer Registry
+# Printer sessions keyed by ID so one backend process can drive a whole rack of
+# printers. The 'default' printer backs the original single-printer API routes.
+
+import threading
+import time
+
+from printer_session import PrinterSession
+
+DEFAULT_PRINTER = 'default'
+
+
+class PrinterRegistry:
+    """Thread-safe printer_id -> PrinterSession map"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.add(DEFAULT_PRINTER, 'Default printer')
+
+    def add(self, printer_id, name=None, streamer_mode='thread', cpu=None):
+        """Register a printer; returns None if the ID is already taken"""
+        with self.lock:
+            if printer_id in self.sessions:
+                return None
+            session = PrinterSession(printer_id, name, streamer_mode, cpu)
+            self.sessions[printer_id] = session
+            return session
+
+    def get(self, printer_id):
+        with self.lock:
+            return self.sessions.get(printer_id)
+
+    def remove(self, printer_id):
+        """Unregister an idle printer; returns False if it is unknown, busy or the default"""
+        with self.lock:
+            session = self.sessions.get(printer_id)
+            if session is None or printer_id == DEFAULT_PRINTER or session.is_printing:
+                return False
+            del self.sessions[printer_id]
+        session.disconnect()
+        return True
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def port_owner(self, port):
+        """The session currently holding a serial port, if any"""
+        for session in self.all():
+            if session.is_connected and session.port == port:
+                return session
+        return None
+
+    def busy_ports(self):
+        """Serial ports held by connected printers"""
+        return {session.port for session in self.all() if session.is_connected}
+
+    def farm_status(self):
+        """All printers in one response, built from cached state without serial I/O"""
+        printers = [session.summary() for session in self.all()]
+        counts = {}
+        for summary in printers:
+            counts[summary['status']] = counts.get(summary['status'], 0) + 1
+        return {'printers': printers, 'counts': counts, 'timestamp': time.time()}
@@ -0,0 +1,998 @@
+# Printer Session
+# Everything the backend knows about one physical printer: its serial connection,
+# the streamer thread printing to it and its latest telemetry. app.py used to keep
+# this in module globals, which limited one backend process to one printer.
+#
+# Job progress and telemetry live in a SessionState struct. With streamer_mode
+# 'process' that struct is shared memory written by a dedicated streamer process
+# (streamer_process.py), so web traffic in this process cannot delay G-code lines.
+#
+# The job itself is an explicit state machine (JOB_STATES). Request threads ask for
+# transitions (pause, cancel, ...) and the print loop acts on them at the next line
+# boundary; every accepted transition is logged. Writers serialise on a lock and
+# bump a sequence counter around each update, so readers take consistent snapshots
+# without ever waiting for the lock.
+#
+# Manual commands sent during a print are injected into the stream between two
+# file lines by the print loop itself, so each gets its own acknowledgement and the
+# streamer never loses one of its own.
+
+import collections
+import contextlib
+import ctypes
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+import serial
+
+try:
+    import termios
+except ImportError:  # Windows
+    termios = None
+
+from command_filter import CommandFilter, FilterReport, active_filter
+from gcode_index import GcodeIndexBuilder, get_index, store_index
+from gcode_storage import open_gcode_text
+from hot_log import HotPathLogger
+from line_noise import NOISE_BYTES, TEXT_BYTES
+from serial_recorder import RecordingSerial, SerialRecorder, capture_dir
+
+logger = logging.getLogger(__name__)
+
+TEMPERATURE_PATTERN = re.compile(r'T:(\d+\.?\d*)\s*/(\d+\.?\d*).*B:(\d+\.?\d*)\s*/(\d+\.?\d*)')
+FIRMWARE_FIELD_PATTERN = re.compile(r'([A-Z_]+):(.*?)(?=\s+[A-Z_]+:|$)')
+CAPABILITY_PATTERN = re.compile(r'Cap:([A-Z_0-9]+):(\d+)')
+SD_PROGRESS_PATTERN = re.compile(r'SD printing byte (\d+)/(\d+)')
+SD_FILE_PATTERN = re.compile(r'Current file:[ \t]*(\S+)(?:[ \t]+(.+))?')
+
+
+def parse_temperatures(line):
+    """Parse an M105 style report (T:25.0 /0.0 B:25.0 /0.0), or None"""
+    temp_match = TEMPERATURE_PATTERN.search(line)
+    if not temp_match:
+        return None
+    return {
+        'hotend_actual': float(temp_match.group(1)),
+        'hotend_target': float(temp_match.group(2)),
+        'bed_actual': float(temp_match.group(3)),
+        'bed_target': float(temp_match.group(4))
+    }
+
+
+def parse_firmware_report(line):
+    """Fields of an M115 FIRMWARE_NAME line ({'FIRMWARE_NAME': 'Marlin 2.1.2', ...}), or None"""
+    if 'FIRMWARE_NAME:' not in line:
+        return None
+    line = line[line.index('FIRMWARE_NAME:'):]
+    return {key: value.strip() for key, value in FIRMWARE_FIELD_PATTERN.findall(line)}
+
+
+def open_serial(port, baud_rate, reset=True, timeout=2):
+    """
+    Open a printer port. HUPCL is cleared on POSIX, so closing the port (or the
+    backend exiting) no longer drops DTR and the next open does not reset the
+    board. reset=True then resets it deliberately with a DTR pulse; reset=False
+    leaves a running board alone (on Windows DTR is kept low from the start).
+    """
+    connection = serial.Serial()
+    connection.port, connection.baudrate, connection.timeout = port, baud_rate, timeout
+    if not reset and os.name == 'nt':
+        connection.dtr = False
+        connection.rts = False
+    connection.open()
+    if termios:
+        try:
+            attributes = termios.tcgetattr(connection.fileno())
+            attributes[2] &= ~termios.HUPCL
+            termios.tcsetattr(connection.fileno(), termios.TCSANOW, attributes)
+        except termios.error as e:
+            logger.debug(f"Could not clear HUPCL on {port}: {e}")
+    if reset:
+        try:
+            connection.dtr = False
+            time.sleep(0.1)
+            connection.dtr = True
+        except (OSError, serial.SerialException) as e:  # no modem lines (e.g. a pty)
+            logger.debug(f"Could not pulse DTR on {port}: {e}")
+    return connection
+
+
+STREAMER_MODES = ('thread', 'process')
+JOB_STATES = ('idle', 'preparing', 'heating', 'printing', 'pausing', 'paused', 'cancelling', 'error')
+# Allowed transitions; anything else is refused (e.g. printing -> paused skips pausing)
+JOB_TRANSITIONS = {
+    'idle': {'preparing'},
+    'preparing': {'printing', 'cancelling', 'error'},
+    'heating': {'printing', 'pausing', 'cancelling', 'error', 'idle'},
+    'printing': {'heating', 'pausing', 'cancelling', 'error', 'idle'},
+    # pausing -> printing only through resume() before the pause took effect; -> idle: file ended first
+    'pausing': {'paused', 'printing', 'cancelling', 'error', 'idle'},
+    'paused': {'printing', 'cancelling', 'error'},
+    'cancelling': {'idle', 'error'},
+    'error': {'preparing'},
+}
+ACTIVE_JOB_STATES = frozenset(JOB_STATES) - {'idle', 'error'}
+TRANSITION_LOG_SIZE = 200
+
+CONNECT_DEADLINE = 10.0      # seconds for the firmware to boot and answer M115 after the port opens
+HELLO_INTERVAL = 1.0         # resend M115 after this much silence (it can be lost in a bootloader reset)
+SD_POLL_INTERVAL = 2.0       # M27/M105 polling of a reattached SD print
+COMMAND_TIMEOUT = 10.0       # seconds to wait for a manual command's ok
+STATUS_QUERY_TIMEOUT = 1.0   # M105 for a status poll; cached telemetry is used after this
+CANCEL_JOIN_TIMEOUT = 5.0    # disconnect waits this long for a cancelled print loop to wind down
+# Handled by Marlin's emergency parser as soon as they arrive, so never queued behind file lines
+IMMEDIATE_COMMANDS = ('M108', 'M112', 'M410')
+TEMPERATURE_FIELDS = ('hotend_actual', 'hotend_target', 'bed_actual', 'bed_target')
+PRINT_ERROR_BYTES = 256
+
+
+class SessionState(ctypes.Structure):
+    """
+    Job state, progress, telemetry and streamer timing of one printer. Job and
+    telemetry fields change only inside a PrinterSession writer section, which makes
+    seq odd for its duration; timing and receive counters are written without it.
+    """
+    _fields_ = [
+        ('seq', ctypes.c_uint64),
+        ('connected', ctypes.c_bool),
+        ('job_state', ctypes.c_uint8),            # index into JOB_STATES
+        ('print_progress', ctypes.c_int64),
+        ('total_lines', ctypes.c_int64),
+        ('current_source_line', ctypes.c_int64),  # File line number of the last acknowledged command
+        ('hotend_actual', ctypes.c_double),
+        ('hotend_target', ctypes.c_double),
+        ('bed_actual', ctypes.c_double),
+        ('bed_target', ctypes.c_double),
+        ('telemetry_time', ctypes.c_double),      # when temperatures were last reported
+        # Ack -> next write turnaround, excluding the deliberate per-command delay
+        ('gap_count', ctypes.c_int64),
+        ('gap_sum', ctypes.c_double),
+        ('gap_sum_sq', ctypes.c_double),
+        ('gap_max', ctypes.c_double),
+        # Manual commands injected into a running print: request -> write delay
+        ('inject_count', ctypes.c_int64),
+        ('inject_wait_sum', ctypes.c_double),
+        ('inject_wait_max', ctypes.c_double),
+        # Received lines and line noise (non-text bytes) on the current connection
+        ('rx_lines', ctypes.c_int64),
+        ('rx_noisy_lines', ctypes.c_int64),
+        ('rx_noise_bytes', ctypes.c_int64),
+        # Immediate commands (M108/M112/M410) written mid-line whose ok the print loop must skip
+        ('pending_acks', ctypes.c_int64),
+        # Job lines written / acknowledged, and those of the current job still waiting for their ok
+        ('lines_sent', ctypes.c_int64),
+        ('lines_acked', ctypes.c_int64),
+        ('unacked_lines', ctypes.c_int64),
+        ('print_error', ctypes.c_char * PRINT_ERROR_BYTES),
+    ]
+
+
+def _state_property(field, convert):
+    def getter(self):
+        return convert(getattr(self.state, field))
+
+    def setter(self, value):
+        setattr(self.state, field, value)
+    return property(getter, setter)
+
+
+class PrinterSession:
+    """One printer: serial port, print streamer worker, job progress and telemetry"""
+
+    print_progress = _state_property('print_progress', int)
+    total_lines = _state_property('total_lines', int)
+    current_source_line = _state_property('current_source_line', int)
+
+    def __init__(self, printer_id, name=None, streamer_mode='thread', cpu=None, state=None):
+        if streamer_mode not in STREAMER_MODES:
+            raise ValueError(f'Unknown streamer mode: {streamer_mode}')
+        self.printer_id = printer_id
+        self.name = name or printer_id
+        self.streamer_mode = streamer_mode
+        self.cpu = cpu                  # CPU the streamer process is pinned to (process mode)
+        self.streamer = None            # StreamerProcess while connected in process mode
+        self.state = state if state is not None else SessionState()
+        self.printer = None
+        self.port = None
+        self.print_thread = None
+        self.serial_lock = threading.Lock()  # one request/response exchange at a time
+        self.state_lock = threading.Lock()   # serialises writers of self.state
+        self.transitions = collections.deque(maxlen=TRANSITION_LOG_SIZE)
+        self.injections = collections.deque()  # manual commands waiting for a slot in the print stream
+        self.hot = HotPathLogger(logger)     # per-line trace, written out when the job fails
+        self.current_file = ""
+        self.current_index = None       # GcodeIndex for the file being printed
+        self.current_job = None         # job queue ID being printed, if dispatched by the scheduler
+        self.bed_clear = False          # operator confirmed the bed is empty (job queue dispatch)
+        self.print_started = None       # time.time() when the current print was started
+        self.z_offset = 0.0             # babystepped Z offset since connecting (mm)
+        self.connection = None          # handshake result, firmware and capabilities of the last connect
+        self.job_source = 'host'        # 'host': streamed by us, 'sd': printed by the firmware from its SD card
+        # Placement constraints: build volume [x, y, z] mm, nozzle mm, loaded material
+        self.build_volume = None
+        self.nozzle_diameter = None
+        self.material = None
+
+    @property
+    def is_connected(self):
+        if self.streamer_mode == 'process':
+            return bool(self.streamer and self.streamer.is_alive() and self.state.connected)
+        return bool(self.printer and self.printer.is_open)
+
+    @property
+    def job_state(self):
+        return JOB_STATES[self.state.job_state]
+
+    @property
+    def is_printing(self):
+        """A job occupies the printer (including while it is paused or being cancelled)"""
+        return self.job_state in ACTIVE_JOB_STATES
+
+    @property
+    def is_paused(self):
+        return self.job_state in ('pausing', 'paused')
+
+    @property
+    def print_error(self):
+        return self.state.print_error.decode('utf-8', errors='replace') or None
+
+    @print_error.setter
+    def print_error(self, message):
+        encoded = (message or '').encode('utf-8')[:PRINT_ERROR_BYTES - 1]
+        self.state.print_error = encoded
+
+    @property
+    def temperatures(self):
+        return {field: getattr(self.state, field) for field in TEMPERATURE_FIELDS}
+
+    @property
+    def telemetry_time(self):
+        return self.state.telemetry_time or None
+
+    def _log(self, level, message):
+        logger.log(level, f"[{self.printer_id}] {message}")
+
+    # --- Job state ---
+    @contextlib.contextmanager
+    def _writing(self):
+        """Writer section: seq is odd while fields are being changed"""
+        with self.state_lock:
+            self.state.seq += 1
+            try:
+                yield self.state
+            finally:
+                self.state.seq += 1
+
+    def _update(self, **fields):
+        """Publish several fields as one consistent update"""
+        with self._writing() as state:
+            for field, value in fields.items():
+                setattr(state, field, value)
+
+    def _transition(self, new_state, reason='', error=None, only_from=None, **fields):
+        """
+        Move the job to new_state if JOB_TRANSITIONS allows it from the current state (and
+        the current state is one of only_from, if given), publishing any extra fields with
+        it. Returns False (and changes nothing) otherwise.
+        """
+        with self._writing() as state:
+            old_state = JOB_STATES[state.job_state]
+            if new_state not in JOB_TRANSITIONS[old_state]:
+                return False
+            if only_from is not None and old_state not in only_from:
+                return False
+            state.job_state = JOB_STATES.index(new_state)
+            if error is not None:
+                self.print_error = error
+            for field, value in fields.items():
+                setattr(state, field, value)
+            self.transitions.append({'time': time.time(), 'from': old_state, 'to': new_state,
+                                     'reason': reason})
+        self._log(logging.INFO, f"Job {old_state} -> {new_state}" + (f" ({reason})" if reason else ""))
+        if new_state == 'error':
+            self.hot.dump_trace(f"[{self.printer_id}] Job failed ({reason})")
+        return True
+
+    def snapshot(self):
+        """Consistent copy of job state, progress and telemetry; never takes the writer lock"""
+        state = self.state
+        while True:
+            seq = state.seq
+            if not seq & 1:
+                copy = SessionState.from_buffer_copy(state)
+                if state.seq == seq:
+                    break
+            time.sleep(0)  # a writer is mid-update; let it finish
+        return {
+            'state': JOB_STATES[copy.job_state],
+            'print_progress': copy.print_progress,
+            'total_lines': copy.total_lines,
+            'current_source_line': copy.current_source_line,
+            'print_error': copy.print_error.decode('utf-8', errors='replace') or None,
+            'temperatures': {field: getattr(copy, field) for field in TEMPERATURE_FIELDS},
+            'telemetry_time': copy.telemetry_time or None,
+        }
+
+    def transition_log(self):
+        """Accepted job state transitions, oldest first"""
+        if self.streamer:
+            return self.streamer.transitions()
+        return list(self.transitions)
+
+    # --- Connection ---
+    def connect(self, port, baud_rate, reset=True):
+        """
+        Open the serial port; raises serial.SerialException on failure. With reset=False
+        the board is not reset, and an SD print it is running is reattached.
+        """
+        self._log(logging.INFO, f"Attempting to connect to printer on {port} at {baud_rate} baud"
+                                f"{'' if reset else ' without reset'}")
+        if self.streamer_mode == 'process':
+            from streamer_process import StreamerProcess
+            self.streamer = StreamerProcess(self.printer_id)
+            self.state = self.streamer.state
+            try:
+                self.connection = self.streamer.connect(port, baud_rate, self.cpu, reset)
+            except Exception:
+                self.state = SessionState()
+                self.streamer.close()
+                self.streamer = None
+                raise
+        else:
+            started = time.perf_counter()
+            self.printer = open_serial(port, baud_rate, reset)
+            try:
+                if capture_dir():
+                    self.printer = RecordingSerial(self.printer, SerialRecorder(capture_dir(), self.printer_id))
+                self.state.rx_lines = self.state.rx_noisy_lines = self.state.rx_noise_bytes = 0
+                self.state.pending_acks = self.state.unacked_lines = 0
+                self.connection = self._handshake(started)
+                if not reset:
+                    self.connection['attached'] = self._reattach()
+            except Exception:
+                self.printer.close()  # or a retry finds the port busy
+                self.printer = None
+                raise
+        attached = self.connection.get('attached')
+        if attached:
+            self.job_source = 'sd'
+            self.current_file = attached['file']
+            self.print_started = time.time()
+        self.state.connected = True
+        self.port = port
+        self.z_offset = 0.0
+        self._log(logging.INFO, f"Successfully connected to printer on {port} "
+                                f"({self.connection['handshake']} in {self.connection['connect_ms']:.0f} ms)")
+
+    def _handshake(self, started, deadline=CONNECT_DEADLINE):
+        """
+        Wait until the firmware is ready for commands: it has answered M115 and
+        every M115 it received has been acknowledged, so no stray ok is left to be
+        mistaken for the first print line's. A 'start' banner means the board just
+        reset and dropped anything sent before it. Returns the connection info;
+        its handshake is 'm115' when ready, otherwise what was heard by the
+        deadline: 'firmware' (a report, acks missing), 'banner' or 'timeout'.
+        """
+        firmware, capabilities = None, {}
+        outstanding, banner = 0, False
+        last_activity = None
+        end = time.monotonic() + deadline
+        while time.monotonic() < end:
+            now = time.monotonic()
+            if self.printer.in_waiting == 0:
+                if last_activity is None or now - last_activity >= HELLO_INTERVAL:
+                    self.printer.write(b'M115\n')
+                    outstanding += 1
+                    last_activity = now
+                time.sleep(0.01)
+                continue
+            line = self._readline()
+            last_activity = time.monotonic()
+            if not line:
+                continue
+            self._note_telemetry(line)
+            if line == 'start':
+                banner, outstanding = True, 0
+                self.printer.write(b'M115\n')
+                outstanding += 1
+            elif parse_firmware_report(line):
+                firmware = parse_firmware_report(line)
+            elif line.startswith('Cap:'):
+                capabilities.update((name, value == '1') for name, value in CAPABILITY_PATTERN.findall(line))
+            elif line.startswith('ok'):
+                outstanding -= 1
+                if firmware and outstanding <= 0:
+                    handshake = 'm115'
+                    break
+        else:
+            if firmware:
+                handshake = 'firmware'  # answered M115, but not every M115 was acknowledged
+                self._log(logging.WARNING, f"M115 answered but not acknowledged within {deadline:g}s; "
+                                           "continuing anyway")
+            elif banner:
+                handshake = 'banner'
+                self._log(logging.WARNING, f"Printer reset but did not answer M115 within {deadline:g}s; "
+                                           "continuing anyway")
+            else:
+                handshake = 'timeout'
+                self._log(logging.WARNING, f"No M115 reply within {deadline:g}s; continuing anyway")
+        return {
+            'handshake': handshake,
+            'reset_banner': banner,
+            'connect_ms': round((time.perf_counter() - started) * 1000, 1),
+            'firmware': firmware,
+            'capabilities': capabilities,
+        }
+
+    def disconnect(self):
+        if self.is_printing and self.job_source == 'host':
+            self.cancel()  # Stop any ongoing print (an SD print keeps running without us)
+            if self.print_thread is not None and self.print_thread is not threading.current_thread():
+                # Let it send the heater-off commands and record the job as cancelled, not as a serial error
+                self.print_thread.join(CANCEL_JOIN_TIMEOUT)
+        if self.streamer:
+            self.state = SessionState.from_buffer_copy(self.state)  # keep last known values
+            self.streamer.close()
+            self.streamer = None
+            self._transition('idle', 'streamer closed')  # if it stopped before finishing the cancel
+        elif self.is_connected:
+            self.printer.close()
+        self.state.connected = False
+        self.printer = None
+        self.port = None
+
+    def read_responses(self):
+        lines = []
+        if self.is_connected:
+            while self.printer.in_waiting > 0:
+                try:
+                    line = self._readline()
+                    if line:
+                        self._note_telemetry(line)
+                        lines.append(line)
+                except Exception as e:
+                    self._log(logging.WARNING, f"Error reading printer response: {e}")
+                    break
+        return lines
+
+    def _readline(self):
+        """Next received line as text, line noise stripped and counted; '' if nothing is left"""
+        raw = self.printer.readline()
+        state = self.state
+        state.rx_lines += 1
+        noise = len(raw.translate(None, TEXT_BYTES))
+        if noise:
+            state.rx_noisy_lines += 1
+            state.rx_noise_bytes += noise
+            raw = raw.translate(None, NOISE_BYTES)
+        line = raw.strip().decode('ascii')
+        if line:
+            self.hot.trace('recv %s', line)
+        return line
+
+    def _note_telemetry(self, line):
+        if 'T:' in line:
+            temps = parse_temperatures(line)
+            if temps:
+                self._update(telemetry_time=time.time(), **temps)
+
+    def _exchange(self, command, timeout):
+        """Write one command and collect its response up to and including ok (or error)"""
+        self.printer.write(command.encode() + b'\n')
+        self.hot.trace('send %s', command)
+        lines = []
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.printer.in_waiting == 0:
+                time.sleep(0.005)
+                continue
+            line = self._readline()
+            if not line:
+                continue
+            self._note_telemetry(line)
+            lowered = line.lower()
+            if lowered.startswith('ok') and self._take_pending_ack():
+                continue  # answers an immediate command written earlier, not this one
+            lines.append(line)
+            if lowered.startswith('ok') or 'error' in lowered:
+                break
+        return lines
+
+    def _streaming(self):
+        return self.print_thread is not None and self.print_thread.is_alive()
+
+    def execute(self, command, timeout=COMMAND_TIMEOUT):
+        """
+        Run one manual command and return its correlated response:
+        {command, response, injected, wait_ms, round_trip_ms}. While a print is streaming
+        the command waits for the next line boundary instead of racing the print loop
+        for the port. Raises RuntimeError if it did not complete within timeout.
+        """
+        if self.streamer:
+            return self.streamer.execute(command, timeout)
+        command = command.strip()
+        started = time.perf_counter()
+        if self._streaming() and command.upper().startswith(IMMEDIATE_COMMANDS):
+            # Written at once; the print loop reads its ok and must not take it for the current line's
+            with self.state_lock:
+                self.state.pending_acks += 1
+            self.printer.write(command.encode() + b'\n')
+            return {'command': command, 'response': [], 'injected': False, 'wait_ms': 0.0,
+                    'round_trip_ms': round((time.perf_counter() - started) * 1000, 3)}
+        if self._streaming():
+            injection = {'command': command, 'queued': started, 'done': threading.Event(),
+                         'response': None, 'wait': None}
+            self.injections.append(injection)
+            deadline = time.monotonic() + timeout
+            while not injection['done'].wait(0.1):
+                streaming = self._streaming()
+                if streaming and time.monotonic() < deadline:
+                    continue
+                try:
+                    self.injections.remove(injection)  # not picked up yet: withdraw it
+                except ValueError:
+                    continue  # the print loop is sending it right now
+                if streaming:
+                    raise RuntimeError(f'{command} was not sent within {timeout:g}s')
+                break  # the print ended first; send it directly below
+            else:
+                return {'command': command, 'response': injection['response'], 'injected': True,
+                        'wait_ms': round(injection['wait'] * 1000, 3),
+                        'round_trip_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+        with self.serial_lock:
+            response = self._exchange(command, timeout)
+        return {'command': command, 'response': response, 'injected': False, 'wait_ms': 0.0,
+                'round_trip_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+    def send_command(self, command):
+        """Send one manual command and return the lines the printer answered it with"""
+        return self.execute(command)['response']
+
+    def query_temperatures(self):
+        """
+        Latest temperatures. While a job runs they are the ones the print loop parsed
+        from the stream (no M105 is injected per status poll); otherwise M105 is sent.
+        """
+        if self.is_printing:
+            return dict(self.temperatures)
+        try:
+            self.execute('M105', timeout=STATUS_QUERY_TIMEOUT)
+        except RuntimeError:
+            pass  # e.g. queued behind a long heat-up line: report the cached values
+        return dict(self.temperatures)
+
+    # --- Job control ---
+    # Each returns False when the job's current state does not allow the request.
+    def start_print(self, filepath, filename, build_index=True, command_filter=None):
+        command_filter = command_filter or active_filter()
+        if self.streamer:
+            if not self.streamer.control('print', path=filepath, command_filter=command_filter.to_dict()):
+                return False
+            self.current_index = get_index(filepath)  # the streamer process only sends lines
+        else:
+            self.job_source = 'host'
+            if not self._transition('preparing', filename, error='', print_progress=0,
+                                    total_lines=0, current_source_line=0):
+                return False
+            self.print_thread = threading.Thread(target=self._print_job,
+                                                 args=(filepath, build_index, command_filter),
+                                                 name=f'print-{self.printer_id}', daemon=True)
+            self.print_thread.start()
+        self.current_file = filename
+        self.print_started = time.time()
+        return True
+
+    def cancel(self):
+        """Ask the print loop to stop; it turns the heaters off and goes idle"""
+        if self.streamer:
+            return self.streamer.control('cancel')
+        return self._transition('cancelling', 'cancel requested')
+
+    def pause(self):
+        """Ask the print loop to hold before the next line"""
+        if self.streamer:
+            return self.streamer.control('pause')
+        return self._transition('pausing', 'pause requested')
+
+    def resume(self):
+        if self.streamer:
+            return self.streamer.control('resume')
+        return self._transition('printing', 'resumed', only_from=('pausing', 'paused'))
+
+    # --- Placement profile ---
+    PROFILE_FIELDS = ('build_volume', 'nozzle_diameter', 'material')
+
+    def profile(self):
+        return {field: getattr(self, field) for field in self.PROFILE_FIELDS}
+
+    def update_profile(self, values):
+        """Set any of build_volume ([x, y, z]), nozzle_diameter and material; raises ValueError"""
+        if values.get('build_volume') is not None:
+            volume = [float(v) for v in values['build_volume']]
+            if len(volume) != 3:
+                raise ValueError('build_volume needs [x, y, z]')
+            self.build_volume = volume
+        if values.get('nozzle_diameter') is not None:
+            self.nozzle_diameter = float(values['nozzle_diameter'])
+        if values.get('material') is not None:
+            self.material = str(values['material']).strip() or None
+
+    # --- Progress ---
+    @property
+    def progress_percent(self):
+        return (self.print_progress / self.total_lines) * 100 if self.total_lines > 0 else 0
+
+    def print_position(self):
+        """Resolve the last acknowledged file line to a toolpath segment and layer"""
+        if self.current_index is None:
+            return None
+        return self.current_index.position_for_line(self.current_source_line)
+
+    def job_status(self, snapshot=None):
+        """Job part of the status response (no serial I/O)"""
+        snapshot = snapshot or self.snapshot()
+        state, progress, total = snapshot['state'], snapshot['print_progress'], snapshot['total_lines']
+        percent = (progress / total) * 100 if total > 0 else 0
+        if state in ACTIVE_JOB_STATES:
+            position = None
+            if self.current_index is not None:
+                position = self.current_index.position_for_line(snapshot['current_source_line'])
+            return {
+                'status': 'paused' if state in ('pausing', 'paused') else 'printing',
+                'state': state,
+                'source': self.job_source,  # for 'sd', current_line/total_lines count file bytes
+                'progress': round(percent, 2),
+                'filename': self.current_file,
+                'current_line': progress,
+                'total_lines': total,
+                'position': position,
+            }
+        if state == 'error':
+            return {
+                'status': 'error',
+                'state': state,
+                'progress': percent,
+                'filename': self.current_file,
+                'current_line': progress,
+                'total_lines': total,
+            }
+        return {
+            'status': 'connected',
+            'state': state,
+            'progress': 0,
+            'filename': "",
+            'current_line': 0,
+            'total_lines': 0,
+        }
+
+    def summary(self):
+        """Cheap snapshot for the farm overview: cached telemetry, never touches the port"""
+        snapshot = self.snapshot()
+        job = self.job_status(snapshot) if self.is_connected else {'status': 'not_connected'}
+        job.pop('position', None)
+        return dict(
+            job,
+            id=self.printer_id,
+            name=self.name,
+            streamer=self.streamer_mode,
+            port=self.port,
+            connected=self.is_connected,
+            bed_clear=self.bed_clear,
+            firmware=(self.connection or {}).get('firmware'),
+            current_job=self.current_job,
+            profile=self.profile(),
+            is_paused=snapshot['state'] in ('pausing', 'paused'),
+            error=snapshot['print_error'],
+            temperatures=snapshot['temperatures'],
+            telemetry_age=(round(time.time() - snapshot['telemetry_time'], 1)
+                           if snapshot['telemetry_time'] else None),
+        )
+
+    # --- Streamer timing ---
+    def _record_gap(self, gap):
+        state = self.state
+        state.gap_count += 1
+        state.gap_sum += gap
+        state.gap_sum_sq += gap * gap
+        if gap > state.gap_max:
+            state.gap_max = gap
+
+    def streamer_metrics(self):
+        """Ack -> next write turnaround (ms), manual command injections and line noise received"""
+        state = self.state
+        count = state.gap_count
+        mean = state.gap_sum / count if count else 0.0
+        variance = max(state.gap_sum_sq / count - mean * mean, 0.0) if count else 0.0
+        return {
+            'mode': self.streamer_mode,
+            'cpu': self.cpu,
+            'lines': count,
+            'turnaround_mean_ms': round(mean * 1000, 3),
+            'jitter_ms': round(math.sqrt(variance) * 1000, 3),
+            'turnaround_max_ms': round(state.gap_max * 1000, 3),
+            'injected_commands': state.inject_count,
+            'injection_wait_mean_ms': round(state.inject_wait_sum / state.inject_count * 1000, 3)
+                                      if state.inject_count else 0.0,
+            'injection_wait_max_ms': round(state.inject_wait_max * 1000, 3),
+            'received_lines': state.rx_lines,
+            'noisy_lines': state.rx_noisy_lines,
+            'noise_bytes': state.rx_noise_bytes,
+            'noise_rate': round(state.rx_noisy_lines / state.rx_lines, 6) if state.rx_lines else 0.0,
+        }
+
+    def reset_streamer_metrics(self):
+        self.state.gap_count = self.state.inject_count = 0
+        self.state.gap_sum = self.state.gap_sum_sq = self.state.gap_max = 0.0
+        self.state.inject_wait_sum = self.state.inject_wait_max = 0.0
+
+    # --- Reattaching to a running SD print ---
+    def _reattach(self):
+        """After a connect without reset: if the firmware is printing from SD, follow that job"""
+        status = ' '.join(self._exchange('M27', COMMAND_TIMEOUT))
+        progress = SD_PROGRESS_PATTERN.search(status)
+        if not progress:
+            return None
+        current = SD_FILE_PATTERN.search('\n'.join(self._exchange('M27 C', COMMAND_TIMEOUT)))
+        filename = (current.group(2) or current.group(1)) if current else 'SD print'
+        done, size = int(progress.group(1)), int(progress.group(2))
+        self.current_index = None
+        self.job_source = 'sd'
+        self._transition('preparing', 'reattach', error='', print_progress=done, total_lines=size,
+                         current_source_line=0)
+        self._transition('printing', f'SD print of {filename} in progress')
+        self.print_thread = threading.Thread(target=self._follow_sd_job, name=f'sd-{self.printer_id}',
+                                             daemon=True)
+        self.print_thread.start()
+        self._log(logging.INFO, f"Reattached to SD print {filename} at byte {done}/{size}")
+        return {'source': 'sd', 'file': filename, 'byte': done, 'size': size}
+
+    def _follow_sd_job(self):
+        """
+        Print loop stand-in while the firmware prints from SD: relays pause, resume and
+        cancel as M25/M24/M524, polls progress (bytes) and temperatures, and serves
+        injected manual commands.
+        """
+        sd_paused = False
+        next_poll = 0.0
+        try:
+            while self.is_connected:
+                self._send_injections()
+                state = self.job_state
+                if state == 'cancelling':
+                    for command in ('M524', 'M104 S0', 'M140 S0'):  # abort SD print, heaters off
+                        self._exchange(command, COMMAND_TIMEOUT)
+                    break
+                if state == 'pausing':
+                    self._exchange('M25', COMMAND_TIMEOUT)
+                    sd_paused = self._transition('paused', 'SD print paused')
+                elif state == 'printing' and sd_paused:
+                    self._exchange('M24', COMMAND_TIMEOUT)
+                    sd_paused = False
+                if time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + SD_POLL_INTERVAL
+                    status = ' '.join(self._exchange('M27', COMMAND_TIMEOUT) + self._exchange('M105', COMMAND_TIMEOUT))
+                    progress = SD_PROGRESS_PATTERN.search(status)
+                    if progress:
+                        self._update(print_progress=int(progress.group(1)), total_lines=int(progress.group(2)))
+                    elif 'Not SD printing' in status and not sd_paused:
+                        self._log(logging.INFO, "SD print finished")
+                        break
+                time.sleep(0.1)
+        except Exception as e:
+            if self.is_connected:
+                self._log(logging.ERROR, f"Lost SD print: {e}")
+                self._transition('error', 'exception', error=f"Lost SD print: {e}")
+        finally:
+            if self.job_state == 'cancelling':
+                self._transition('idle', 'cancelled')
+            else:
+                self._transition('idle', 'finished' if self.is_connected else 'detached')
+
+    # --- Print Streaming Logic ---
+    def _send_injections(self):
+        """Send queued manual commands; called by the print loop between file lines"""
+        while self.injections:
+            try:
+                injection = self.injections.popleft()
+            except IndexError:
+                return  # withdrawn by its requester
+            wait = time.perf_counter() - injection['queued']
+            state = self.state
+            state.inject_count += 1
+            state.inject_wait_sum += wait
+            if wait > state.inject_wait_max:
+                state.inject_wait_max = wait
+            self.hot.trace('inject %s after %.1f ms', injection['command'], wait * 1000)
+            try:
+                injection['response'] = self._exchange(injection['command'], COMMAND_TIMEOUT)
+            except Exception as e:
+                injection['response'] = [f'error: {e}']
+            injection['wait'] = wait
+            injection['done'].set()
+
+    def _take_pending_ack(self):
+        """Consume one outstanding immediate-command ack, if any; True when one was taken"""
+        with self.state_lock:
+            if self.state.pending_acks <= 0:
+                return False
+            self.state.pending_acks -= 1
+            return True
+
+    def _hold_while_paused(self, line_number):
+        """Park at a line boundary while a pause is pending or active; False once cancelled"""
+        waiting = False
+        while True:
+            self._send_injections()
+            state = self.job_state
+            if state == 'cancelling':
+                return False
+            if state == 'pausing':
+                self._transition('paused', f'before line {line_number}')
+            elif state == 'paused':
+                if not waiting:
+                    self._log(logging.INFO, "Print paused, waiting...")
+                    waiting = True
+                time.sleep(0.1)
+            else:
+                return True
+
+    def _print_job(self, filepath, build_index=True, command_filter=None):
+        try:
+            self._log(logging.INFO, f"Starting print job: {filepath}")
+
+            # Read G-code file, building the line -> segment index in the same pass and
+            # applying the command filter, so the streaming loop below sends lines as they are
+            index_builder = GcodeIndexBuilder()
+            command_filter = command_filter or CommandFilter()
+            filter_report = FilterReport()
+            with open_gcode_text(filepath) as f:
+                gcode_lines = []
+                source_lines = []  # File line number of each entry in gcode_lines
+                for line_number, line in enumerate(f, 1):
+                    if build_index:
+                        index_builder.feed_line(line_number, line)
+                    line = line.strip()
+                    if line and not line.startswith(';'):  # Skip empty lines and comments
+                        code, line = command_filter.apply(line)
+                        if code:
+                            filter_report.record(code, line_number, line is not None)
+                        if line is None:
+                            continue
+                        gcode_lines.append(line)
+                        source_lines.append(line_number)
+
+            if build_index:
+                self.current_index = index_builder.build()
+                store_index(filepath, self.current_index)
+            self._log(logging.INFO, f"Total G-code lines: {len(gcode_lines)}")
+            if filter_report.total:
+                self._log(logging.INFO, f"Command filter: {filter_report.summary()}")
+            if not self._transition('printing', 'file loaded', total_lines=len(gcode_lines)):
+                return  # cancelled while loading
+
+            # Send initial setup commands
+            if self.is_connected:
+                setup_commands = ['G21', 'G90', 'M83']  # mm units, absolute positioning, relative extruder
+                for cmd in setup_commands:
+                    self.printer.write(f'{cmd}\n'.encode())
+                    time.sleep(0.1)
+                    self.read_responses()  # Clear responses
+
+            self.state.unacked_lines = 0
+            ack_time = None  # when the previous line was acknowledged
+            injected = 0     # injection count at that moment; turnarounds spent injecting are skipped
+            delay = 0.0      # deliberate pause taken after it
+            recorder = getattr(self.printer, 'recorder', None)
+            for i, line in enumerate(gcode_lines):
+                if recorder:
+                    recorder.line = source_lines[i]
+                if not self._hold_while_paused(i + 1):
+                    self._log(logging.INFO, "Print cancelled by user")
+                    if self.is_connected:
+                        self.printer.write(b'M104 S0\n')  # Turn off hotend
+                        time.sleep(0.1)
+                        self.printer.write(b'M140 S0\n')  # Turn off bed
+                        time.sleep(0.1)
+                        self.printer.write(b'M84\n')     # Disable motors
+                    break
+
+                heating = line.startswith(('M190', 'M109'))
+                if heating:
+                    self._transition('heating', line.split()[0])
+
+                if self.is_connected:
+                    try:
+                        self.printer.write(line.encode() + b'\n')
+                        self.state.lines_sent += 1
+                        self.state.unacked_lines += 1  # stays counted if its ok never comes
+                        self.hot.trace('send line %d/%d: %s', i + 1, len(gcode_lines), line)
+                        if ack_time is not None and not self.is_paused and self.state.inject_count == injected:
+                            self._record_gap(time.perf_counter() - ack_time - delay)
+
+                        # Wait for acknowledgment with appropriate timeout
+                        timeout_seconds = 10  # Default timeout
+                        if line.startswith('M190'):  # Bed heating
+                            timeout_seconds = 300  # 5 minutes
+                        elif line.startswith('M109'):  # Hotend heating
+                            timeout_seconds = 180  # 3 minutes
+                        elif line.startswith('G28'):  # Homing
+                            timeout_seconds = 60   # 1 minute
+                        elif line.startswith('G29'):  # Auto bed leveling
+                            timeout_seconds = 120  # 2 minutes
+
+                        timeout_count = 0
+                        max_timeout = timeout_seconds * 10  # 0.1 second intervals
+                        response_received = False
+
+                        while timeout_count < max_timeout and not response_received:
+                            if self.job_state == 'cancelling':  # Cancelled during wait
+                                break
+
+                            if self.printer.in_waiting > 0:
+                                response = self._readline()
+                                if response:
+                                    self._note_telemetry(response)
+                                    if 'ok' in response.lower():
+                                        if self._take_pending_ack():
+                                            continue  # an immediate command's ok, not this line's
+                                        response_received = True
+                                        self.state.lines_acked += 1
+                                        self.state.unacked_lines -= 1
+                                        ack_time = time.perf_counter()
+                                        injected = self.state.inject_count
+                                        break
+                                    elif 'error' in response.lower():
+                                        message = f"Printer error on line {i+1}: {response}"
+                                        self._log(logging.ERROR, message)
+                                        self._transition('error', 'printer error', error=message)
+                                        return
+
+                            time.sleep(0.1)
+                            timeout_count += 1
+
+                        if not response_received and self.job_state != 'cancelling':
+                            self.hot.log('timeout', logging.WARNING, '[%s] Timeout waiting for response on line %d: %s',
+                                         self.printer_id, i + 1, line)
+                            # Continue anyway for non-critical commands
+                            if line.startswith(('M190', 'M109', 'G28', 'G29')):
+                                self._log(logging.ERROR, f"Critical command timeout on line {i+1}")
+                                self._transition('error', 'timeout', error=f"Timeout on critical command: {line}")
+                                return
+
+                    except Exception as e:
+                        self._log(logging.ERROR, f"Error sending line {i+1}: {str(e)}")
+                        self._transition('error', 'serial error', error=f"Error on line {i+1}: {str(e)}")
+                        return
+
+                self._update(print_progress=i + 1, current_source_line=source_lines[i])
+                if heating:
+                    # Refused if a pause or cancel came in while heating
+                    self._transition('printing', 'temperature reached', only_from=('heating',))
+
+                # Variable delay based on command type
+                if heating:
+                    delay = 0.5   # Longer delay for heating commands
+                elif line.startswith(('G0', 'G1')):
+                    delay = 0.02  # Short delay for movement
+                else:
+                    delay = 0.1   # Standard delay
+                time.sleep(delay)
+
+            if self.job_state != 'cancelling':
+                self._log(logging.INFO, "Print job completed successfully")
+
+        except Exception as e:
+            self._log(logging.ERROR, f"Print job error: {str(e)}")
+            self._transition('error', 'exception', error=f"Print job failed: {str(e)}")
+        finally:
+            recorder = getattr(self.printer, 'recorder', None)
+            if recorder:
+                recorder.line = -1  # later traffic belongs to no job line
+            # Finished or cancelled; refused (and a no-op) after an error
+            self._transition('idle', 'cancelled' if self.job_state == 'cancelling' else 'finished')
+            self._log(logging.INFO, "Print job thread finished")
@@ -0,0 +1,44 @@
+# Serial Port Ownership
+# Only one backend process may own the printers' serial ports. The owner holds an
+# exclusive lock on a file in the uploads directory for as long as it runs; any
+# other process importing the app (a second server, an extra WSGI worker) sees the
+# lock taken and leaves the ports alone.
+
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_lock_file = None
+
+
+def acquire_serial_ownership(lock_path):
+    """Try to become the serial owner; returns (is_owner, owner_pid)"""
+    global _lock_file
+    if _lock_file is not None:
+        return True, os.getpid()
+    lock_file = open(lock_path, 'a+')
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        try:
+            lock_file.seek(0)
+            owner = lock_file.read().strip()
+        except OSError:  # Windows locks are mandatory, the owner's PID may be unreadable
+            owner = ''
+        lock_file.close()
+        return False, int(owner) if owner.isdigit() else None
+
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file  # held (and the lock with it) until the process exits
+    return True, os.getpid()
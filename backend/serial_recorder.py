@@ -0,0 +1,260 @@
+# Serial Traffic Recorder
+# Always-on capture of every chunk written to and read from a printer port, with
+# monotonic timestamps and the job line being printed, so a failed print can be
+# examined (and replayed, see serial_replay.py) after the fact.
+#
+# Capture file (.cap):
+#   header   MAGIC, then <d wall-clock time the capture (connection) started
+#   frames   <II compressed size, raw size, then zlib data holding records
+#   record   <dBiI seconds since capture start, direction (TX/RX), job line (-1 if
+#            none), payload size, then the payload bytes
+# Frames decompress independently. A <name>.cap.idx sidecar (JSON) lists each
+# frame's offset, time range and job line range, so a reader can start at any job
+# line; without it the frame headers are scanned instead.
+#
+# record() only appends to an in-memory frame; compression and file I/O happen on
+# the recorder's writer thread. Files rotate at MAX_FILE_BYTES and only the newest
+# MAX_FILES per printer are kept.
+
+import glob
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SERCAP1\n'
+FILE_HEADER = struct.Struct('<d')
+FRAME_HEADER = struct.Struct('<II')
+RECORD_HEADER = struct.Struct('<dBiI')
+TX, RX = 0, 1
+FRAME_BYTES = 64 * 1024        # raw record bytes per compressed frame
+FLUSH_INTERVAL = 1.0           # a partial frame is written after this many seconds
+MAX_FILE_BYTES = 16 * 1024 * 1024
+MAX_FILES = 20
+
+_capture_dir = None
+
+
+def capture_dir():
+    """Directory new connections record into, or None when recording is off"""
+    return _capture_dir
+
+
+def set_capture_dir(directory):
+    global _capture_dir
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _capture_dir = directory
+
+
+class SerialRecorder:
+    """Rotating, compressed capture of one printer connection"""
+
+    def __init__(self, directory, name, max_file_bytes=MAX_FILE_BYTES, max_files=MAX_FILES,
+                 frame_bytes=FRAME_BYTES):
+        self.directory = directory
+        self.name = name
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.frame_bytes = frame_bytes
+        self.line = -1                 # job line being sent; set by the print loop
+        self._lock = threading.Lock()
+        self._frame = bytearray()
+        self._frame_meta = None        # [first t, last t, min line, max line, records]
+        self._started = time.monotonic()
+        self._wall_started = time.time()
+        self._frames = queue.SimpleQueue()
+        self._file = None
+        self.path = None
+        self._index = []
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._open_file()
+        self._writer = threading.Thread(target=self._write_frames, name=f'recorder-{name}', daemon=True)
+        self._writer.start()
+
+    # --- Capture (any thread) ---
+    def record(self, direction, data):
+        """Append one TX/RX chunk to the current frame"""
+        line = self.line
+        with self._lock:
+            stamp = time.monotonic() - self._started
+            self._frame += RECORD_HEADER.pack(stamp, direction, line, len(data))
+            self._frame += data
+            meta = self._frame_meta
+            if meta is None:
+                self._frame_meta = [stamp, stamp, line, line, 1]
+            else:
+                meta[1] = stamp
+                if line >= 0:
+                    meta[2] = line if meta[2] < 0 else min(meta[2], line)
+                    meta[3] = max(meta[3], line)
+                meta[4] += 1
+            if len(self._frame) >= self.frame_bytes:
+                self._hand_off()
+
+    def _hand_off(self):
+        """Queue the current frame for the writer; called with the lock held"""
+        if self._frame:
+            self._frames.put((bytes(self._frame), self._frame_meta))
+            self._frame = bytearray()
+            self._frame_meta = None
+
+    def close(self):
+        """Write what is buffered and finish the file and its index"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._hand_off()
+        self._frames.put(None)
+        self._writer.join(timeout=5)
+
+    # --- Writer thread ---
+    def _open_file(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(self.directory, f'{self.name}-{stamp}-{int(time.time() * 1000) % 1000:03d}.cap')
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC + FILE_HEADER.pack(self._wall_started))
+        self._index = []
+
+    def _finish_file(self):
+        self._file.close()
+        with open(self.path + '.idx.tmp', 'w') as f:
+            json.dump({'frames': self._index}, f)
+        os.replace(self.path + '.idx.tmp', self.path + '.idx')
+
+    def _prune(self):
+        captures = sorted(glob.glob(os.path.join(self.directory, f'{glob.escape(self.name)}-*.cap')))
+        for old in captures[:-self.max_files]:
+            for path in (old, old + '.idx'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _write_frames(self):
+        while True:
+            try:
+                item = self._frames.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                with self._lock:
+                    self._hand_off()  # partial frame: get it on disk within FLUSH_INTERVAL
+                continue
+            if item is None:
+                break
+            raw, meta = item
+            try:
+                compressed = zlib.compress(raw, 1)
+                offset = self._file.tell()
+                self._file.write(FRAME_HEADER.pack(len(compressed), len(raw)) + compressed)
+                self._file.flush()
+                self._index.append([offset] + meta)
+                if self._file.tell() >= self.max_file_bytes:
+                    self._finish_file()
+                    self._open_file()
+                    self._prune()
+            except OSError as e:
+                logger.warning(f"Serial capture {self.path} failed: {e}")
+        try:
+            self._finish_file()
+        except OSError as e:
+            logger.warning(f"Could not finish serial capture {self.path}: {e}")
+
+
+class RecordingSerial:
+    """Serial port wrapper that records everything written to and read from it"""
+
+    def __init__(self, port, recorder):
+        self._port = port
+        self.recorder = recorder
+
+    def write(self, data):
+        self.recorder.record(TX, data)
+        return self._port.write(data)
+
+    def readline(self):
+        data = self._port.readline()
+        if data:
+            self.recorder.record(RX, data)
+        return data
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        if data:
+            self.recorder.record(RX, data)
+        return data
+
+    def close(self):
+        try:
+            self._port.close()
+        finally:
+            self.recorder.close()
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+# --- Reading captures ---
+def _scan_frames(f):
+    """Frame index rebuilt from the frame headers (for a file without its .idx)"""
+    frames = []
+    f.seek(len(MAGIC) + FILE_HEADER.size)
+    while True:
+        offset = f.tell()
+        header = f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            break
+        compressed_size, _ = FRAME_HEADER.unpack(header)
+        data = f.read(compressed_size)
+        if len(data) < compressed_size:
+            break  # cut off mid-frame (the backend stopped while writing)
+        frames.append([offset, None, None, None, None, None])
+    return frames
+
+
+class CaptureReader:
+    """Records of one capture file, optionally starting at a job line"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a serial capture')
+            self.started = FILE_HEADER.unpack(f.read(FILE_HEADER.size))[0]
+            try:
+                with open(path + '.idx') as index:
+                    self.frames = json.load(index)['frames']
+            except (OSError, ValueError):
+                self.frames = _scan_frames(f)
+
+    def _start_frame(self, line):
+        if line is None:
+            return 0
+        for i, frame in enumerate(self.frames):
+            if frame[4] is None or frame[4] >= line:
+                return i  # unindexed frames cannot be skipped
+        return len(self.frames)
+
+    def records(self, from_line=None):
+        """Yield (seconds, direction, job line, data), from the frame holding from_line on"""
+        with open(self.path, 'rb') as f:
+            for frame in self.frames[self._start_frame(from_line):]:
+                f.seek(frame[0])
+                compressed_size, _ = FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))
+                raw = zlib.decompress(f.read(compressed_size))
+                position = 0
+                while position < len(raw):
+                    stamp, direction, line, size = RECORD_HEADER.unpack_from(raw, position)
+                    position += RECORD_HEADER.size
+                    data = raw[position:position + size]
+                    position += size
+                    if from_line is None or line < 0 or line >= from_line:
+                        yield stamp, direction, line, data
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Serial Capture Replay
+Feeds the received side of a serial capture (see serial_recorder.py) back through
+the backend's response handling: the lines are served by a fake port to
+get_printer_response() and each response goes through EnhancedPauseDetector, as
+during a print. Reports where pauses were detected and the cost per line.
+
+Usage: python serial_replay.py uploads/captures/default-....cap [--from-line N]
+                               [--realtime] [--handler nuclear|improved] [--list]
+"""
+
+import argparse
+import importlib
+import logging
+import time
+
+from enhanced_pause_detector import EnhancedPauseDetector
+from serial_recorder import RX, TX, CaptureReader
+
+
+class ReplaySerial:
+    """Read side of a printer port, fed one received line at a time"""
+
+    def __init__(self):
+        self.is_open = True
+        self.lines = []
+        self.written = 0
+
+    def push(self, line):
+        self.lines.append(line)
+
+    @property
+    def in_waiting(self):
+        return len(self.lines[0]) if self.lines else 0
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else b''
+
+    def write(self, data):
+        self.written += len(data)  # the handler's own commands go nowhere
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.lines.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+def received_lines(records):
+    """(seconds, job line, raw line) for each received line; RX chunks are re-split on newlines"""
+    pending = b''
+    for stamp, direction, line, data in records:
+        if direction != RX:
+            continue
+        pending += data
+        *complete, pending = pending.split(b'\n')
+        for raw in complete:
+            yield stamp, line, raw + b'\n'
+    if pending:
+        yield stamp, line, pending
+
+
+def replay(reader, handler, from_line=None, realtime=False):
+    """Run the capture through handler.get_printer_response and the pause detector"""
+    port = ReplaySerial()
+    handler.printer = port
+    detector = EnhancedPauseDetector(port)
+    pauses = []
+    lines = 0
+    started = time.perf_counter()
+    first = None
+    for stamp, job_line, raw in received_lines(reader.records(from_line)):
+        if realtime:
+            if first is None:
+                first = (stamp, time.monotonic())
+            wait = stamp - first[0] - (time.monotonic() - first[1])
+            if wait > 0:
+                time.sleep(wait)
+        port.push(raw)
+        for response in handler.get_printer_response():
+            if detector.detect_pause_from_response(response):
+                pauses.append((stamp, job_line, response))
+        lines += 1
+    elapsed = time.perf_counter() - started
+    return {'lines': lines, 'pauses': pauses, 'elapsed': elapsed,
+            'us_per_line': elapsed / lines * 1e6 if lines else 0.0}
+
+
+def list_frames(reader):
+    print(f"{'offset':>10}{'from s':>10}{'to s':>10}{'lines':>16}{'records':>9}")
+    for offset, first, last, min_line, max_line, count in reader.frames:
+        if first is None:
+            print(f'{offset:>10}  (no index)')
+            continue
+        lines = f'{min_line}-{max_line}' if max_line >= 0 else '-'
+        print(f'{offset:>10}{first:>10.2f}{last:>10.2f}{lines:>16}{count:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a serial capture through the response handling')
+    parser.add_argument('capture', help='.cap file written by the serial recorder')
+    parser.add_argument('--from-line', type=int, help='start at the frame holding this job (file) line')
+    parser.add_argument('--realtime', action='store_true', help='keep the recorded timing instead of full speed')
+    parser.add_argument('--handler', choices=('nuclear', 'improved'), default='nuclear',
+                        help='backend whose get_printer_response() parses the lines')
+    parser.add_argument('--list', action='store_true', help='print the frame index and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    reader = CaptureReader(args.capture)
+    if args.list:
+        list_frames(reader)
+        return
+    sent = sum(len(data) for _, direction, _, data in reader.records(args.from_line) if direction == TX)
+    handler = importlib.import_module('app_nuclear' if args.handler == 'nuclear' else 'improved_app')
+    result = replay(reader, handler, args.from_line, args.realtime)
+
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.started))
+    print(f"Capture started {started}: {result['lines']} received lines, {sent} bytes sent")
+    print(f"Replay took {result['elapsed']:.3f}s ({result['us_per_line']:.1f} us per line)")
+    print(f"Pauses detected: {len(result['pauses'])}")
+    for stamp, job_line, response in result['pauses']:
+        print(f"  {stamp:10.3f}s  line {job_line if job_line >= 0 else '-':>7}  {response}")
+
+
+if __name__ == '__main__':
+    main()
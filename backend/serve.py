@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Production Server
+Serves the backend from one process with a pool of worker threads, so a single
+process owns every serial port while many web requests are handled concurrently.
+Uses waitress when it is installed, otherwise a thread-pool Werkzeug server
+(app.run() is Werkzeug's development server and should not face real traffic).
+
+The default `app` takes the serial ownership lock (uploads/.serial-owner.lock) on
+import. Any other process serving it is not forwarded to the owner: it still serves
+files and the queue but answers printer routes with 503. Other backends given with
+--app (e.g. improved_app) take no lock at all, so run only one process of those.
+
+Usage: python serve.py [--host 0.0.0.0] [--port 5000] [--threads 8]
+                       [--server auto|waitress|werkzeug] [--app app]
+"""
+
+import argparse
+import importlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server handling requests on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        self.pool.shutdown(wait=False)
+        super().server_close()
+
+
+def serve(app, host, port, threads, server='auto'):
+    if server in ('auto', 'waitress'):
+        try:
+            import waitress
+        except ImportError:
+            if server == 'waitress':
+                raise
+            waitress = None
+        if waitress:
+            logger.info(f"Serving on http://{host}:{port} with waitress ({threads} threads)")
+            waitress.serve(app, host=host, port=port, threads=threads)
+            return
+    logger.info(f"Serving on http://{host}:{port} with Werkzeug thread pool ({threads} threads)")
+    httpd = ThreadPoolWSGIServer(host, port, app, threads)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the printer backend with a production server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help='concurrent request workers')
+    parser.add_argument('--server', choices=('auto', 'waitress', 'werkzeug'), default='auto')
+    parser.add_argument('--app', default='app',
+                        help='backend module exposing `app` (only the default `app` takes the serial owner lock)')
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.app)  # configures logging; `app` also tries to become the serial owner
+    serve(module.app, args.host, args.port, args.threads, args.server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Server Load Benchmark
+Hammers a running backend with concurrent clients and reports request latency
+percentiles per endpoint, to compare server modes and worker counts.
+
+Usage: python server_benchmark.py [--url http://127.0.0.1:5000] [--clients 16]
+                                  [--duration 10] [--paths /api/status,/api/farm/status]
+"""
+
+import argparse
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+
+
+def client(base_url, paths, deadline, results, errors, lock):
+    latencies = defaultdict(list)
+    failed = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url + path, timeout=10) as response:
+                response.read()
+        except Exception:
+            failed += 1
+            continue
+        latencies[path].append(time.perf_counter() - start)
+    with lock:
+        for path, values in latencies.items():
+            results[path].extend(values)
+        errors[0] += failed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent client load test for the backend')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--paths', default='/api/status,/api/farm/status,/api/files')
+    args = parser.parse_args()
+
+    paths = args.paths.split(',')
+    results, errors, lock = defaultdict(list), [0], threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    clients = [threading.Thread(target=client, args=(args.url, paths[i % len(paths):] + paths[:i % len(paths)],
+                                                     deadline, results, errors, lock))
+               for i in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    total = sum(len(values) for values in results.values())
+    print(f"{args.clients} clients, {args.duration:g}s: {total} requests "
+          f"({total / args.duration:.0f} req/s), {errors[0]} errors")
+    print(f"{'path':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for path in paths:
+        values = sorted(results[path])
+        if not values:
+            continue
+        print(f"{path:<24}{len(values):>8}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.95) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}"
+              f"{values[-1] * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Streaming Metrics
+# Counters, gauges and histograms for the print streaming hot path, rendered in the
+# Prometheus text exposition format for a /metrics endpoint (no client library).
+#
+# Updates take no lock: every thread adds into its own cell (a plain list only that
+# thread writes), and a scrape sums the cells. A lock is only taken the first time
+# a thread touches a metric and while scraping, when the cells of threads that have
+# exited are folded into a retired total. Values that are cheap to compute at scrape
+# time (printer state, pause recovery counts) come from collector callbacks instead.
+
+import bisect
+import threading
+import time
+
+ACK_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0, 60.0, 300.0)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class _Cells:
+    """Per-thread value lists of a fixed size, summed when read"""
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells = []               # (thread, cell) of every thread that wrote
+        self._retired = [0] * size     # totals of threads that have exited
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0] * self.size
+            with self._lock:
+                self._cells.append((threading.current_thread(), cell))
+            return cell
+
+    def totals(self):
+        with self._lock:
+            live = []
+            for thread, cell in self._cells:
+                if thread.is_alive():
+                    live.append((thread, cell))
+                else:
+                    self._retired = [a + b for a, b in zip(self._retired, cell)]
+            self._cells = live
+            totals = list(self._retired)
+            for _, cell in live:
+                totals = [a + b for a, b in zip(totals, cell)]
+        return totals
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child metric for one combination of label values (created once, then looked up)"""
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.documentation)
+
+    def _series(self):
+        if self.labelnames:
+            return sorted(self._children.items())
+        return [((), self)]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, metric in self._series():
+            lines += metric._samples(self.labelnames, values)
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+
+    def value(self):
+        return self._cells.totals()[0]
+
+    def _samples(self, names, values):
+        return [f'{self.name}{_format_labels(names, values)} {_format_value(self.value())}']
+
+
+class Gauge(Counter):
+    """Value that goes up and down (inc/dec from any thread), or is read from function at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def dec(self, amount=1):
+        self._cells.cell()[0] -= amount
+
+    def value(self):
+        return self.function() if self.function else super().value()
+
+
+class Histogram(_Metric):
+    """Distribution over fixed upper bounds, with the sum and count of observations"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._cells = _Cells(len(self.buckets) + 2)   # one per bucket, +Inf, then the sum
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, self.buckets)
+
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _samples(self, names, values):
+        totals = self._cells.totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels(names, values, [("le", _format_value(float(bound)))])}'
+                         f' {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(names, values)} {_format_value(float(totals[-1]))}')
+        lines.append(f'{self.name}_count{_format_labels(names, values)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of one process plus collectors that produce extra lines at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, buckets, labelnames=()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def add_collector(self, collector):
+        """collector() returns [(name, type, help, [(labels dict, value), ...]), ...]"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            for name, kind, documentation, samples in collector():
+                lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}'
+                          for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+class BackendMetrics:
+    """A registry with the backend's uptime; per-printer values are added as collectors"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix='printer'):
+        self.registry = registry = MetricsRegistry()
+        self.started = time.time()
+        self._monotonic_start = time.monotonic()
+        registry.gauge(f'{prefix}_uptime_seconds', 'Seconds since the backend started', function=self.uptime)
+        registry.gauge(f'{prefix}_start_time_seconds', 'Unix time the backend started', function=lambda: self.started)
+
+    def uptime(self):
+        return time.monotonic() - self._monotonic_start
+
+    def render(self):
+        return self.registry.render()
+
+
+class StreamMetrics(BackendMetrics):
+    """The streaming engine's metrics: what a print loop and its serial port update per line"""
+
+    def __init__(self, prefix='printer'):
+        super().__init__(prefix)
+        registry = self.registry
+        self.unacked = 0   # lines written whose ok has not been read; set by the (single) print loop
+        self.lines_sent = registry.counter(f'{prefix}_lines_sent_total', 'G-code lines written to the printer')
+        self.lines_acked = registry.counter(f'{prefix}_lines_acked_total', 'G-code lines the printer acknowledged')
+        self.tx_bytes = registry.counter(f'{prefix}_tx_bytes_total', 'Bytes written to the serial port')
+        self.rx_bytes = registry.counter(f'{prefix}_rx_bytes_total', 'Bytes read from the serial port')
+        registry.gauge(f'{prefix}_commands_in_flight', 'Commands sent and not yet acknowledged',
+                       function=lambda: self.unacked)
+        self.resends = registry.counter(f'{prefix}_resends_total', 'Resend requests received from the firmware')
+        self.errors = registry.counter(f'{prefix}_errors_total', 'Print streaming errors by kind', ('kind',))
+        self.ack_latency = registry.histogram(f'{prefix}_ack_latency_seconds',
+                                              'Time from writing a line to its acknowledgement', ACK_LATENCY_BUCKETS)
+        self.line_gap = registry.histogram(f'{prefix}_line_gap_seconds',
+                                           'Time from an acknowledgement to writing the next line', GAP_BUCKETS)
+
+
+class MeteredSerial:
+    """Serial port wrapper counting the bytes written to and read from it"""
+
+    def __init__(self, port, metrics):
+        self._port = port
+        self.metrics = metrics
+
+    def write(self, data):
+        self.metrics.tx_bytes.inc(len(data))
+        return self._port.write(data)
+
+    def readline(self):
+        data = self._port.readline()
+        self.metrics.rx_bytes.inc(len(data))
+        return data
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        self.metrics.rx_bytes.inc(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Streamer Jitter Benchmark
+Prints the same job to a simulated printer (a pseudo-terminal that acknowledges
+every line) with the streamer in-process and out-of-process while other threads
+keep the backend's GIL busy, then compares ack -> next line turnaround jitter.
+
+Usage: python streamer_benchmark.py [--lines 150] [--load-threads 4] [--cpu N]
+POSIX only (uses a pty).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from printer_session import PrinterSession
+
+
+def fake_printer(master_fd):
+    """Answer 'ok' to every line received (M115 with a firmware report), like firmware with an empty planner"""
+    buffer = b''
+    while True:
+        try:
+            data = os.read(master_fd, 4096)
+        except OSError:
+            return
+        if not data:
+            return
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            if line.strip() == b'M115':
+                os.write(master_fd, b'FIRMWARE_NAME:Benchmark MACHINE_TYPE:pty EXTRUDER_COUNT:1\n')
+            os.write(master_fd, b'ok\n')
+
+
+def gil_load(stop):
+    """Stand-in for request handling: JSON encoding of a dashboard-sized payload"""
+    payload = {'files': [{'name': f'part_{i}.gcode', 'size': i * 1000, 'layers': list(range(50))}
+                         for i in range(200)]}
+    while not stop.is_set():
+        json.dumps(payload)
+
+
+def run(mode, gcode_path, port, load_threads, cpu):
+    session = PrinterSession(f'bench-{mode}', streamer_mode=mode, cpu=cpu)
+    session.connect(port, 115200)
+    stop = threading.Event()
+    workers = [threading.Thread(target=gil_load, args=(stop,), daemon=True) for _ in range(load_threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        session.start_print(gcode_path, os.path.basename(gcode_path))
+        time.sleep(1.0)
+        while session.is_printing:
+            time.sleep(0.2)
+        return session.streamer_metrics()
+    finally:
+        stop.set()
+        session.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=150)
+    parser.add_argument('--load-threads', type=int, default=4)
+    parser.add_argument('--cpu', type=int, default=None, help='pin the streamer process to this CPU')
+    args = parser.parse_args()
+
+    master_fd, slave_fd = os.openpty()
+    port = os.ttyname(slave_fd)
+    responder = multiprocessing.get_context('fork').Process(target=fake_printer, args=(master_fd,),
+                                                            daemon=True)
+    responder.start()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.gcode', delete=False) as f:
+        for i in range(args.lines):
+            f.write(f'G1 X{i % 100} Y{(i * 7) % 100} F3000\n')
+        gcode_path = f.name
+
+    try:
+        results = [run(mode, gcode_path, port, args.load_threads, args.cpu) for mode in ('thread', 'process')]
+    finally:
+        os.remove(gcode_path)
+        responder.terminate()
+
+    print(f"{args.lines} lines, {args.load_threads} GIL load threads")
+    print(f"{'mode':<10}{'lines':>8}{'mean ms':>10}{'jitter ms':>11}{'max ms':>10}")
+    for m in results:
+        print(f"{m['mode']:<10}{m['lines']:>8}{m['turnaround_mean_ms']:>10.3f}"
+              f"{m['jitter_ms']:>11.3f}{m['turnaround_max_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
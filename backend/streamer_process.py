@@ -0,0 +1,211 @@
+# Out-of-Process Print Streamer
+# Runs a printer's serial connection and print loop in a dedicated Python process,
+# optionally pinned to one CPU, so the streamer never waits on the backend's GIL.
+# Job state, progress and telemetry are published through a SessionState struct in
+# a shared memory-mapped file that only the child writes. Print, pause/cancel and
+# manual-command requests travel as JSON lines over the child's stdin/stdout.
+#
+# The child is started with subprocess rather than multiprocessing so it never
+# re-imports app.py (which would start a second catalog watcher, etc.).
+
+import ctypes
+import itertools
+import json
+import logging
+import mmap
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import serial
+
+from command_filter import CommandFilter
+from hot_log import start_queue_logging
+from printer_session import PrinterSession, SessionState
+from serial_recorder import capture_dir, set_capture_dir
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 30.0   # seconds for the child to open the port and settle
+COMMAND_TIMEOUT = 10.0   # seconds to wait for a control request or manual command
+
+
+def _map_state(path):
+    """Map the shared state file; returns (mmap, SessionState view)"""
+    with open(path, 'r+b') as f:
+        shared = mmap.mmap(f.fileno(), ctypes.sizeof(SessionState))
+    return shared, SessionState.from_buffer(shared)
+
+
+class StreamerProcess:
+    """Backend-side handle of one streamer process"""
+
+    def __init__(self, printer_id):
+        self.printer_id = printer_id
+        shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self.state_path = tempfile.mkstemp(prefix=f'streamer-{printer_id}-', dir=shm_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bytes(ctypes.sizeof(SessionState)))
+        self._shared, self.state = _map_state(self.state_path)
+        self.process = None
+        self._write_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._pending = {}       # request id -> [threading.Event, reply]
+        self._reader = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def connect(self, port, baud_rate, cpu=None, reset=True):
+        """
+        Start the child and wait until the printer behind the port is ready; returns the
+        connection info, raises serial.SerialException
+        """
+        args = [sys.executable, os.path.abspath(__file__), self.state_path, self.printer_id]
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        cwd=os.getcwd())
+        self._reader = threading.Thread(target=self._read_replies, name=f'streamer-{self.printer_id}',
+                                        daemon=True)
+        self._reader.start()
+        reply = self._request({'op': 'connect', 'port': port, 'baud_rate': baud_rate, 'cpu': cpu,
+                               'reset': reset, 'capture_dir': capture_dir()}, timeout=CONNECT_TIMEOUT)
+        if reply.get('error'):
+            raise serial.SerialException(reply['error'])
+        return reply['connection']
+
+    def _read_replies(self):
+        for raw in self.process.stdout:
+            try:
+                reply = json.loads(raw)
+            except ValueError:
+                continue
+            waiter = self._pending.pop(reply.get('id'), None)
+            if waiter:
+                waiter[1] = reply
+                waiter[0].set()
+        for event, _ in list(self._pending.values()):  # child exited: release any waiters
+            event.set()
+
+    def _send(self, message):
+        with self._write_lock:
+            self.process.stdin.write((json.dumps(message) + '\n').encode())
+            self.process.stdin.flush()
+
+    def _request(self, message, timeout):
+        request_id = next(self._request_ids)
+        waiter = [threading.Event(), None]
+        self._pending[request_id] = waiter
+        self._send(dict(message, id=request_id))
+        if not waiter[0].wait(timeout) or waiter[1] is None:
+            self._pending.pop(request_id, None)
+            return {'error': 'Streamer process did not respond'}
+        return waiter[1]
+
+    def control(self, action, **args):
+        """Run a job control request (print, pause, resume, cancel) in the child; returns accepted"""
+        if 'path' in args:
+            args['path'] = os.path.abspath(args['path'])
+        reply = self._request(dict(args, op='control', action=action), timeout=COMMAND_TIMEOUT)
+        return bool(reply.get('accepted'))
+
+    def transitions(self):
+        return self._request({'op': 'transitions'}, timeout=COMMAND_TIMEOUT).get('transitions', [])
+
+    def execute(self, command, timeout=COMMAND_TIMEOUT):
+        reply = self._request({'op': 'command', 'command': command, 'timeout': timeout},
+                              timeout=timeout + 1.0)
+        if reply.get('error'):
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        if self.is_alive():
+            try:
+                self._send({'op': 'close'})
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        del self.state
+        try:
+            self._shared.close()
+        except BufferError:  # a session still holds a view; the mapping goes away with it
+            pass
+        os.remove(self.state_path)
+
+
+# --- Child process ---
+def _pin_to_cpu(cpu):
+    if cpu is None:
+        return
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {int(cpu)})
+        logger.info(f"Streamer pinned to CPU {cpu}")
+    else:
+        logger.warning("CPU pinning is not supported on this platform")
+
+
+def _reply(out_lock, message):
+    with out_lock:
+        sys.stdout.write(json.dumps(message) + '\n')
+        sys.stdout.flush()
+
+
+def _run_command(session, out_lock, message):
+    try:
+        _reply(out_lock, {'id': message['id'], 'result': session.execute(message['command'], message['timeout'])})
+    except Exception as e:
+        _reply(out_lock, {'id': message['id'], 'error': str(e)})
+
+
+def child_main(state_path, printer_id):
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format=f'%(asctime)s - %(levelname)s - streamer[{printer_id}] %(message)s')
+    start_queue_logging()
+    shared, state = _map_state(state_path)
+    session = PrinterSession(printer_id, state=state)
+    out_lock = threading.Lock()
+
+    for raw in sys.stdin:
+        message = json.loads(raw)
+        op = message.get('op')
+        if op == 'connect':
+            try:
+                _pin_to_cpu(message.get('cpu'))
+                set_capture_dir(message.get('capture_dir'))
+                session.connect(message['port'], message['baud_rate'], message['reset'])
+                _reply(out_lock, {'id': message['id'], 'connection': session.connection})
+            except Exception as e:
+                _reply(out_lock, {'id': message['id'], 'error': str(e)})
+        elif op == 'control':
+            action = message['action']
+            if action == 'print':
+                # Index building stays in the backend; this process only streams lines
+                path = message['path']
+                accepted = session.start_print(path, os.path.basename(path), build_index=False,
+                                               command_filter=CommandFilter(**message['command_filter']))
+            elif action in ('pause', 'resume', 'cancel'):
+                accepted = getattr(session, action)()
+            else:
+                accepted = False
+            _reply(out_lock, {'id': message['id'], 'accepted': accepted})
+        elif op == 'transitions':
+            _reply(out_lock, {'id': message['id'], 'transitions': list(session.transitions)})
+        elif op == 'command':
+            # May wait for a slot in the print stream; keep reading control requests meanwhile
+            threading.Thread(target=_run_command, args=(session, out_lock, message), daemon=True).start()
+        elif op == 'close':
+            break
+
+    # Backend closed the pipe or asked us to stop; an SD print carries on without us
+    if session.job_source == 'host':
+        session.cancel()
+        if session.print_thread:
+            session.print_thread.join(timeout=5)
+    if session.is_connected:
+        session.printer.close()
+
+
+if __name__ == '__main__':
+    child_main(sys.argv[1], sys.argv[2])
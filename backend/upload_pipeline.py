@@ -0,0 +1,279 @@
+# Single-Pass Upload Pipeline
+# Streams an upload to disk in chunks while hashing, indexing, validating and
+# analysing it, so the file never has to be re-opened after it is saved.
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from command_filter import FilterReport, active_filter
+from gcode_index import GcodeIndexBuilder, store_index
+from gcode_storage import FrameCompressor, StreamDecompressor, compression_for
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ISSUES = 100
+MAX_CACHED_ANALYSES = 256   # least recently used analyses are dropped beyond this
+
+# Bytes below 0x20 other than tab/CR/LF are never valid in a G-code line
+_CONTROL_BYTES = bytes(b for b in range(32) if b not in b'\t\r\n')
+_COMMAND_START = re.compile(rb'[GMTFSgmtfs]')
+
+
+def validate_gcode_bytes(line):
+    """Return an issue description for a raw G-code line, or None if it looks valid"""
+    stripped = line.strip()
+    if not stripped or stripped.startswith(b';'):
+        return None
+    if not _COMMAND_START.match(stripped):
+        return 'unknown command'
+    if len(stripped.translate(None, _CONTROL_BYTES)) != len(stripped):
+        return 'control characters'
+    return None
+
+
+class StreamingUploadAnalyzer:
+    """
+    Consumes an upload chunk by chunk and computes everything derived from its content.
+    The hash and size cover the stored bytes; for compressed uploads (compression
+    'gzip' or 'zstd') lines, offsets and layers refer to the decompressed G-code.
+    """
+
+    def __init__(self, compression=None, command_filter=None):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.content_size = 0
+        self.decompressor = StreamDecompressor(compression) if compression else None
+        self.layer_offsets = []          # byte offset of the line each layer starts on
+        self.issue_count = 0
+        self.issues = []                 # first MAX_REPORTED_ISSUES issues
+        self.index_builder = GcodeIndexBuilder()
+        self.command_filter = command_filter or active_filter()
+        self.filter_report = FilterReport()  # lines the command filter will drop or rewrite at print time
+        self._partial = []               # pieces of a line that spans chunks, joined once it ends
+        self._partial_size = 0
+        self._line_number = 0
+
+    def feed(self, chunk):
+        """Process the next chunk of the upload"""
+        if not chunk:
+            return
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        if self.decompressor is None:
+            self._feed_content(chunk)
+        else:
+            for piece in self.decompressor.decompress(chunk):
+                self._feed_content(piece)
+
+    def _feed_content(self, chunk):
+        chunk_start = self.content_size
+        self.content_size += len(chunk)
+
+        start = 0
+        end = chunk.find(b'\n')
+        if self._partial:
+            if end < 0:  # still inside a long line
+                self._partial.append(chunk)
+                self._partial_size += len(chunk)
+                return
+            self._partial.append(chunk[:end + 1])
+            self._process_line(chunk_start - self._partial_size, b''.join(self._partial))
+            self._partial, self._partial_size = [], 0
+            start = end + 1
+            end = chunk.find(b'\n', start)
+        while end >= 0:
+            self._process_line(chunk_start + start, chunk[start:end + 1])
+            start = end + 1
+            end = chunk.find(b'\n', start)
+        if start < len(chunk):
+            self._partial, self._partial_size = [chunk[start:]], len(chunk) - start
+
+    def _process_line(self, offset, raw_line):
+        self._line_number += 1
+
+        issue = validate_gcode_bytes(raw_line)
+        if issue:
+            self.issue_count += 1
+            if len(self.issues) < MAX_REPORTED_ISSUES:
+                self.issues.append({
+                    'line': self._line_number,
+                    'issue': issue,
+                    'text': raw_line.strip()[:50].decode('utf-8', errors='replace'),
+                })
+
+        code, result = self.command_filter.apply(raw_line)
+        if code:
+            self.filter_report.record(code, self._line_number, result is not None)
+
+        # Only movement lines matter to the index; skip decoding everything else
+        stripped = raw_line.lstrip()
+        text = stripped.decode('utf-8', errors='replace') if stripped.startswith((b'G0', b'G1')) else ''
+        layers = len(self.index_builder.layer_first_segments)
+        self.index_builder.feed_line(self._line_number, text)
+        if len(self.index_builder.layer_first_segments) > layers:  # this line starts a layer
+            self.layer_offsets.append(offset)
+
+    def finish(self):
+        """Flush the trailing unterminated line and return the analysis summary"""
+        if self._partial:
+            self._process_line(self.content_size - self._partial_size, b''.join(self._partial))
+            self._partial, self._partial_size = [], 0
+        if self.decompressor and self.size and not self.decompressor.at_frame_end:
+            self.issue_count += 1
+            if len(self.issues) < MAX_REPORTED_ISSUES:
+                self.issues.append({'line': self._line_number, 'issue': 'truncated compressed data', 'text': ''})
+
+        index = self.index_builder.build()
+        layers = [
+            {
+                'layer': layer,
+                'z': index.layer_heights[layer],
+                'line': index.segment_lines[segment],
+                'offset': self.layer_offsets[layer],
+            }
+            for layer, segment in enumerate(index.layer_first_segments)
+        ]
+        return {
+            'sha256': self.sha256.hexdigest(),
+            'size': self.size,
+            'line_count': self._line_number,
+            'segment_count': index.total_segments,
+            'layer_count': index.total_layers,
+            'layers': layers,
+            # Extent of extruding moves: {'min': [x, y, z], 'max': [x, y, z]}
+            'bounds': {'min': index.bounds[:3], 'max': index.bounds[3:]} if index.bounds else None,
+            'validation_issues': self.issue_count,
+            'issues': self.issues,
+            'filtered_commands': self.filter_report.as_dict(),
+            'command_filter': self.command_filter.to_dict(),  # the table filtered_commands was made with
+            'compression': self.decompressor.method if self.decompressor else None,
+            'content_size': self.content_size,
+            # [content offset, stored offset] of each independently decodable frame
+            'frames': self.decompressor.frames if self.decompressor else None,
+        }, index
+
+
+# --- Analysis cache, so later lookups (seek by line, catalog) skip the file ---
+# Least recently used analyses are dropped first.
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def get_cached_analysis(filepath):
+    """Return the analysis recorded for a file at upload time, or None"""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    with _analysis_cache_lock:
+        path = os.path.abspath(filepath)
+        cached = _analysis_cache.get(path)
+        if cached and cached[0] == (stat.st_size, stat.st_mtime_ns):
+            _analysis_cache.move_to_end(path)
+            return cached[1]
+    return None
+
+
+def forget_cached_analyses():
+    """Drop every cached analysis (e.g. after the command filter table changed)"""
+    with _analysis_cache_lock:
+        _analysis_cache.clear()
+
+
+def analysis_is_current(analysis):
+    """True if analysis was made with the active command filter table"""
+    return analysis.get('command_filter') == active_filter().to_dict()
+
+
+def analyze_file(filepath, chunk_size=CHUNK_SIZE):
+    """Analyse a file already on disk (one sequential read) unless its analysis is cached"""
+    cached = get_cached_analysis(filepath)
+    if cached:
+        return cached
+    analyzer = StreamingUploadAnalyzer(compression_for(filepath))
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            analyzer.feed(chunk)
+    return record_analysis(filepath, analyzer)
+
+
+def save_upload_stream(stream, dest_path, chunk_size=CHUNK_SIZE):
+    """
+    Copy a readable stream to dest_path while analysing it in the same pass.
+    Data is written to a temporary file and moved into place only once complete.
+    A .gcode.gz / .gcode.zst dest_path is stored compressed as received.
+    Returns the analysis dict.
+    """
+    analyzer = StreamingUploadAnalyzer(compression_for(dest_path))
+    part_path = dest_path + '.part'
+    try:
+        with open(part_path, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                analyzer.feed(chunk)
+        os.replace(part_path, dest_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    return record_analysis(dest_path, analyzer)
+
+
+def compress_at_rest(src_path, method='gzip', chunk_size=CHUNK_SIZE):
+    """
+    Replace a plain G-code file with a framed compressed copy (<name>.gz or <name>.zst),
+    analysing the compressed output as it is written. Returns (new_path, analysis).
+    """
+    suffix = {'gzip': '.gz', 'zstd': '.zst'}[method]
+    dest_path = src_path + suffix
+    part_path = dest_path + '.part'
+    compressor = FrameCompressor(method)
+    analyzer = StreamingUploadAnalyzer(method)
+    try:
+        with open(src_path, 'rb') as src, open(part_path, 'wb') as out:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                frames = compressor.compress(chunk)
+                if frames:
+                    out.write(frames)
+                    analyzer.feed(frames)
+            frames = compressor.flush()
+            out.write(frames)
+            analyzer.feed(frames)
+        os.replace(part_path, dest_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.remove(src_path)
+
+    analysis = record_analysis(dest_path, analyzer)
+    logger.info(f"Compressed {os.path.basename(src_path)} at rest: {analysis['content_size']} -> "
+                f"{analysis['size']} bytes in {len(analysis['frames'])} frames")
+    return dest_path, analysis
+
+
+def record_analysis(dest_path, analyzer):
+    """Finish an analyzer for a file that is now in place and cache everything it derived"""
+    analysis, index = analyzer.finish()
+    store_index(dest_path, index)
+    stat = os.stat(dest_path)
+    with _analysis_cache_lock:
+        path = os.path.abspath(dest_path)
+        _analysis_cache[path] = ((stat.st_size, stat.st_mtime_ns), analysis)
+        _analysis_cache.move_to_end(path)
+        while len(_analysis_cache) > MAX_CACHED_ANALYSES:
+            _analysis_cache.popitem(last=False)
+
+    if analysis['validation_issues']:
+        logger.warning(f"File validation issues in {os.path.basename(dest_path)}: "
+                       f"{analysis['validation_issues']} lines, first: {analysis['issues'][:5]}")
+    return analysis
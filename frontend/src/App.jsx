@@ -21,6 +21,7 @@ function App() {
     const [temperatures, setTemperatures] = useState(null);
     const [printStatus, setPrintStatus] = useState({ status: 'idle' });
     const [gcode, setGcode] = useState('');
+    const [viewedFile, setViewedFile] = useState('');
     const [currentPosition, setCurrentPosition] = useState({ x: 0, y: 0, z: 0, e: 0 });
     const [settings, setSettings] = useState({
         enableTemperaturePanel: true,
@@ -151,7 +152,8 @@ function App() {
                                 filename: data.filename,
                                 current_line: data.current_line,
                                 total_lines: data.total_lines,
-                                is_paused: data.is_paused
+                                is_paused: data.is_paused,
+                                position: data.position
                             });
                         } else if (data.status === 'connected') {
                             // Use a functional update to avoid stale state for printStatus
@@ -183,13 +185,13 @@ function App() {
         try {
             const data = await handleApiCall('/api/connect', {
                 method: 'POST',
-                body: JSON.stringify({ port: selectedPort, baud_rate: parseInt(baudRate) })
+                body: JSON.stringify({ port: selectedPort, baud_rate: baudRate === 'auto' ? 'auto' : parseInt(baudRate) })
             });
             
             if (data.status === 'success') {
                 setIsConnected(true);
-                setPort(selectedPort);
-                setLog(prev => [...prev, `${timestamp} - Connected to ${selectedPort} at ${baudRate} baud`]);
+                setPort(data.port || selectedPort);
+                setLog(prev => [...prev, `${timestamp} - Connected to ${data.port || selectedPort} at ${data.baud_rate || baudRate} baud`]);
             } else {
                 throw new Error(data.message || 'Connection failed');
             }
@@ -265,6 +267,7 @@ function App() {
             if (response.ok) {
                 const content = await response.text();
                 setGcode(content);
+                setViewedFile(filename);
                 setLog(prev => [...prev, `${timestamp} - Loaded ${filename} for viewing`]);
             }
         } catch (error) {
@@ -459,7 +462,10 @@ function App() {
                             backgroundColor: 'rgba(255, 255, 255, 0.98)',
                             minHeight: '400px'
                         }}>
-                            <GcodeViewer gcode={gcode} />
+                            <GcodeViewer 
+                                gcode={gcode}
+                                livePosition={printStatus.filename === viewedFile ? printStatus.position : null}
+                            />
                         </div>
                     </div>
                 </div>
@@ -89,6 +89,7 @@ export default function Connection({ port, setPort, isConnected, onConnect, onDi
                                 style={{ backgroundColor: isConnected ? '#e9f5e9' : 'white', fontWeight: '500' }}
                             >
                                 <option value="">{isDetectingPorts ? 'Scanning...' : 'Select Port'}</option>
+                                <option value="auto">Auto-detect</option>
                                 {availablePorts.map(p => (
                                     <option key={p.port} value={p.port}>
                                         {p.port} {p.is_printer ? `(${p.description})` : ''}
@@ -121,6 +122,7 @@ export default function Connection({ port, setPort, isConnected, onConnect, onDi
                                 disabled={isConnected || isConnecting}
                                 style={{ backgroundColor: isConnected ? '#e9f5e9' : 'white', fontWeight: '500' }}
                             >
+                                <option value="auto">Auto-detect</option>
                                 <option value="115200">115200 (Recommended)</option>
                                 <option value="250000">250000 (Fast)</option>
                                 <option value="57600">57600</option>
@@ -1,18 +1,89 @@
 // frontend/src/components/FileManager.jsx - Production Version with View functionality
 import React, { useState, useEffect } from 'react';
+import { Sha256 } from '../sha256';
+
+const API_BASE = 'http://127.0.0.1:5000';
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024; // Larger files use resumable chunked uploads
+const CHUNK_RETRIES = 5;
+
+const sha256Hex = async (buffer) => {
+    // crypto.subtle is only available in secure contexts (localhost / https)
+    if (!window.crypto || !window.crypto.subtle) return null;
+    const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
+const formatDuration = (seconds) => {
+    if (seconds == null) return null;
+    const hours = Math.floor(seconds / 3600);
+    const minutes = Math.round((seconds % 3600) / 60);
+    return hours > 0 ? `${hours}h ${minutes}m` : `${minutes}m`;
+};
+
+const formatSize = (bytes) => (bytes >= 1024 * 1024
+    ? `${(bytes / (1024 * 1024)).toFixed(1)} MB`
+    : `${(bytes / 1024).toFixed(0)} KB`);
+
+// Whole-file SHA-256 read slice by slice, so large files are never loaded at once
+const hashFile = async (file, sliceSize = 4 * 1024 * 1024) => {
+    const hash = new Sha256();
+    for (let offset = 0; offset < file.size; offset += sliceSize) {
+        hash.update(await file.slice(offset, offset + sliceSize).arrayBuffer());
+    }
+    return hash.hex();
+};
+
+// Links content the backend already stores by its hash; null when it has to be uploaded
+const uploadByHash = async (file, digest) => {
+    const known = await fetch(`${API_BASE}/api/upload/by-hash`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, sha256: digest })
+    });
+    return known.ok ? { response: known, data: await known.json() } : null;
+};
+
+const putChunkWithRetry = async (uploadId, offset, buffer) => {
+    const digest = await sha256Hex(buffer);
+    for (let attempt = 1; ; attempt++) {
+        let response;
+        try {
+            response = await fetch(`${API_BASE}/api/uploads/${uploadId}?offset=${offset}`, {
+                method: 'PUT',
+                headers: digest ? { 'X-Chunk-SHA256': digest } : {},
+                body: buffer
+            });
+        } catch (err) {
+            // Network drop: back off and resend the same chunk
+            if (attempt >= CHUNK_RETRIES) throw err;
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+            continue;
+        }
+        if (response.ok) return;
+        const data = await response.json().catch(() => ({}));
+        if (response.status < 500 || attempt >= CHUNK_RETRIES) {
+            throw new Error(data.message || `Chunk upload failed (${response.status})`);
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+    }
+};
 
 export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
     const [files, setFiles] = useState([]);
+    const [catalog, setCatalog] = useState({});
     const [selectedFile, setSelectedFile] = useState(null);
     const [uploading, setUploading] = useState(false);
     const [error, setError] = useState('');
+    const [uploadProgress, setUploadProgress] = useState(null);
 
     const fetchFiles = async () => {
         try {
-            const response = await fetch('http://127.0.0.1:5000/api/files');
+            // no-cache revalidates with the catalog ETag, so unchanged listings cost a 304
+            const response = await fetch(`${API_BASE}/api/files`, { cache: 'no-cache' });
             if (response.ok) {
                 const data = await response.json();
                 setFiles(data.files || []);
+                setCatalog(Object.fromEntries((data.catalog || []).map(entry => [entry.name, entry])));
                 setError('');
             } else {
                 throw new Error('Failed to fetch files');
@@ -28,39 +99,98 @@ export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
         fetchFiles();
     }, [isConnected]);
 
+    // Resumable upload: picks up the missing ranges of an earlier attempt of the same file
+    const uploadChunked = async (file) => {
+        const resumeKey = `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+        let uploadId = localStorage.getItem(resumeKey);
+        let chunkSize = 4 * 1024 * 1024;
+        let missing = null;
+
+        if (uploadId) {
+            const response = await fetch(`${API_BASE}/api/uploads/${uploadId}`);
+            if (response.ok) {
+                missing = (await response.json()).missing_ranges;
+            } else {
+                uploadId = null;
+            }
+        }
+        if (!uploadId) {
+            // Known content is linked without a transfer; otherwise finalize checks the whole file against it
+            const digest = await hashFile(file);
+            const linked = await uploadByHash(file, digest);
+            if (linked) return linked;
+            const response = await fetch(`${API_BASE}/api/uploads`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size, sha256: digest })
+            });
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.message || 'Upload initiation failed');
+            uploadId = data.upload_id;
+            chunkSize = data.chunk_size;
+            missing = [[0, file.size]];
+            localStorage.setItem(resumeKey, uploadId);
+        }
+
+        let remaining = missing.reduce((total, [start, end]) => total + (end - start), 0);
+        for (const [start, end] of missing) {
+            for (let offset = start; offset < end; offset += chunkSize) {
+                const buffer = await file.slice(offset, Math.min(offset + chunkSize, end)).arrayBuffer();
+                await putChunkWithRetry(uploadId, offset, buffer);
+                remaining -= buffer.byteLength;
+                setUploadProgress(Math.round(((file.size - remaining) / file.size) * 100));
+            }
+        }
+
+        const response = await fetch(`${API_BASE}/api/uploads/${uploadId}/finalize`, { method: 'POST' });
+        const data = await response.json();
+        localStorage.removeItem(resumeKey);
+        return { response, data };
+    };
+
+    const uploadStreamed = async (file) => {
+        // Content the backend already stores is linked by hash without sending the file
+        const digest = await sha256Hex(await file.arrayBuffer());
+        if (digest) {
+            const linked = await uploadByHash(file, digest);
+            if (linked) return linked;
+        }
+
+        // Stream the raw file body; the backend hashes and analyses it while saving
+        const response = await fetch(`${API_BASE}/api/upload/stream/${encodeURIComponent(file.name)}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file
+        });
+        const data = await response.json();
+        return { response, data };
+    };
+
     const handleUpload = async (event) => {
         const file = event.target.files[0];
         if (!file) return;
 
         // Validate file type
-        if (!file.name.toLowerCase().endsWith('.gcode') && !file.name.toLowerCase().endsWith('.gco')) {
-            setError('Only G-code files (.gcode, .gco) are allowed');
-            return;
-        }
-
-        // Validate file size (50MB limit)
-        if (file.size > 50 * 1024 * 1024) {
-            setError('File too large (max 50MB)');
+        if (!/\.(gcode|gco|gcode\.gz|gcode\.zst)$/i.test(file.name)) {
+            setError('Only G-code files (.gcode, .gco, .gcode.gz, .gcode.zst) are allowed');
             return;
         }
 
         setUploading(true);
+        setUploadProgress(null);
         setError('');
         
         try {
-            const formData = new FormData();
-            formData.append('file', file);
-            
-            const response = await fetch('http://127.0.0.1:5000/api/upload', {
-                method: 'POST',
-                body: formData
-            });
-            
-            const data = await response.json();
+            const { response, data } = file.size > CHUNKED_UPLOAD_THRESHOLD
+                ? await uploadChunked(file)
+                : await uploadStreamed(file);
             
             if (response.ok && data.status === 'success') {
                 await fetchFiles(); // Refresh the file list
                 event.target.value = ''; // Clear the input
+                if (data.analysis && data.analysis.validation_issues > 0) {
+                    setError(`Uploaded with ${data.analysis.validation_issues} potentially problematic lines`);
+                }
             } else {
                 setError(data.message || 'Upload failed');
             }
@@ -69,6 +199,7 @@ export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
             console.error('Upload error:', err);
         } finally {
             setUploading(false);
+            setUploadProgress(null);
         }
     };
 
@@ -112,14 +243,14 @@ export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
                             className="form-control border-end-0" 
                             onChange={handleUpload} 
                             disabled={!isConnected || uploading}
-                            accept=".gcode,.gco"
+                            accept=".gcode,.gco,.gz,.zst"
                             style={{ borderRadius: '8px 0 0 8px' }}
                         />
                         <span className="input-group-text bg-primary text-white border-0" style={{ borderRadius: '0 8px 8px 0' }}>
                             <i className="bi bi-file-earmark-arrow-up"></i>
                         </span>
                     </div>
-                    <small className="text-muted">Supported formats: .gcode, .gco (max 50MB)</small>
+                    <small className="text-muted">Supported formats: .gcode, .gco, .gcode.gz, .gcode.zst (large files upload in resumable chunks)</small>
                 </div>
                 
                 {/* Files List */}
@@ -139,9 +270,20 @@ export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
                                 >
                                     <div className="d-flex align-items-center">
                                         <i className={`bi ${selectedFile === file ? 'bi-file-earmark-check-fill text-primary' : 'bi-file-earmark-code'} me-2`}></i>
-                                        <span className={`${selectedFile === file ? 'fw-semibold text-primary' : ''}`} style={{ fontSize: '0.9rem' }}>
-                                            {file}
-                                        </span>
+                                        <div>
+                                            <span className={`${selectedFile === file ? 'fw-semibold text-primary' : ''}`} style={{ fontSize: '0.9rem' }}>
+                                                {file}
+                                            </span>
+                                            {catalog[file] && (
+                                                <small className="d-block text-muted" style={{ fontSize: '0.7rem' }}>
+                                                    {formatSize(catalog[file].size)}
+                                                    {catalog[file].estimated_time != null && ` • ${formatDuration(catalog[file].estimated_time)}`}
+                                                    {catalog[file].filament_mm != null && ` • ${(catalog[file].filament_mm / 1000).toFixed(2)} m`}
+                                                    {catalog[file].layer_count != null && ` • ${catalog[file].layer_count} layers`}
+                                                    {catalog[file].has_thumbnail && <i className="bi bi-image ms-1" title="Has thumbnail"></i>}
+                                                </small>
+                                            )}
+                                        </div>
                                     </div>
                                     <button 
                                         className="btn btn-outline-info btn-sm" 
@@ -177,7 +319,7 @@ export default function FileManager({ isConnected, onStartPrint, onViewFile }) {
                         {uploading ? (
                             <>
                                 <span className="spinner-border spinner-border-sm me-2" role="status"></span>
-                                Uploading...
+                                Uploading{uploadProgress != null ? ` ${uploadProgress}%` : '...'}
                             </>
                         ) : (
                             <>
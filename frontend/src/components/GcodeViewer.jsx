@@ -4,7 +4,7 @@ import React, { useState, Suspense, lazy } from 'react';
 // Use lazy loading for the 3D viewer to improve initial load performance
 const GcodeViewer3D = lazy(() => import('./GcodeViewer3D'));
 
-export default function GcodeViewer({ gcode }) {
+export default function GcodeViewer({ gcode, livePosition }) {
     const [viewMode, setViewMode] = useState('text');
     const [loadingSample, setLoadingSample] = useState(false);
     const [isCollapsed, setIsCollapsed] = useState(false);
@@ -144,7 +144,7 @@ export default function GcodeViewer({ gcode }) {
                                 </div>
                             </div>
                         }>
-                            <GcodeViewer3D gcode={gcode} />
+                            <GcodeViewer3D gcode={gcode} livePosition={livePosition} />
                         </Suspense>
                     )}
                 </div>
@@ -47,7 +47,7 @@ const parseGcode = (gcodeText) => {
 };
 
 // Interactive Canvas-based 3D/2D renderer with full 360-degree rotation
-const InteractiveCanvasRenderer = ({ moves, simulationProgress, viewMode }) => {
+const InteractiveCanvasRenderer = ({ moves, simulationProgress, liveSegment, viewMode }) => {
     const canvasRef = useRef(null);
     const [transform, setTransform] = useState({
         scale: 1,
@@ -497,15 +497,21 @@ const InteractiveCanvasRenderer = ({ moves, simulationProgress, viewMode }) => {
         }
         
         // Draw toolpath
-        const progressIndex = Math.floor(simulationProgress * moves.length);
+        // Live segment index comes from the backend's line -> segment index
+        const progressIndex = liveSegment != null
+            ? liveSegment + 1
+            : Math.floor(simulationProgress * moves.length);
         
         sortedMoves.forEach(({ move, index }) => {
             const isCompleted = index < progressIndex;
+            const isCurrent = liveSegment != null && index === liveSegment;
             const isExtrusion = move.isExtrusion;
             
             // Color based on height in 3D mode
             let strokeColor;
-            if (isCompleted) {
+            if (isCurrent) {
+                strokeColor = '#dc3545';
+            } else if (isCompleted) {
                 strokeColor = '#0066cc';
             } else if (viewMode === '3D' && isExtrusion) {
                 const heightRatio = (move.from.z - minZ) / (rangeZ || 1);
@@ -516,7 +522,7 @@ const InteractiveCanvasRenderer = ({ moves, simulationProgress, viewMode }) => {
             }
             
             ctx.strokeStyle = strokeColor;
-            ctx.lineWidth = isExtrusion ? 2 : 1;
+            ctx.lineWidth = isCurrent ? 4 : (isExtrusion ? 2 : 1);
             
             let fromX, fromY, toX, toY;
             
@@ -616,7 +622,7 @@ const InteractiveCanvasRenderer = ({ moves, simulationProgress, viewMode }) => {
             ctx.fillText('Z', 35, rect.height - 5);
         }
         
-    }, [moves, simulationProgress, transform, viewMode]);
+    }, [moves, simulationProgress, liveSegment, transform, viewMode]);
     
     // Cleanup effect for animation frames
     useEffect(() => {
@@ -743,7 +749,7 @@ const InteractiveCanvasRenderer = ({ moves, simulationProgress, viewMode }) => {
 };
 
 // Main 3D viewer component
-export default function GcodeViewer3D({ gcode }) {
+export default function GcodeViewer3D({ gcode, livePosition }) {
     const [moves, setMoves] = useState([]);
     const [isLoading, setIsLoading] = useState(false);
     const [simulationProgress, setSimulationProgress] = useState(0);
@@ -753,6 +759,13 @@ export default function GcodeViewer3D({ gcode }) {
     const [showLayers, setShowLayers] = useState(false);
     const [selectedLayer, setSelectedLayer] = useState(null);
     
+    // Real print progress published by the backend overrides the simulation
+    const liveSegment = livePosition && livePosition.segment >= 0 && livePosition.segment < moves.length
+        ? livePosition.segment
+        : null;
+    const isLive = liveSegment != null;
+    const displayProgress = isLive ? (liveSegment + 1) / moves.length : simulationProgress;
+    
     // Parse G-code when it changes
     useEffect(() => {
         if (!gcode) {
@@ -788,7 +801,7 @@ export default function GcodeViewer3D({ gcode }) {
     useEffect(() => {
         let interval;
         
-        if (isSimulating && moves.length > 0) {
+        if (isSimulating && !isLive && moves.length > 0) {
             interval = setInterval(() => {
                 setSimulationProgress(prev => {
                     const newProgress = prev + 0.01; // 1% per update
@@ -804,7 +817,7 @@ export default function GcodeViewer3D({ gcode }) {
         return () => {
             if (interval) clearInterval(interval);
         };
-    }, [isSimulating, moves.length]);
+    }, [isSimulating, isLive, moves.length]);
     
     const startSimulation = () => {
         setSimulationProgress(0);
@@ -868,7 +881,7 @@ export default function GcodeViewer3D({ gcode }) {
                                 <button 
                                     className="btn btn-sm btn-success"
                                     onClick={startSimulation}
-                                    disabled={isSimulating}
+                                    disabled={isSimulating || isLive}
                                 >
                                     <i className="bi bi-play-fill"></i>
                                 </button>
@@ -893,7 +906,9 @@ export default function GcodeViewer3D({ gcode }) {
                         <div className="d-flex align-items-center gap-3 justify-content-end">
                             {/* Progress Display */}
                             <small className="text-muted">
-                                Progress: {Math.round(simulationProgress * 100)}%
+                                {isLive
+                                    ? `Live: layer ${livePosition.layer + 1}/${livePosition.total_layers} • line ${livePosition.line}`
+                                    : `Progress: ${Math.round(simulationProgress * 100)}%`}
                             </small>
                             
                             {/* Stats */}
@@ -908,7 +923,7 @@ export default function GcodeViewer3D({ gcode }) {
                 <div className="progress mt-2" style={{ height: '4px' }}>
                     <div 
                         className="progress-bar bg-primary" 
-                        style={{ width: `${simulationProgress * 100}%` }}
+                        style={{ width: `${displayProgress * 100}%` }}
                     ></div>
                 </div>
             </div>
@@ -918,6 +933,7 @@ export default function GcodeViewer3D({ gcode }) {
                 <InteractiveCanvasRenderer 
                     moves={moves}
                     simulationProgress={simulationProgress}
+                    liveSegment={liveSegment}
                     viewMode={viewMode}
                 />
             </div>
@@ -932,7 +948,7 @@ export default function GcodeViewer3D({ gcode }) {
                         <span className="badge bg-dark me-1">Dark</span> Extrusion moves
                     </div>
                     <div className="col-md-3 col-6">
-                        <span className="badge bg-primary me-1">Blue</span> Simulated progress
+                        <span className="badge bg-primary me-1">Blue</span> {isLive ? 'Printed (live)' : 'Simulated progress'}
                     </div>
                     <div className="col-md-3 col-6">
                         {viewMode === '3D' && <span className="badge bg-info me-1">Color</span>}